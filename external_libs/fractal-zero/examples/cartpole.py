@@ -1,6 +1,8 @@
+from functools import partial
 import gym
 
 from fractal_zero.config import FMCConfig, FractalZeroConfig
+from fractal_zero.data.actor_pool import ActorPool
 from fractal_zero.data.data_handler import DataHandler
 from fractal_zero.fractal_zero import FractalZero
 
@@ -66,6 +68,49 @@ def get_cartpole_config(
     )
 
 
+def train_cartpole_with_actors(alphazero_style: bool, use_wandb: bool, num_actors: int = None):
+    """Same as `train_cartpole`, but the training games are played by an `ActorPool` while the learner trains."""
+
+    env = gym.make("CartPole-v0")
+    config = get_cartpole_config(env, alphazero_style, use_wandb)
+
+    train_batches = 2
+    sync_weights_every = 4
+
+    config.joint_model = config.joint_model.to(config.device)
+
+    data_handler = DataHandler(config)
+    fractal_zero = FractalZero(config)
+    trainer = FractalZeroTrainer(fractal_zero, data_handler)
+
+    pool = ActorPool(
+        partial(FractalZero, config),
+        num_actors=num_actors,
+        model=fractal_zero.model,
+        weight_sync_interval=sync_weights_every,
+    )
+
+    try:
+        num_games = 0
+        with tqdm(desc="Playing games and training", total=config.num_games) as pbar:
+            while num_games < config.num_games:
+                # only blocks until the first game is available, after that the learner never waits.
+                new_games = pool.fill_replay_buffer(
+                    data_handler.replay_buffer, min_episodes=1 if num_games == 0 else 0
+                )
+                num_games += new_games
+                pbar.update(new_games)
+
+                for _ in range(train_batches):
+                    trainer.train_step()
+                    pool.step(fractal_zero.model)
+
+                if config.use_wandb:
+                    wandb.log(pool.get_stats(), commit=False)
+    finally:
+        pool.close()
+
+
 def train_cartpole(alphazero_style: bool, use_wandb: bool):
     env = gym.make("CartPole-v0")
     config = get_cartpole_config(env, alphazero_style, use_wandb)
@@ -0,0 +1,287 @@
+from typing import List
+import gym
+import numpy as np
+import torch
+
+from fractal_zero.vectorized_environment import VectorizedEnvironment
+
+
+class BatchedClassicControlEnvironment(VectorizedEnvironment):
+    """A classic control environment where the state of all walkers is held in a single `(walkers, state_size)` array,
+    so stepping, cloning and resetting are a handful of array operations instead of one `gym.Env` per walker.
+
+    Mirrors the gym environment (with its `TimeLimit`) step for step, subclasses implement the dynamics. Unlike
+    `SerialVectorizedEnvironment`, infos are always empty.
+    """
+
+    env_id: str
+    state_size: int
+
+    # per walker arrays, these are cloned/snapshotted along with the walkers.
+    _walker_arrays = ("states", "elapsed_steps", "dones", "observations")
+
+    def __init__(self, n: int, env_id: str = None, seed: int = None):
+        env_id = env_id if env_id else self.env_id
+        super().__init__(env_id, n)
+
+        self.env_id = env_id
+        self.max_episode_steps = gym.spec(env_id).max_episode_steps
+        self.num_actions = self._action_space.n
+        self.rng = np.random.default_rng(seed)
+
+        self.states = np.zeros((n, self.state_size), dtype=float)
+        self.elapsed_steps = np.zeros(n, dtype=np.int64)
+        self.dones = np.zeros(n, dtype=bool)
+        self.observations = self._get_observations(self.states)
+
+    def _reset_state(self) -> np.ndarray:
+        raise NotImplementedError
+
+    def _step_states(self, states: np.ndarray, actions: np.ndarray):
+        """Returns the new states, rewards and terminal mask (not including the time limit)."""
+        raise NotImplementedError
+
+    def _get_observations(self, states: np.ndarray) -> np.ndarray:
+        return states.astype(np.float32)
+
+    def _get_env_state(self, env: gym.Env) -> np.ndarray:
+        return np.asarray(env.unwrapped.state, dtype=float)
+
+    def _set_all(self, state: np.ndarray, elapsed_steps: int = 0):
+        self.states[:] = state
+        self.elapsed_steps[:] = elapsed_steps
+        self.dones[:] = False
+        self.observations = self._get_observations(self.states)
+
+    def batch_reset(self, *args, **kwargs):
+        # all walkers start from the same root.
+        self._set_all(self._reset_state())
+        return self.observations.copy()
+
+    def set_all_states(self, new_env: gym.Env, observation: np.ndarray):
+        self._set_all(self._get_env_state(new_env), getattr(new_env, "_elapsed_steps", 0))
+
+    def _on_step(self, active: np.ndarray, terminal: np.ndarray):
+        pass
+
+    def _encode(self, rewards: np.ndarray):
+        return (
+            torch.from_numpy(self.observations.copy()),
+            self.observations.copy(),
+            torch.from_numpy(rewards),
+            torch.from_numpy(self.dones.copy()),
+            [{} for _ in range(self.n)],
+        )
+
+    def batch_step(self, actions, frozen_mask):
+        assert len(actions) == self.n
+
+        actions = np.asarray(actions, dtype=np.int64)
+        active = ~np.asarray(frozen_mask, dtype=bool)
+
+        new_states, rewards, terminal = self._step_states(self.states, actions)
+        elapsed_steps = self.elapsed_steps + 1
+        dones = np.logical_or(terminal, elapsed_steps >= self.max_episode_steps)
+
+        self.states = np.where(active[:, None], new_states, self.states)
+        self.elapsed_steps = np.where(active, elapsed_steps, self.elapsed_steps)
+        self.dones = np.where(active, dones, self.dones)
+        self.observations = np.where(active[:, None], self._get_observations(new_states), self.observations)
+        self._on_step(active, terminal)
+
+        # frozen walkers don't step, they return their previous observation with 0 reward.
+        return self._encode(np.where(active, rewards, 0.0))
+
+    def clone(self, partners, clone_mask):
+        if isinstance(partners, torch.Tensor):
+            partners = partners.cpu().numpy()
+        if isinstance(clone_mask, torch.Tensor):
+            clone_mask = clone_mask.cpu().numpy()
+
+        sources = np.where(clone_mask, partners, np.arange(self.n))
+        for attr in self._walker_arrays:
+            setattr(self, attr, getattr(self, attr)[sources])
+
+    def get_snapshots(self, walkers: List[int]) -> List:
+        return [{attr: np.copy(getattr(self, attr)[walker]) for attr in self._walker_arrays} for walker in walkers]
+
+    def restore_snapshots(self, assignments: dict):
+        for walker, snapshot in assignments.items():
+            for attr, value in snapshot.items():
+                getattr(self, attr)[walker] = value
+
+    def batched_action_space_sample(self):
+        return self.rng.integers(0, self.num_actions, size=self.n)
+
+
+class BatchedCartPole(BatchedClassicControlEnvironment):
+    env_id = "CartPole-v0"
+    state_size = 4
+
+    _walker_arrays = BatchedClassicControlEnvironment._walker_arrays + ("steps_beyond_done",)
+
+    gravity = 9.8
+    masscart = 1.0
+    masspole = 0.1
+    total_mass = masspole + masscart
+    length = 0.5
+    polemass_length = masspole * length
+    force_mag = 10.0
+    tau = 0.02
+    theta_threshold_radians = 12 * 2 * np.pi / 360
+    x_threshold = 2.4
+
+    def __init__(self, n: int, env_id: str = None, seed: int = None):
+        # -1 means the pole hasn't fallen yet (`None` in gym).
+        self.steps_beyond_done = np.full(n, -1, dtype=np.int64)
+        super().__init__(n, env_id=env_id, seed=seed)
+
+    def _set_all(self, state: np.ndarray, elapsed_steps: int = 0):
+        super()._set_all(state, elapsed_steps)
+        self.steps_beyond_done[:] = -1
+
+    def set_all_states(self, new_env: gym.Env, observation: np.ndarray):
+        super().set_all_states(new_env, observation)
+        steps_beyond_done = new_env.unwrapped.steps_beyond_done
+        self.steps_beyond_done[:] = -1 if steps_beyond_done is None else steps_beyond_done
+
+    def _reset_state(self):
+        return self.rng.uniform(low=-0.05, high=0.05, size=(4,))
+
+    def _step_states(self, states, actions):
+        x, x_dot, theta, theta_dot = states.T
+        force = np.where(actions == 1, self.force_mag, -self.force_mag)
+        costheta = np.cos(theta)
+        sintheta = np.sin(theta)
+
+        temp = (force + self.polemass_length * theta_dot**2 * sintheta) / self.total_mass
+        thetaacc = (self.gravity * sintheta - costheta * temp) / (
+            self.length * (4.0 / 3.0 - self.masspole * costheta**2 / self.total_mass)
+        )
+        xacc = temp - self.polemass_length * thetaacc * costheta / self.total_mass
+
+        # euler
+        x = x + self.tau * x_dot
+        x_dot = x_dot + self.tau * xacc
+        theta = theta + self.tau * theta_dot
+        theta_dot = theta_dot + self.tau * thetaacc
+
+        terminal = (
+            (x < -self.x_threshold)
+            | (x > self.x_threshold)
+            | (theta < -self.theta_threshold_radians)
+            | (theta > self.theta_threshold_radians)
+        )
+
+        # the step where the pole falls is still rewarded, the ones after it aren't.
+        rewards = np.where(terminal & (self.steps_beyond_done >= 0), 0.0, 1.0)
+        return np.stack((x, x_dot, theta, theta_dot), axis=1), rewards, terminal
+
+    def _on_step(self, active: np.ndarray, terminal: np.ndarray):
+        self.steps_beyond_done = np.where(active & terminal, self.steps_beyond_done + 1, self.steps_beyond_done)
+
+
+class BatchedAcrobot(BatchedClassicControlEnvironment):
+    env_id = "Acrobot-v1"
+    state_size = 4
+
+    dt = 0.2
+    link_length_1 = 1.0
+    link_mass_1 = 1.0
+    link_mass_2 = 1.0
+    link_com_pos_1 = 0.5
+    link_com_pos_2 = 0.5
+    link_moi = 1.0
+    max_vel_1 = 4 * np.pi
+    max_vel_2 = 9 * np.pi
+    available_torque = np.array([-1.0, 0.0, 1.0])
+
+    def _reset_state(self):
+        return self.rng.uniform(low=-0.1, high=0.1, size=(4,)).astype(np.float32)
+
+    def _dsdt(self, s, torque):
+        # "book" dynamics (gym's default).
+        m1, m2 = self.link_mass_1, self.link_mass_2
+        l1, lc1, lc2 = self.link_length_1, self.link_com_pos_1, self.link_com_pos_2
+        I1 = I2 = self.link_moi
+        g = 9.8
+
+        theta1, theta2, dtheta1, dtheta2 = s.T
+
+        d1 = m1 * lc1**2 + m2 * (l1**2 + lc2**2 + 2 * l1 * lc2 * np.cos(theta2)) + I1 + I2
+        d2 = m2 * (lc2**2 + l1 * lc2 * np.cos(theta2)) + I2
+        phi2 = m2 * lc2 * g * np.cos(theta1 + theta2 - np.pi / 2.0)
+        phi1 = (
+            -m2 * l1 * lc2 * dtheta2**2 * np.sin(theta2)
+            - 2 * m2 * l1 * lc2 * dtheta2 * dtheta1 * np.sin(theta2)
+            + (m1 * lc1 + m2 * l1) * g * np.cos(theta1 - np.pi / 2)
+            + phi2
+        )
+        ddtheta2 = (torque + d2 / d1 * phi1 - m2 * l1 * lc2 * dtheta1**2 * np.sin(theta2) - phi2) / (
+            m2 * lc2**2 + I2 - d2**2 / d1
+        )
+        ddtheta1 = -(d2 * ddtheta2 + phi1) / d1
+        return np.stack((dtheta1, dtheta2, ddtheta1, ddtheta2), axis=1)
+
+    def _step_states(self, states, actions):
+        torque = self.available_torque[actions]
+
+        # single rk4 step of size dt.
+        dt, dt2 = self.dt, self.dt / 2.0
+        k1 = self._dsdt(states, torque)
+        k2 = self._dsdt(states + dt2 * k1, torque)
+        k3 = self._dsdt(states + dt2 * k2, torque)
+        k4 = self._dsdt(states + dt * k3, torque)
+        ns = states + dt / 6.0 * (k1 + 2 * k2 + 2 * k3 + k4)
+
+        # the velocities are bounded, so the angles never need to wrap more than once.
+        angles = ns[:, :2]
+        angles = np.where(angles > np.pi, angles - 2 * np.pi, angles)
+        angles = np.where(angles < -np.pi, angles + 2 * np.pi, angles)
+        ns = np.stack(
+            (
+                angles[:, 0],
+                angles[:, 1],
+                np.clip(ns[:, 2], -self.max_vel_1, self.max_vel_1),
+                np.clip(ns[:, 3], -self.max_vel_2, self.max_vel_2),
+            ),
+            axis=1,
+        )
+
+        terminal = -np.cos(ns[:, 0]) - np.cos(ns[:, 1] + ns[:, 0]) > 1.0
+        rewards = np.where(terminal, 0.0, -1.0)
+        return ns, rewards, terminal
+
+    def _get_observations(self, states):
+        theta1, theta2, dtheta1, dtheta2 = states.T
+        return np.stack(
+            (np.cos(theta1), np.sin(theta1), np.cos(theta2), np.sin(theta2), dtheta1, dtheta2), axis=1
+        ).astype(np.float32)
+
+
+class BatchedMountainCar(BatchedClassicControlEnvironment):
+    env_id = "MountainCar-v0"
+    state_size = 2
+
+    min_position = -1.2
+    max_position = 0.6
+    max_speed = 0.07
+    goal_position = 0.5
+    goal_velocity = 0
+    force = 0.001
+    gravity = 0.0025
+
+    def _reset_state(self):
+        return np.array([self.rng.uniform(low=-0.6, high=-0.4), 0])
+
+    def _step_states(self, states, actions):
+        position, velocity = states.T
+
+        velocity = velocity + (actions - 1) * self.force + np.cos(3 * position) * (-self.gravity)
+        velocity = np.clip(velocity, -self.max_speed, self.max_speed)
+        position = np.clip(position + velocity, self.min_position, self.max_position)
+        velocity = np.where((position == self.min_position) & (velocity < 0), 0.0, velocity)
+
+        terminal = (position >= self.goal_position) & (velocity >= self.goal_velocity)
+        rewards = np.full(len(states), -1.0)
+        return np.stack((position, velocity), axis=1), rewards, terminal
@@ -0,0 +1,211 @@
+import multiprocessing as mp
+import queue
+from time import perf_counter
+from typing import Callable, Dict, List
+
+import numpy as np
+import torch
+
+
+def _state_dict_to_numpy(model: torch.nn.Module) -> Dict[str, np.ndarray]:
+    # numpy arrays are sent through the pipes as plain bytes, tensors would go through torch's shared memory.
+    return {key: value.detach().cpu().numpy() for key, value in model.state_dict().items()}
+
+
+def _publish_latest(latest: mp.Queue, item):
+    # latest-only: replace whatever the actor hasn't picked up yet. the queue's feeder thread does the actual transfer,
+    # so this never waits on the actor.
+    while True:
+        try:
+            latest.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                latest.get_nowait()
+            except queue.Empty:
+                pass
+
+
+def _actor_worker(
+    make_actor: Callable,
+    weights: mp.Queue,
+    episodes: mp.Queue,
+    stop_event,
+    actor_index: int,
+    seed: int,
+    initial_weights,
+):
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+
+    actor = make_actor()
+    version, state_dict = initial_weights if initial_weights else (0, None)
+
+    while not stop_event.is_set():
+        # only the latest weights are ever queued.
+        try:
+            version, state_dict = weights.get_nowait()
+        except queue.Empty:
+            pass
+        if state_dict is not None:
+            actor.model.load_state_dict({key: torch.from_numpy(value) for key, value in state_dict.items()})
+            state_dict = None
+
+        episode = actor.play_episode()
+
+        while not stop_event.is_set():
+            try:
+                episodes.put((actor_index, version, episode), timeout=0.1)
+                break
+            except queue.Full:
+                continue
+
+
+class ActorPool:
+    """Plays episodes in `num_actors` worker processes while the learner trains, and streams them back.
+
+    `make_actor` is called once in each worker, it should return an object with a `model` (`torch.nn.Module`) that
+    receives the learner's weights, and a `play_episode()` method (ie. `FractalZero` or `ExpertDatasetGenerator`).
+    With the "spawn" start method, `make_actor` must be picklable (ie. a `functools.partial`, not a lambda).
+
+    The learner calls `step(model)` after each of its updates, which broadcasts the weights to all actors every
+    `weight_sync_interval` steps. Actors pick up new weights between episodes, each actor only ever has the latest
+    weights queued, so broadcasting never waits on busy actors.
+    """
+
+    def __init__(
+        self,
+        make_actor: Callable,
+        num_actors: int = None,
+        model: torch.nn.Module = None,
+        weight_sync_interval: int = 1,
+        max_queued_episodes: int = None,
+        start_method: str = None,
+    ):
+        self.num_actors = num_actors if num_actors else mp.cpu_count()
+        self.weight_sync_interval = weight_sync_interval
+
+        ctx = mp.get_context(start_method)
+
+        self.episodes = ctx.Queue(maxsize=max_queued_episodes if max_queued_episodes else 0)
+        self.stop_event = ctx.Event()
+
+        self.num_steps = 0
+        self.weight_version = 0
+
+        # the initial weights are handed to the workers directly, so no episode is played before they're loaded.
+        initial_weights = None
+        if model is not None:
+            self.weight_version += 1
+            initial_weights = (self.weight_version, _state_dict_to_numpy(model))
+
+        self.weight_queues = []
+        self.processes = []
+        seeds = np.random.randint(0, 2**31 - 1, size=self.num_actors)
+        for actor_index, seed in enumerate(seeds):
+            weights = ctx.Queue(maxsize=1)
+            process = ctx.Process(
+                target=_actor_worker,
+                args=(make_actor, weights, self.episodes, self.stop_event, actor_index, int(seed), initial_weights),
+                daemon=True,
+            )
+            process.start()
+
+            self.weight_queues.append(weights)
+            self.processes.append(process)
+
+        self.num_episodes = 0
+        self.total_staleness = 0
+        self.waiting_time = 0.0
+        self.start_time = perf_counter()
+
+        self.closed = False
+
+    def broadcast_weights(self, model: torch.nn.Module):
+        start = perf_counter()
+
+        self.weight_version += 1
+        weights = _state_dict_to_numpy(model)
+        for latest in self.weight_queues:
+            _publish_latest(latest, (self.weight_version, weights))
+
+        # any time spent here is time the learner isn't learning.
+        self.waiting_time += perf_counter() - start
+
+    def step(self, model: torch.nn.Module):
+        """Call after each learner update."""
+
+        self.num_steps += 1
+        if self.num_steps % self.weight_sync_interval == 0:
+            self.broadcast_weights(model)
+
+    def get_episodes(self, min_episodes: int = 0, timeout: float = None) -> List:
+        """Returns every episode that's been played so far, blocking until at least `min_episodes` are available.
+        Time spent blocking counts against the learner's utilisation.
+        """
+
+        episodes = []
+
+        start = perf_counter()
+        while len(episodes) < min_episodes:
+            try:
+                episodes.append(self.episodes.get(timeout=timeout))
+            except queue.Empty:
+                break
+        self.waiting_time += perf_counter() - start
+
+        while True:
+            try:
+                episodes.append(self.episodes.get_nowait())
+            except queue.Empty:
+                break
+
+        for _, version, _ in episodes:
+            self.total_staleness += self.weight_version - version
+        self.num_episodes += len(episodes)
+
+        return [episode for _, _, episode in episodes]
+
+    def fill_replay_buffer(self, replay_buffer, min_episodes: int = 1, timeout: float = None) -> int:
+        episodes = self.get_episodes(min_episodes=min_episodes, timeout=timeout)
+        for episode in episodes:
+            replay_buffer.append(episode)
+        return len(episodes)
+
+    def get_stats(self) -> dict:
+        elapsed = perf_counter() - self.start_time
+        return {
+            "actors/num_episodes": self.num_episodes,
+            "actors/episodes_per_second": self.num_episodes / elapsed,
+            # fraction of the time the learner wasn't blocked waiting on episodes.
+            "actors/learner_utilisation": 1 - self.waiting_time / elapsed,
+            # how many weight broadcasts behind the collected episodes were.
+            "actors/mean_weight_staleness": self.total_staleness / max(self.num_episodes, 1),
+        }
+
+    def close(self):
+        if self.closed:
+            return
+
+        self.stop_event.set()
+
+        # drain, otherwise workers blocked on a full queue (or its feeder thread) may never exit.
+        for process in self.processes:
+            while process.is_alive():
+                try:
+                    self.episodes.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            process.join()
+
+        # weights that were never picked up would keep the feeder threads (and this process) from exiting.
+        for latest in self.weight_queues:
+            latest.cancel_join_thread()
+            latest.close()
+        self.closed = True
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
@@ -16,7 +16,7 @@ class DataHandler:
         # TODO: expert dataset
 
     def get_batch(
-        self, num_frames: int
+        self, num_frames: int, return_mask: bool = False
     ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
         # TODO: a version of this that allows non-uniform numbers of frames per batch
 
@@ -29,39 +29,24 @@ class DataHandler:
         else:
             batch_size = self.config.max_batch_size
 
-        observations = np.zeros(
-            (batch_size, num_frames, *self.config.observation_shape), dtype=float
+        observations, actions, auxiliaries, values, mask = self.replay_buffer.sample_clips(
+            batch_size, num_frames
         )
-        actions = np.zeros(
-            (batch_size, num_frames, *self.config.action_shape), dtype=float
-        )
-        auxiliaries = np.zeros((batch_size, num_frames), dtype=float)
-        values = np.zeros((batch_size, num_frames), dtype=float)
-
-        total_empty_frames = 0
-        for i in range(batch_size):
-            (
-                gobservations,
-                gactions,
-                grewards,
-                gvalues,
-                num_empty_frames,
-            ) = self.replay_buffer.sample_game_clip(num_frames, pad_to_num_frames=True)
 
-            observations[i, :] = gobservations
-            actions[i] = np.expand_dims(
-                gactions, -1
-            )  # TODO: fix action shape to avoid this expanddims
-            auxiliaries[i] = grewards  # auxiliary is a generalization of reward.
-            values[i] = gvalues
-
-            total_empty_frames += num_empty_frames
+        # TODO: fix action shape to avoid this reshape
+        actions = actions.reshape(batch_size, num_frames, *self.config.action_shape)
+        total_empty_frames = int((~mask).sum())
 
         # TODO: put these on the correct device sooner?
-        return (
+        batch = (
             torch.tensor(observations, device=self.config.device).float(),
             torch.tensor(actions, device=self.config.device).float(),
+            # auxiliary is a generalization of reward.
             torch.tensor(auxiliaries, device=self.config.device).unsqueeze(-1).float(),
             torch.tensor(values, device=self.config.device).unsqueeze(-1).float(),
             total_empty_frames,
         )
+
+        if return_mask:
+            return (*batch, torch.tensor(mask, device=self.config.device))
+        return batch
@@ -51,6 +51,14 @@ class ExpertDatasetGenerator(ExpertDataset):
 
         return x, t
 
+    @property
+    def model(self):
+        return self.policy_model
+
+    def play_episode(self, max_steps: int = None):
+        # for `ActorPool`.
+        return self.sample_trajectory(max_steps)
+
     def sample_batch(self, num_trajectories: int, max_steps: int):
         observations = []
         actions = []
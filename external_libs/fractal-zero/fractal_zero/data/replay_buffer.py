@@ -51,80 +51,149 @@ class GameHistory:
 
 
 class ReplayBuffer:
+    """Stores every game in preallocated contiguous arrays. Each game gets a slot of `slot_length` frames (the game's
+    frames start at `slot * slot_length`), so evicting a game is O(1): its slot is simply overwritten by the next one.
+    Clips for a whole batch are gathered with a single fancy indexing call per array.
+    """
+
     def __init__(self, config: FractalZeroConfig):
         # TODO: prioritized experience replay (PER) https://arxiv.org/abs/1511.05952
 
         self.config = config
 
-        self.game_histories = []
+        self.capacity = self.config.max_replay_buffer_size
+        # the first frame of each game is the initial observation.
+        self.slot_length = self.config.max_game_steps + 1
+
+        self.episode_lengths = np.zeros(self.capacity, dtype=np.int64)
+        self.num_games = 0
+        self._next_slot = 0
+
+        # allocated with the first game, once the observation/action shapes are known.
+        self.observations = None
+        self.actions = None
+        self.rewards = None
+        self.values = None
+
+    def _allocate(self, observation_shape: tuple, action_shape: tuple):
+        num_frames = self.capacity * self.slot_length
+        self.observations = np.zeros((num_frames, *observation_shape), dtype=float)
+        self.actions = np.zeros((num_frames, *action_shape), dtype=float)
+        self.rewards = np.zeros(num_frames, dtype=float)
+        self.values = np.zeros(num_frames, dtype=float)
+
+    def _grow_slots(self, slot_length: int):
+        # only needed if a game is longer than `max_game_steps`.
+        old_length = self.slot_length
+        arrays = []
+        for arr in (self.observations, self.actions, self.rewards, self.values):
+            slots = arr.reshape(self.capacity, old_length, *arr.shape[1:])
+            new = np.zeros((self.capacity, slot_length, *arr.shape[1:]), dtype=arr.dtype)
+            new[:, :old_length] = slots
+            arrays.append(new.reshape(self.capacity * slot_length, *arr.shape[1:]))
+
+        self.observations, self.actions, self.rewards, self.values = arrays
+        self.slot_length = slot_length
+
+    def _get_slot_to_replace(self) -> int:
+        if self.num_games < self.capacity:
+            return self.num_games
+
+        strat = self.config.replay_buffer_pop_strategy
+
+        if strat == "oldest":
+            slot = self._next_slot
+            self._next_slot = (self._next_slot + 1) % self.capacity
+            return slot
+        elif strat == "random":
+            return np.random.randint(0, self.capacity)
+
+        raise NotImplementedError(
+            f'Replay buffer pop strategy "{strat}" is not supported.'
+        )
 
     def append(self, game_history: GameHistory):
         """Add a trajectory/episode to the replay buffer. If the buffer is full, a trajectory will be popped according
         to the pop strategy specified in the config.
         """
 
-        if len(self) >= self.config.max_replay_buffer_size:
-            strat = self.config.replay_buffer_pop_strategy
+        length = len(game_history)
+        observations = np.asarray(game_history.observations, dtype=float)
+        actions = np.asarray(game_history.actions, dtype=float)
 
-            if strat == "oldest":
-                i = 0
-            elif strat == "random":
-                i = np.random.randint(0, len(self))
-            else:
-                raise NotImplementedError(
-                    f'Replay buffer pop strategy "{strat}" is not supported.'
-                )
+        if self.observations is None:
+            self._allocate(observations.shape[1:], actions.shape[1:])
+        if length > self.slot_length:
+            self._grow_slots(length)
 
-            self.game_histories.pop(i)
+        slot = self._get_slot_to_replace()
+        offset = slot * self.slot_length
 
-        self.game_histories.append(game_history)
+        self.observations[offset : offset + length] = observations
+        self.actions[offset : offset + length] = actions
+        self.rewards[offset : offset + length] = np.asarray(game_history.environment_reward_signals, dtype=float)
+        self.values[offset : offset + length] = np.asarray(game_history.values, dtype=float)
+        self.episode_lengths[slot] = length
 
-        if len(self) > self.config.max_replay_buffer_size:
-            raise ValueError
+        self.num_games = min(self.num_games + 1, self.capacity)
 
-    def sample_game(self) -> GameHistory:
-        game_index = np.random.randint(0, len(self.game_histories))
-        return self.game_histories[game_index]
+    def sample_clips(self, batch_size: int, clip_length: int) -> tuple:
+        """Sample `batch_size` clips of `clip_length` frames (uniformly over games). Clips that run past the end of
+        their game are zero padded, `mask` is False for those frames.
+
+        Returns observations (B, T, *obs_shape), actions (B, T, *action_shape), rewards (B, T), values (B, T) and
+        mask (B, T).
+        """
 
-    def sample_game_clip(
-        self, clip_length: int, pad_to_num_frames: bool = True
-    ) -> tuple:
         assert clip_length > 0
 
-        game = self.sample_game()
+        slots = np.random.randint(0, len(self), size=batch_size)
+        lengths = self.episode_lengths[slots]
 
         # minimizing padding means the start frame chosen will result in the least amount of padded frames.
         if self.config.minimize_batch_padding:
-            if len(game) <= clip_length:
-                start_frame = 0
-            else:
-                start_frame = np.random.randint(0, len(game) - clip_length)
+            start_frames = np.random.randint(0, np.maximum(lengths - clip_length, 1))
         else:
-            start_frame = np.random.randint(0, len(game))
+            start_frames = np.random.randint(0, lengths)
 
-        end_frame = start_frame + clip_length
+        frames = start_frames[:, None] + np.arange(clip_length)
+        mask = frames < lengths[:, None]
 
-        actual_frames = game[start_frame:end_frame]
+        # padded frames point at the last frame of the slot, and are zeroed after gathering.
+        indices = slots[:, None] * self.slot_length + np.minimum(frames, self.slot_length - 1)
 
-        actual_num_frames = len(actual_frames[0])
-        num_frames = clip_length if pad_to_num_frames else actual_num_frames
+        def _gather(arr: np.ndarray):
+            clips = arr[indices]
+            clips[~mask] = 0
+            return clips
 
-        observations = np.zeros((num_frames, *game.observation_shape), dtype=float)
-        actions = np.zeros((num_frames, *game.action_shape), dtype=float)
-        rewards = np.zeros((num_frames,), dtype=float)
-        values = np.zeros((num_frames,), dtype=float)
+        return (
+            _gather(self.observations),
+            _gather(self.actions),
+            _gather(self.rewards),
+            _gather(self.values),
+            mask,
+        )
 
-        observations[:actual_num_frames] = actual_frames[0]
-        actions[:actual_num_frames] = actual_frames[1]
-        rewards[:actual_num_frames] = actual_frames[2]
-        values[:actual_num_frames] = actual_frames[3]
+    def sample_game_clip(
+        self, clip_length: int, pad_to_num_frames: bool = True
+    ) -> tuple:
+        observations, actions, rewards, values, mask = self.sample_clips(1, clip_length)
+        actual_num_frames = int(mask.sum())
+        num_frames = clip_length if pad_to_num_frames else actual_num_frames
 
         num_empty_frames = clip_length - actual_num_frames
 
-        return observations, actions, rewards, values, num_empty_frames
+        return (
+            observations[0, :num_frames],
+            actions[0, :num_frames],
+            rewards[0, :num_frames],
+            values[0, :num_frames],
+            num_empty_frames,
+        )
 
     def get_episode_lengths(self):
-        return [len(history) for history in self.game_histories]
+        return self.episode_lengths[: len(self)].tolist()
 
     def __len__(self):
-        return len(self.game_histories)
+        return self.num_games
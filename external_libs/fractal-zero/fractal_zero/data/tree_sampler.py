@@ -1,15 +1,72 @@
+from dataclasses import dataclass
+from typing import Dict, Union
 import torch
 import numpy as np
 
+from fractal_zero.search.array_tree import ArrayGameTree
 from fractal_zero.search.tree import GameTree, StateNode
+from fractal_zero.utils import map_columns, stack_items
 
 import wandb
 
 
+@dataclass
+class PaddedTreeBatch:
+    """All nodes of a tree (that have at least 1 weighted child) with their child actions padded to the max number
+    of children `K`. Padded entries have a weight of 0 and are False in `mask`. Dict actions are a columnar batch of
+    (N, K, ...) tensors (see `stack_dict_samples`).
+    """
+
+    observations: torch.Tensor  # (N, *observation_shape)
+    child_actions: Union[torch.Tensor, Dict]  # (N, K, *action_shape)
+    child_weights: torch.Tensor  # (N, K)
+    mask: torch.Tensor  # (N, K)
+
+    def __len__(self):
+        return len(self.observations)
+
+
+def _pad_children(
+    observations: torch.Tensor,
+    child_parents: np.ndarray,
+    child_actions: Union[torch.Tensor, Dict],
+    child_weights: np.ndarray,
+) -> PaddedTreeBatch:
+    """`child_parents` holds the row in `observations` of each child's parent, sorted ascending."""
+
+    # skip children with an almost 0 weight, and then any state that has no action targets left.
+    keep = ~np.isclose(child_weights, 0)
+    child_parents = child_parents[keep]
+    child_actions = map_columns(lambda actions: actions[torch.as_tensor(keep)], child_actions)
+    child_weights = child_weights[keep]
+
+    rows, child_rows, counts = np.unique(child_parents, return_inverse=True, return_counts=True)
+    starts = np.cumsum(counts) - counts
+    columns = np.arange(len(child_parents)) - starts[child_rows]
+
+    n, k = len(rows), int(counts.max()) if len(counts) > 0 else 0
+    row_index, column_index = torch.as_tensor(child_rows), torch.as_tensor(columns)
+
+    def _pad(actions: torch.Tensor):
+        padded = actions.new_zeros((n, k, *actions.shape[1:]))
+        padded[row_index, column_index] = actions
+        return padded
+
+    actions = map_columns(_pad, child_actions)
+
+    weights = torch.zeros((n, k), dtype=torch.float)
+    weights[row_index, column_index] = torch.as_tensor(child_weights, dtype=torch.float)
+
+    mask = torch.zeros((n, k), dtype=bool)
+    mask[row_index, column_index] = True
+
+    return PaddedTreeBatch(observations[torch.as_tensor(rows)], actions, weights, mask)
+
+
 class TreeSampler:
     def __init__(
         self,
-        tree: GameTree,
+        tree: Union[GameTree, ArrayGameTree],
         sample_type: str = "all_nodes",
         weight_type: str = "walker_children_ratio",
         use_wandb: bool = False,
@@ -62,12 +119,11 @@ class TreeSampler:
         rewards = []
         infos = []
 
-        g = self.tree.g
-        for node in g.nodes:
+        for node, children in self.tree.iter_nodes_with_children():
 
             actions = []
             weights = []
-            for _, child_node, data in g.out_edges(node, data=True):
+            for child_node, action in children:
                 weight = self._calculate_weight(child_node)
 
                 # skip if the weight is almost 0.
@@ -75,7 +131,6 @@ class TreeSampler:
                     continue
 
                 weights.append(weight)
-                action = data["action"]
                 actions.append(action)
 
             # if no action targets exist, skip this state.
@@ -90,6 +145,82 @@ class TreeSampler:
 
         return observations, child_actions, child_weights, rewards, infos
 
+    def _calculate_weights(self, num_child_walkers: np.ndarray) -> np.ndarray:
+        if self.weight_type == "walker_children_ratio":
+            return num_child_walkers / self.tree.num_walkers
+        elif self.weight_type == "constant":
+            return np.ones(len(num_child_walkers))
+        elif self.weight_type == "time_spent_at_node":
+            raise NotImplementedError
+        raise ValueError(f"{self.weight_type} not supported.")
+
+    def _get_array_tree_children(self):
+        nodes, children, starts, ends = self.tree.get_children_index()
+        has_children = ends > starts
+        nodes = nodes[has_children]
+
+        # children are already sorted by parent, so their parent's row is just a running count.
+        child_parents = np.repeat(np.arange(len(nodes)), (ends - starts)[has_children])
+
+        observations = self.tree.gather_observations(nodes)
+        child_actions = self.tree.gather_actions(children)
+        num_child_walkers = self.tree.num_child_walkers[children]
+        return observations, child_parents, child_actions, num_child_walkers
+
+    def _get_game_tree_children(self):
+        observations = []
+        child_parents = []
+        child_actions = []
+        num_child_walkers = []
+
+        for node, children in self.tree.iter_nodes_with_children():
+            if len(children) <= 0:
+                continue
+
+            for child_node, action in children:
+                child_parents.append(len(observations))
+                child_actions.append(action)
+                num_child_walkers.append(child_node.num_child_walkers)
+            observations.append(node.observation)
+
+        return (
+            stack_items(observations),
+            np.array(child_parents, dtype=np.int64),
+            stack_items(child_actions),
+            np.array(num_child_walkers),
+        )
+
+    def get_padded_batch(self) -> PaddedTreeBatch:
+        """Same samples as the "all_nodes" batch, but as padded tensors so it can be trained on in a single batched
+        forward/backward. For an `ArrayGameTree` this is built directly from its arrays (no per-node python).
+
+        Observations must be stackable (arrays/tensors/scalars). Actions can also be dicts, their child actions are
+        then a columnar batch that can be passed to `DictSpaceLoss.weighted_loss`.
+        """
+
+        if self.sample_type != "all_nodes":
+            raise ValueError(f"Padded batches are only supported for all_nodes sampling, got {self.sample_type}.")
+
+        if isinstance(self.tree, ArrayGameTree):
+            observations, child_parents, child_actions, num_child_walkers = self._get_array_tree_children()
+        else:
+            observations, child_parents, child_actions, num_child_walkers = self._get_game_tree_children()
+
+        weights = self._calculate_weights(num_child_walkers)
+        batch = _pad_children(observations, child_parents, child_actions, weights)
+
+        if self.use_wandb and wandb.run:
+            num_actions = batch.mask.sum(dim=1)
+            wandb.log(
+                {
+                    "tree_sampler/mean_weights": (batch.child_weights.sum(dim=1) / num_actions).mean().item(),
+                    "tree_sampler/num_samples": len(batch),
+                    "tree_sampler/mean_num_actions": num_actions.float().mean().item(),
+                }
+            )
+
+        return batch
+
     def get_batch(self):
         if self.sample_type == "best_path":
             obs, acts, weights, rewards, infos = self._get_best_path_as_batch()
@@ -92,3 +92,7 @@ class FractalZero(torch.nn.Module):
             print(f"episode length: {len(game_history)}")
 
         return game_history
+
+    def play_episode(self) -> GameHistory:
+        # for `ActorPool`.
+        return self.play_game()
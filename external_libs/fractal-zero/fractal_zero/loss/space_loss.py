@@ -1,5 +1,7 @@
 from abc import ABC
+import inspect
 from typing import Dict, Mapping, Sequence
+import numpy as np
 import torch
 import torch.nn.functional as F
 
@@ -19,8 +21,74 @@ def _long_cast(vec):
     return torch.tensor(vec, dtype=torch.long).long()
 
 
+def stack_dict_samples(samples: Sequence[Mapping]) -> Dict:
+    """Turns a sequence of (possibly nested) dict samples into a columnar batch: one stacked tensor per key."""
+
+    batch = {}
+    for key, value in samples[0].items():
+        values = [sample[key] for sample in samples]
+        if isinstance(value, Mapping):
+            batch[key] = stack_dict_samples(values)
+        elif isinstance(value, torch.Tensor):
+            batch[key] = torch.stack(values)
+        else:
+            batch[key] = torch.as_tensor(np.asarray(values))
+    return batch
+
+
+def _accepts_reduction(loss_func) -> bool:
+    try:
+        parameters = inspect.signature(loss_func).parameters.values()
+    except (TypeError, ValueError):
+        # no signature to inspect (ie. builtins), assume it's one of torch's losses.
+        return True
+    return any(p.name == "reduction" or p.kind == p.VAR_KEYWORD for p in parameters)
+
+
 class SpaceLoss(ABC):
-    pass
+    def per_sample_loss(self, x, y):
+        """Loss of each prediction in the batch `x` (N, ...) against its target `y` (N, ...), shape (N,)."""
+        raise NotImplementedError
+
+    def weighted_loss(self, x, targets, weights):
+        """Loss of each prediction `x` (N, ...) against all of its `targets` (N, K, ...), weighted by `weights` (N, K),
+        summed over the targets and averaged over N. Padded targets should have a weight of 0.
+
+        Loss functions that don't support `reduction="none"` are called once per (prediction, target) pair with a
+        non-zero weight instead.
+        """
+        raise NotImplementedError
+
+
+def _weighted_multi_target_loss(loss_func, x, targets, weights, accepts_reduction: bool = True):
+    n, k = weights.shape
+
+    if not accepts_reduction:
+        rows, columns = torch.nonzero(weights, as_tuple=True)
+        total = sum(loss_func(x[i], targets[i, j]) * weights[i, j] for i, j in zip(rows.tolist(), columns.tolist()))
+        return total / n
+
+    if loss_func == F.cross_entropy:
+        # x are logits (N, C) and the targets class indices (N, K).
+        x = x.unsqueeze(1).expand(n, k, *x.shape[1:]).reshape(n * k, -1)
+        losses = loss_func(x, targets.reshape(n * k), reduction="none")
+    else:
+        x = x.reshape(n, 1, -1).expand(n, k, -1)
+        losses = loss_func(x, targets.reshape(n, k, -1), reduction="none").mean(dim=-1)
+
+    return (losses.reshape(n, k) * weights).sum() / n
+
+
+def _per_sample_loss(loss_func, x, y, accepts_reduction: bool = True):
+    if not accepts_reduction:
+        return torch.stack([loss_func(x_sample, y_sample) for x_sample, y_sample in zip(x, y)])
+
+    if loss_func == F.cross_entropy:
+        # x are logits (N, C) and y class indices (N,).
+        return loss_func(x, y, reduction="none")
+
+    n = len(x)
+    return loss_func(x.reshape(n, -1), y.reshape(n, -1), reduction="none").mean(dim=-1)
 
 
 class DiscreteSpaceLoss(SpaceLoss):
@@ -30,6 +98,7 @@ class DiscreteSpaceLoss(SpaceLoss):
         # TODO: ie. if the incoming sample is obviously logits, maybe
         # TODO: we use F.cross_entropy automatically?
         self.loss_func = loss_func if loss_func else F.mse_loss
+        self.accepts_reduction = _accepts_reduction(self.loss_func)
 
         if not isinstance(discrete_space, spaces.Discrete):
             raise ValueError(f"Expected Discrete space, got {discrete_space}.")
@@ -66,10 +135,19 @@ class DiscreteSpaceLoss(SpaceLoss):
 
         return self.loss_func(x, y)
 
+    def per_sample_loss(self, x, y):
+        return _per_sample_loss(self.loss_func, self._cast_x(x), self._cast_y(y), self.accepts_reduction)
+
+    def weighted_loss(self, x, targets, weights):
+        x = self._cast_x(x)
+        targets = self._cast_y(targets)
+        return _weighted_multi_target_loss(self.loss_func, x, targets, _float_cast(weights), self.accepts_reduction)
+
 
 class BoxSpaceLoss(SpaceLoss):
     def __init__(self, box_space: spaces.Box, loss_func=None):
         self.loss_func = loss_func if loss_func else F.mse_loss
+        self.accepts_reduction = _accepts_reduction(self.loss_func)
         if not isinstance(box_space, spaces.Box):
             raise ValueError(f"Expected Discrete space, got {box_space}.")
         self.space = box_space
@@ -77,6 +155,14 @@ class BoxSpaceLoss(SpaceLoss):
     def __call__(self, x, y):
         return self.loss_func(_float_cast(x), _float_cast(y))
 
+    def per_sample_loss(self, x, y):
+        return _per_sample_loss(self.loss_func, _float_cast(x), _float_cast(y), self.accepts_reduction)
+
+    def weighted_loss(self, x, targets, weights):
+        return _weighted_multi_target_loss(
+            self.loss_func, _float_cast(x), _float_cast(targets), _float_cast(weights), self.accepts_reduction
+        )
+
 
 LOSS_CLASSES = {spaces.Discrete: DiscreteSpaceLoss, spaces.Box: BoxSpaceLoss}
 
@@ -114,17 +200,30 @@ class DictSpaceLoss(SpaceLoss):
                     f"Expected both inputs to be the same length. Got {len(y)} and {len(t)}."
                 )
 
-            total = 0
-            c = 0
-            for y_sample, t_sample in zip(y, t):
-                total += self._dict_loss(y_sample, t_sample)
-                c += 1
-
             # TODO: support reduce function instead of always doing mean?
-            return total / c
+            return self.batched_loss(stack_dict_samples(y), stack_dict_samples(t))
 
         return self._dict_loss(y, t)
 
+    def per_sample_loss(self, y, t):
+        return sum(func.per_sample_loss(y[key], t[key]) for key, func in self.funcs.items())
+
+    def batched_loss(self, y: Mapping, t: Mapping, weights=None):
+        """Loss over a columnar batch (one tensor per key with a leading batch dim N, see `stack_dict_samples`),
+        with a single loss call per key. Summed over the keys and averaged over N, optionally weighting each sample
+        by `weights` (N,).
+        """
+
+        losses = self.per_sample_loss(y, t)
+        if weights is None:
+            return losses.mean()
+        return (losses * _float_cast(weights)).sum() / len(losses)
+
+    def weighted_loss(self, x, targets, weights):
+        # columnar like `batched_loss`, each key's targets are (N, K, ...).
+        weights = _float_cast(weights)
+        return sum(func.weighted_loss(x[key], targets[key], weights) for key, func in self.funcs.items())
+
 
 def get_space_loss(space: spaces.Space, spec: Dict = None) -> SpaceLoss:
     if isinstance(space, spaces.Dict):
@@ -0,0 +1,451 @@
+from typing import List, Mapping, Sequence
+import networkx as nx
+import numpy as np
+import torch
+
+from fractal_zero.search.tree import render_tree
+from fractal_zero.utils import map_columns, stack_items
+
+
+def _to_numpy(x, dtype=None) -> np.ndarray:
+    if isinstance(x, torch.Tensor):
+        x = x.detach().cpu().numpy()
+    return np.asarray(x, dtype=dtype)
+
+
+def _scatter_chunks(chunks: List, n: int):
+    # `chunks` are (positions, rows) pairs, where rows are a tensor or a columnar batch.
+    first = chunks[0][1]
+    if isinstance(first, Mapping):
+        return {key: _scatter_chunks([(positions, chunk[key]) for positions, chunk in chunks], n) for key in first}
+
+    # levels may have been given with different dtypes (ie. an integer root observation).
+    dtype = first.dtype
+    for _, chunk in chunks[1:]:
+        dtype = torch.promote_types(dtype, chunk.dtype)
+
+    out = torch.zeros((n, *first.shape[1:]), dtype=dtype, device=first.device)
+    for positions, chunk in chunks:
+        out[positions] = chunk.to(dtype)
+    return out
+
+
+class ArrayStateNode:
+    """Lightweight view of a single node in an `ArrayGameTree`. Exposes the same attributes as `StateNode`."""
+
+    def __init__(self, tree: "ArrayGameTree", index: int):
+        self.tree = tree
+        self.id = int(index)
+
+    @property
+    def observation(self):
+        return self.tree._get_level_item(self.tree.level_observations, self.id)
+
+    @property
+    def reward(self):
+        return self.tree._get_level_item(self.tree.level_rewards, self.id)
+
+    @property
+    def info(self):
+        return self.tree._get_level_item(self.tree.level_infos, self.id)
+
+    @property
+    def action(self):
+        """The action that was taken from the parent to arrive at this node."""
+        return self.tree._get_level_item(self.tree.level_actions, self.id)
+
+    @property
+    def num_child_walkers(self) -> int:
+        return int(self.tree.num_child_walkers[self.id])
+
+    @property
+    def visits(self) -> int:
+        return int(self.tree.get_visits()[self.id])
+
+    @property
+    def terminal(self) -> bool:
+        return False
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ArrayStateNode) and other.tree is self.tree and other.id == self.id
+
+    def __hash__(self) -> int:
+        return hash((id(self.tree), self.id))
+
+    def __str__(self) -> str:
+        return f"State(nc={self.num_child_walkers}, c={self.visits}, r={self.reward})"
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
+
+class ArrayPath:
+    """Read-only view of the path from the root to a leaf of an `ArrayGameTree`. Exposes the same interface as `Path`,
+    but it's a snapshot: it won't follow the walker after it is cloned.
+    """
+
+    def __init__(self, tree: "ArrayGameTree", leaf: int):
+        self.tree = tree
+        self.leaf = int(leaf)
+
+    @property
+    def root(self) -> ArrayStateNode:
+        return self.tree.root
+
+    @property
+    def g(self) -> nx.DiGraph:
+        return self.tree.g
+
+    @property
+    def ordered_states(self) -> List[ArrayStateNode]:
+        return [ArrayStateNode(self.tree, i) for i in self.tree.get_path_indices(self.leaf)]
+
+    @property
+    def total_reward(self) -> float:
+        return float(self.tree.cumulative_rewards[self.leaf])
+
+    @property
+    def average_reward(self) -> float:
+        return self.total_reward / len(self)
+
+    @property
+    def last_node(self) -> ArrayStateNode:
+        return ArrayStateNode(self.tree, self.leaf)
+
+    @property
+    def first_action(self):
+        return self.ordered_states[1].action
+
+    @property
+    def last_action(self):
+        if self.leaf == 0:
+            return None
+        return self.last_node.action
+
+    def get_action_between(self, state: ArrayStateNode, next_state: ArrayStateNode):
+        if self.tree.parents[next_state.id] != state.id:
+            raise ValueError(f"No edge exists between {state} and {next_state}.")
+        return next_state.action
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ArrayPath) and other.tree is self.tree and other.leaf == self.leaf
+
+    def __str__(self):
+        return f"Path(len={len(self)}, total_reward={self.total_reward})"
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
+    def __len__(self):
+        return int(self.tree.depths[self.leaf]) + 1
+
+    def __iter__(self):
+        # same as `Path`, the last state is not yielded because it has no action.
+        states = self.ordered_states
+        for state, next_state in zip(states[:-1], states[1:]):
+            yield state, next_state.action
+
+
+class ArrayGameTree:
+    """Drop-in alternative to `GameTree` that stores the tree in preallocated arrays (parent index, reward, cumulative
+    reward, depth, child count and number of child walkers per node) instead of a networkx graph of `StateNode`s.
+
+    Building a level, cloning and pruning are vectorized over all walkers, and each node's cumulative reward is stored
+    so path rewards never have to be re-summed. Observations, rewards, infos and actions are stored once per level
+    (as they were given to `build_next_level`) and indexed by node. `walker_paths`, `best_path`, `g` etc. are views
+    built on demand, so `TreeSampler` and the rest of the `GameTree` interface keep working.
+    """
+
+    def __init__(self, num_walkers: int, root_observation=None, prune: bool = True, initial_capacity: int = 1024):
+        self.num_walkers = num_walkers
+        self.prune = prune
+
+        self.num_nodes = 0
+        self._capacity = 0
+        self.parents = np.empty(0, dtype=np.int64)
+        self.depths = np.empty(0, dtype=np.int64)
+        self.rewards = np.empty(0, dtype=float)
+        self.cumulative_rewards = np.empty(0, dtype=float)
+        self.num_children = np.empty(0, dtype=np.int64)
+        self.num_child_walkers = np.empty(0, dtype=np.int64)
+        self.alive = np.empty(0, dtype=bool)
+
+        # (level, row) of each node into the per level data.
+        self.node_levels = np.empty(0, dtype=np.int64)
+        self.node_rows = np.empty(0, dtype=np.int64)
+
+        # visits are only needed for inspection, so clones are recorded at the new leaf and accumulated lazily.
+        self._base_visits = np.empty(0, dtype=np.int64)
+        self._pending_visits = np.empty(0, dtype=np.int64)
+
+        self._grow(max(initial_capacity, num_walkers + 1))
+
+        # level 0 is the root.
+        self.level_observations = [[root_observation]]
+        self.level_rewards = [[0]]
+        self.level_infos = [[None]]
+        self.level_actions = [[None]]
+        self.level_num_alive = [1]
+
+        root = self._allocate(1)
+        self.parents[root] = -1
+        self.depths[root] = 0
+        self.rewards[root] = 0
+        self.cumulative_rewards[root] = 0
+        self.num_child_walkers[root] = num_walkers
+        self.node_levels[root] = 0
+        self.node_rows[root] = 0
+
+        self.walker_leaves = np.zeros(num_walkers, dtype=np.int64)
+
+    def _grow(self, capacity: int):
+        def _resize(arr: np.ndarray, fill=0):
+            new = np.full(capacity, fill, dtype=arr.dtype)
+            new[: self.num_nodes] = arr[: self.num_nodes]
+            return new
+
+        self.parents = _resize(self.parents, -1)
+        self.depths = _resize(self.depths)
+        self.rewards = _resize(self.rewards)
+        self.cumulative_rewards = _resize(self.cumulative_rewards)
+        self.num_children = _resize(self.num_children)
+        self.num_child_walkers = _resize(self.num_child_walkers)
+        self.alive = _resize(self.alive, False)
+        self.node_levels = _resize(self.node_levels)
+        self.node_rows = _resize(self.node_rows)
+        self._base_visits = _resize(self._base_visits)
+        self._pending_visits = _resize(self._pending_visits)
+        self._capacity = capacity
+
+    def _allocate(self, n: int) -> np.ndarray:
+        if self.num_nodes + n > self._capacity:
+            self._grow(max(self._capacity * 2, self.num_nodes + n))
+
+        indices = np.arange(self.num_nodes, self.num_nodes + n)
+        self.num_nodes += n
+
+        self.alive[indices] = True
+        self.num_children[indices] = 0
+        self.num_child_walkers[indices] = 1
+        self._base_visits[indices] = 1
+        self._pending_visits[indices] = 0
+        return indices
+
+    def _get_level_item(self, level_data: List, index: int):
+        return level_data[self.node_levels[index]][self.node_rows[index]]
+
+    @property
+    def root(self) -> ArrayStateNode:
+        return ArrayStateNode(self, 0)
+
+    def build_next_level(
+        self,
+        actions: Sequence,
+        new_observations: Sequence,
+        rewards: Sequence,
+        infos: Sequence,
+        freeze_mask=None,
+    ):
+        if freeze_mask is None:
+            freeze_mask = np.zeros(self.num_walkers, dtype=bool)
+
+        assert (
+            len(actions)
+            == len(new_observations)
+            == len(rewards)
+            == len(freeze_mask)
+            == self.num_walkers
+        )
+
+        active_walkers = np.flatnonzero(~_to_numpy(freeze_mask, dtype=bool))
+        if len(active_walkers) == 0:
+            return
+
+        new_nodes = self._allocate(len(active_walkers))
+        parents = self.walker_leaves[active_walkers]
+        step_rewards = _to_numpy(rewards, dtype=float)[active_walkers]
+
+        self.parents[new_nodes] = parents
+        self.depths[new_nodes] = self.depths[parents] + 1
+        self.rewards[new_nodes] = step_rewards
+        self.cumulative_rewards[new_nodes] = self.cumulative_rewards[parents] + step_rewards
+        # multiple walkers can share the same leaf after cloning.
+        np.add.at(self.num_children, parents, 1)
+
+        # the level data is stored by reference, rows are indexed by walker.
+        self.node_levels[new_nodes] = len(self.level_observations)
+        self.node_rows[new_nodes] = active_walkers
+        self.level_observations.append(new_observations)
+        self.level_rewards.append(rewards)
+        self.level_infos.append(infos)
+        self.level_actions.append(list(actions))
+        self.level_num_alive.append(len(active_walkers))
+
+        self.walker_leaves[active_walkers] = new_nodes
+
+    def clone(self, partners: Sequence, clone_mask: Sequence):
+        partners = _to_numpy(partners, dtype=np.int64)
+        cloning_walkers = np.flatnonzero(_to_numpy(clone_mask, dtype=bool))
+        if len(cloning_walkers) == 0:
+            return
+
+        old_leaves = self.walker_leaves[cloning_walkers]
+        new_leaves = self.walker_leaves[partners[cloning_walkers]]
+        self.walker_leaves[cloning_walkers] = new_leaves
+        np.add.at(self._pending_visits, new_leaves, 1)
+
+        # walk both paths up to their closest common state. the old path loses a walker before it,
+        # the new path gains one after it.
+        decremented = []
+        u, v = old_leaves, new_leaves
+        while True:
+            diverged = u != v
+            if not diverged.any():
+                break
+            u, v = u[diverged], v[diverged]
+
+            u_depths, v_depths = self.depths[u], self.depths[v]
+            step_u = u_depths >= v_depths
+            step_v = v_depths >= u_depths
+
+            np.subtract.at(self.num_child_walkers, u[step_u], 1)
+            np.add.at(self.num_child_walkers, v[step_v], 1)
+            decremented.append(u[step_u])
+
+            u = np.where(step_u, self.parents[u], u)
+            v = np.where(step_v, self.parents[v], v)
+
+        if self.prune and decremented:
+            self._prune(np.unique(np.concatenate(decremented)))
+
+    def _prune(self, candidates: np.ndarray):
+        dead = candidates[(self.num_child_walkers[candidates] <= 0) & self.alive[candidates]]
+        if len(dead) == 0:
+            return
+
+        self.alive[dead] = False
+        np.subtract.at(self.num_children, self.parents[dead], 1)
+
+        # release the level data once none of its nodes are alive anymore.
+        dead_levels, counts = np.unique(self.node_levels[dead], return_counts=True)
+        for level, count in zip(dead_levels, counts):
+            self.level_num_alive[level] -= count
+            if self.level_num_alive[level] <= 0:
+                self.level_observations[level] = None
+                self.level_rewards[level] = None
+                self.level_infos[level] = None
+                self.level_actions[level] = None
+
+    def get_path_indices(self, leaf: int) -> List[int]:
+        indices = []
+        node = int(leaf)
+        while node >= 0:
+            indices.append(node)
+            node = int(self.parents[node])
+        return indices[::-1]
+
+    def get_visits(self) -> np.ndarray:
+        # each clone counts as a visit to every node on the path it cloned to.
+        visits = self._pending_visits[: self.num_nodes].copy()
+        depths = self.depths[: self.num_nodes]
+        parents = self.parents[: self.num_nodes]
+        for depth in range(int(depths.max()), 0, -1):
+            nodes = np.flatnonzero(depths == depth)
+            np.add.at(visits, parents[nodes], visits[nodes])
+        return visits + self._base_visits[: self.num_nodes]
+
+    @property
+    def walker_paths(self) -> List[ArrayPath]:
+        return [ArrayPath(self, leaf) for leaf in self.walker_leaves]
+
+    @property
+    def best_path(self) -> ArrayPath:
+        # best path of current walker
+        best_walker = np.argmax(self.cumulative_rewards[self.walker_leaves])
+        return ArrayPath(self, self.walker_leaves[best_walker])
+
+    @property
+    def last_actions(self):
+        return [ArrayPath(self, leaf).last_action for leaf in self.walker_leaves]
+
+    def get_depths(self) -> torch.Tensor:
+        return torch.tensor(self.depths[self.walker_leaves] + 1, dtype=float)
+
+    def get_total_rewards(self) -> torch.Tensor:
+        return torch.tensor(self.cumulative_rewards[self.walker_leaves], dtype=float)
+
+    @property
+    def nodes(self) -> List[ArrayStateNode]:
+        return [ArrayStateNode(self, i) for i in np.flatnonzero(self.alive[: self.num_nodes])]
+
+    def get_children_index(self):
+        """Returns the alive nodes, all alive (non-root) nodes sorted by their parent, and the `[start, end)` range of
+        each alive node's children in that sorted array.
+        """
+
+        alive = np.flatnonzero(self.alive[: self.num_nodes])
+        children = alive[self.parents[alive] >= 0]
+        children = children[np.argsort(self.parents[children], kind="stable")]
+        children_parents = self.parents[children]
+
+        starts = np.searchsorted(children_parents, alive, side="left")
+        ends = np.searchsorted(children_parents, alive, side="right")
+        return alive, children, starts, ends
+
+    def _gather_level_data(self, level_data: List, indices: np.ndarray) -> torch.Tensor:
+        if len(indices) == 0:
+            return self._empty_level_data(level_data)
+
+        # stack each level once, then scatter its rows into place.
+        levels = self.node_levels[indices]
+        rows = self.node_rows[indices]
+
+        chunks = []
+        for level in np.unique(levels):
+            positions = torch.as_tensor(np.flatnonzero(levels == level))
+            rows_at_level = torch.as_tensor(rows[positions.numpy()])
+            chunks.append((positions, map_columns(lambda column: column[rows_at_level], stack_items(level_data[level]))))
+
+        return _scatter_chunks(chunks, len(indices))
+
+    def _empty_level_data(self, level_data: List) -> torch.Tensor:
+        # shaped like the first item still stored (ie. the root observation). if there is none (ie. the actions of a
+        # tree that was just reset), the item shape is unknown.
+        for items in level_data:
+            for item in items if items is not None else []:
+                if item is not None:
+                    example = stack_items([item])
+                    return map_columns(lambda column: column.new_zeros((0, *column.shape[1:])), example)
+        return torch.zeros((0,))
+
+    def gather_observations(self, indices: np.ndarray) -> torch.Tensor:
+        """Observations of the given nodes, stacked into a single tensor (or a columnar batch for dicts)."""
+        return self._gather_level_data(self.level_observations, indices)
+
+    def gather_actions(self, indices: np.ndarray) -> torch.Tensor:
+        """Actions taken to arrive at each of the given (non-root) nodes, stacked into a single tensor (or a columnar
+        batch for dict actions).
+        """
+        return self._gather_level_data(self.level_actions, indices)
+
+    def iter_nodes_with_children(self):
+        """Yields each (alive) node along with a list of its (child node, action) pairs."""
+
+        alive, children, starts, ends = self.get_children_index()
+        for node, start, end in zip(alive, starts, ends):
+            child_nodes = [ArrayStateNode(self, child) for child in children[start:end]]
+            yield ArrayStateNode(self, node), [(child, child.action) for child in child_nodes]
+
+    @property
+    def g(self) -> nx.DiGraph:
+        """Snapshot of the tree as a networkx graph (for inspection and rendering, this is not cheap)."""
+
+        g = nx.DiGraph()
+        for node, children in self.iter_nodes_with_children():
+            g.add_node(node)
+            for child, action in children:
+                g.add_edge(node, child, action=action)
+        return g
+
+    def render(self, label_type: str = "reward"):
+        render_tree(self.g, self.root, label_type=label_type)
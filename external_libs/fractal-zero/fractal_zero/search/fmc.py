@@ -5,8 +5,9 @@ import torch.nn.functional as F
 import numpy as np
 
 from tqdm import tqdm
+from fractal_zero.search.array_tree import ArrayGameTree
 from fractal_zero.search.tree import GameTree
-from fractal_zero.utils import cloning_primitive
+from fractal_zero.utils import cloning_primitive, gather_cloning_primitive
 
 from fractal_zero.vectorized_environment import VectorizedEnvironment
 
@@ -35,6 +36,23 @@ def _relativize_vector(vector: torch.Tensor):
     return standard
 
 
+def _relativize_vector_on_device(vector: torch.Tensor):
+    # same as `_relativize_vector`, without any data dependent control flow or masked assignment.
+    std = vector.std()
+    standard = (vector - vector.mean()) / torch.where(std > 0, std, torch.ones_like(std))
+    # when all values are equal the standardized values are 0, which are all mapped to 1.
+    return torch.where(standard > 0, torch.log(1 + standard) + 1, torch.exp(standard))
+
+
+def _get_walker_item(subject, walker: int):
+    item = subject[walker]
+    if isinstance(item, torch.Tensor):
+        return item.detach().cpu().clone()
+    if isinstance(item, np.ndarray):
+        return item.copy()
+    return item
+
+
 _ATTRIBUTES_TO_CLONE = (
     "states",
     "observations",
@@ -44,6 +62,8 @@ _ATTRIBUTES_TO_CLONE = (
     "average_rewards",
     "actions",
     "infos",
+    "depths",
+    "first_actions",
 )
 
 
@@ -60,6 +80,8 @@ class FMC:
         freeze_best: bool = True,
         track_tree: bool = True,
         prune_tree: bool = True,
+        use_array_tree: bool = False,
+        device_resident: bool = False,
     ):
         self.vec_env = vectorized_environment
         self.balance = balance
@@ -71,6 +93,14 @@ class FMC:
         self.freeze_best = freeze_best
         self.track_tree = track_tree
         self.prune_tree = prune_tree
+        self.use_array_tree = use_array_tree
+
+        # when true, all of FMC's walker bookkeeping stays on the device of the rewards returned by the vectorized
+        # environment and is never synchronized with the host (until results are read). the tree is built on the host,
+        # so use `track_tree=False` to avoid synchronization there as well.
+        # with `track_tree=False`, only O(walkers) state is kept (no matter how many steps are simulated), which is all
+        # that's needed to plan with `best_first_action`.
+        self.device_resident = device_resident
 
         self.reset()
 
@@ -91,9 +121,15 @@ class FMC:
         self.average_rewards = torch.zeros(self.num_walkers, dtype=float)
         self.clone_mask = torch.zeros(self.num_walkers, dtype=bool)
         self.freeze_mask = torch.zeros((self.num_walkers), dtype=bool)
+        # per walker path length (including the root) and the first action taken from the root. these are cloned
+        # along with the walkers, so the best first action and average rewards never need the tree.
+        self.depths = torch.ones(self.num_walkers, dtype=float)
+        self.first_actions = None
 
+        # the array backed tree is much cheaper to maintain for large numbers of walkers.
+        tree_class = ArrayGameTree if self.use_array_tree else GameTree
         self.tree = (
-            GameTree(self.num_walkers, prune=self.prune_tree, root_observation=root_obs)
+            tree_class(self.num_walkers, prune=self.prune_tree, root_observation=root_obs)
             if self.track_tree
             else None
         )
@@ -106,6 +142,13 @@ class FMC:
     def _can_early_exit(self):
         return torch.all(self.dones)
 
+    def _move_to_device(self, device):
+        if self.scores.device == device:
+            return
+
+        for attr in ("dones", "scores", "average_rewards", "clone_mask", "freeze_mask", "depths"):
+            setattr(self, attr, getattr(self, attr).to(device))
+
     def simulate(self, steps: int, use_tqdm: bool = False):
         if self.did_early_exit:
             raise ValueError("Already early exited.")
@@ -114,12 +157,16 @@ class FMC:
         for _ in it:
             self._perturbate()
 
-            if self._can_early_exit():
+            # checking for early exits requires a sync, so when device resident it's only checked after all steps.
+            if not self.device_resident and self._can_early_exit():
                 self.did_early_exit = True
                 break
 
             self._clone()
 
+        if self.device_resident and self._can_early_exit():
+            self.did_early_exit = True
+
     def _perturbate(self):
         freeze_steps = torch.logical_or(self.freeze_mask, self.dones)
 
@@ -135,12 +182,28 @@ class FMC:
             self.infos,
         ) = self.vec_env.batch_step(self.actions, freeze_steps)
 
-        if self.reward_is_score:
-            self.scores = self.rewards.cpu().clone()
+        if self.device_resident:
+            self._move_to_device(self.rewards.device)
+            self.dones = self.dones.to(self.scores.device)
+            freeze_steps = freeze_steps.to(self.scores.device)
+
+            if self.reward_is_score:
+                self.scores = self.rewards.clone()
+            else:
+                self.scores += self.rewards
         else:
-            self.scores += self.rewards.cpu()
+            if self.reward_is_score:
+                self.scores = self.rewards.cpu().clone()
+            else:
+                self.scores += self.rewards.cpu()
 
-        self.average_rewards = self.scores / self.tree.get_depths()
+        if self.first_actions is None:
+            # no walker can be frozen on the first step.
+            self._set_first_actions()
+
+        # frozen walkers don't add a new node to their path.
+        self.depths += (~freeze_steps).to(self.depths.dtype)
+        self.average_rewards = self.scores / self.depths
 
         if self.tree:
             # NOTE: the actions that are in the tree will diverge slightly from
@@ -154,16 +217,47 @@ class FMC:
 
         self._set_freeze_mask()
 
+    def _set_first_actions(self):
+        # tensors and arrays are cloned in place, so they can't be shared with the actions.
+        if isinstance(self.actions, torch.Tensor):
+            self.first_actions = self.actions.clone()
+        elif isinstance(self.actions, np.ndarray):
+            self.first_actions = self.actions.copy()
+        else:
+            # cloning builds a new list, sharing it is safe.
+            self.first_actions = self.actions
+
+    @property
+    def best_walker(self) -> int:
+        return int(self.scores.argmax())
+
+    @property
+    def best_first_action(self):
+        """The first action of the walker with the highest score (the same as `tree.best_path.first_action`)."""
+        return self.first_actions[self.best_walker]
+
     def _set_freeze_mask(self):
+        if self.device_resident:
+            self.freeze_mask = torch.zeros_like(self.dones)
+            if self.freeze_best:
+                metric = self.average_rewards if self.use_average_rewards else self.scores
+                walkers = torch.arange(self.num_walkers, device=metric.device)
+                self.freeze_mask = walkers == metric.argmax()
+            return
+
         self.freeze_mask = torch.zeros((self.num_walkers), dtype=bool)
         if self.freeze_best:
-            if self.use_average_rewards:
-                metric = self.average_rewards.argmax()
-            else:
-                metric = self.scores
+            metric = self.average_rewards if self.use_average_rewards else self.scores
             self.freeze_mask[metric.argmax()] = 1
 
     def _set_valid_clone_partners(self):
+        if self.device_resident:
+            # cannot clone to walkers at terminal states (unless all walkers are at terminal states).
+            valid = ~self.dones
+            weights = torch.where(valid.any(), valid, torch.ones_like(valid)).float()
+            self.clone_partners = torch.multinomial(weights, self.num_walkers, replacement=True)
+            return
+
         valid_clone_partners = np.arange(self.num_walkers)
 
         # cannot clone to walkers at terminal states
@@ -174,6 +268,9 @@ class FMC:
         self.clone_partners = torch.tensor(clone_partners, dtype=int).long()
 
     def _set_clone_variables(self):
+        if self.device_resident:
+            return self._set_clone_variables_on_device()
+
         self._set_valid_clone_partners()
         self.similarities = self.similarity_function(
             self.states, self.states[self.clone_partners]
@@ -202,6 +299,26 @@ class FMC:
         # don't clone frozen walkers
         self.clone_mask[self.freeze_mask] = False
 
+    def _set_clone_variables_on_device(self):
+        self._set_valid_clone_partners()
+        self.similarities = self.similarity_function(
+            self.states, self.states[self.clone_partners]
+        ).to(self.scores.device)
+
+        rel_sim = _relativize_vector_on_device(self.similarities)
+        rel_score = _relativize_vector_on_device(
+            self.average_rewards if self.use_average_rewards else self.scores
+        )
+        self.virtual_rewards = rel_score ** self.balance * rel_sim
+
+        vr = self.virtual_rewards
+        pair_vr = self.virtual_rewards[self.clone_partners]
+        value = (pair_vr - vr) / torch.where(vr > 0, vr, 1e-8)
+        clone_mask = value >= torch.rand(1, device=value.device)
+
+        # clone all walkers at terminal states, but never clone frozen walkers.
+        self.clone_mask = torch.logical_and(torch.logical_or(clone_mask, self.dones), ~self.freeze_mask)
+
     def _clone(self):
         self._set_clone_variables()
 
@@ -216,6 +333,8 @@ class FMC:
         self.rewards = self.rewards.clone()
         if isinstance(self.observations, torch.Tensor):
             self.observations = self.observations.clone()
+        elif isinstance(self.observations, np.ndarray):
+            self.observations = self.observations.copy()
         if isinstance(self.infos, torch.Tensor):
             self.infos = self.infos.clone()
 
@@ -228,8 +347,49 @@ class FMC:
         # if self.rewards[self.freeze_mask].sum().item() != 0:
         #     raise ValueError(self.rewards[self.freeze_mask], self.rewards[self.freeze_mask].sum())
 
+    def export_walkers(self, walkers: List[int]) -> List[dict]:
+        """Everything needed to recreate the given walkers in another swarm (searching the same kind of environment,
+        with the same snapshotter). The result can be sent to other processes.
+        """
+
+        walkers = [int(walker) for walker in walkers]
+        snapshots = self.vec_env.get_snapshots(walkers)
+
+        exported = []
+        for walker, snapshot in zip(walkers, snapshots):
+            walker_data = {attr: _get_walker_item(getattr(self, attr), walker) for attr in _ATTRIBUTES_TO_CLONE}
+            walker_data["snapshot"] = snapshot
+            exported.append(walker_data)
+        return exported
+
+    def import_walkers(self, walkers: List[int], exported: List[dict]):
+        """Overwrite the given walkers with walkers exported from another swarm."""
+
+        if self.tree:
+            raise ValueError("Walkers can only be imported with `track_tree=False`, their paths are not in this tree.")
+
+        walkers = [int(walker) for walker in walkers]
+        self.vec_env.restore_snapshots({walker: data["snapshot"] for walker, data in zip(walkers, exported)})
+
+        for walker, walker_data in zip(walkers, exported):
+            for attr in _ATTRIBUTES_TO_CLONE:
+                subject, value = getattr(self, attr), walker_data[attr]
+                if isinstance(subject, torch.Tensor) and isinstance(value, torch.Tensor):
+                    value = value.to(subject.device)
+                subject[walker] = value
+
+        # an imported walker may be the new best.
+        self._set_freeze_mask()
+
     def _clone_variable(self, subject_var_name: str):
         subject = getattr(self, subject_var_name)
+        if self.device_resident:
+            cloned_subject = gather_cloning_primitive(
+                subject, self.clone_partners, self.clone_mask
+            )
+            setattr(self, subject_var_name, cloned_subject)
+            return cloned_subject
+
         # note: this will be cloned in-place!
         cloned_subject = cloning_primitive(
             subject, self.clone_partners, self.clone_mask
@@ -0,0 +1,251 @@
+from collections import defaultdict
+import multiprocessing as mp
+from typing import Callable, Dict, List
+
+import numpy as np
+import torch
+
+from fractal_zero.search.fmc import FMC
+from fractal_zero.vectorized_environment import VectorizedEnvironment, _shared_array
+
+
+def _write_board(fmc: FMC, board: np.ndarray, num_exchanged: int):
+    # row 0 holds the swarm's top scores (descending), row 1 its worst scores (ascending).
+    scores = fmc.scores.detach().cpu().numpy()
+    order = np.argsort(scores, kind="stable")
+    board[0] = scores[order[::-1][:num_exchanged]]
+    board[1] = scores[order[:num_exchanged]]
+
+
+def _multi_swarm_worker(
+    conn,
+    make_vec_env: Callable[[], VectorizedEnvironment],
+    fmc_kwargs: dict,
+    seed: int,
+    swarm_index: int,
+    raw_board,
+    board_shape: tuple,
+):
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+
+    board = np.frombuffer(raw_board, dtype=float, count=int(np.prod(board_shape))).reshape(board_shape)[swarm_index]
+    num_exchanged = board_shape[-1]
+
+    vec_env = make_vec_env()
+    fmc = FMC(vec_env, **fmc_kwargs)
+
+    try:
+        while True:
+            command, data = conn.recv()
+
+            if command == "simulate":
+                if not fmc.did_early_exit:
+                    fmc.simulate(data)
+                _write_board(fmc, board, num_exchanged)
+                conn.send(fmc.did_early_exit)
+            elif command == "export":
+                top_walkers = torch.argsort(fmc.scores.detach().cpu(), descending=True)[:data]
+                conn.send(fmc.export_walkers(top_walkers.tolist()))
+            elif command == "import":
+                # immigrants replace the worst walkers that they beat (never the frozen best walker).
+                scores = fmc.scores.detach().cpu().numpy()
+                walkers = [w for w in np.argsort(scores, kind="stable") if not fmc.freeze_mask[w]]
+
+                accepted = []
+                for walker, walker_data in zip(walkers, data):
+                    if float(walker_data["scores"]) > scores[walker]:
+                        accepted.append((walker, walker_data))
+
+                if accepted:
+                    fmc.import_walkers([w for w, _ in accepted], [d for _, d in accepted])
+                    _write_board(fmc, board, num_exchanged)
+                conn.send(len(accepted))
+            elif command == "result":
+                best_walker = fmc.best_walker
+                conn.send(
+                    {
+                        "score": float(fmc.scores[best_walker]),
+                        "first_action": fmc.best_first_action,
+                        "did_early_exit": fmc.did_early_exit,
+                    }
+                )
+            elif command == "reset":
+                fmc.reset()
+                conn.send(None)
+            elif command == "set_root":
+                fmc.reset()
+                vec_env.set_all_states(*data)
+                conn.send(None)
+            elif command == "close":
+                break
+            else:
+                raise NotImplementedError(command)
+    finally:
+        conn.close()
+
+
+class MultiSwarmFMC:
+    """Root-parallel FMC: `num_swarms` independent swarms search from the same root, each in its own process with its
+    own vectorized environment (or dynamics model copy) built by `make_vec_env`.
+
+    Every `exchange_interval` steps, each swarm's top `num_exchanged` walkers migrate to another swarm (according to
+    the `exchange_topology`), replacing the worst walkers there that they beat. Each swarm's top/worst scores are kept
+    in a shared memory board, so only migrations that will actually be accepted are sent. Walkers migrate with their
+    environment snapshots, so the vectorized environments must support `get_snapshots`/`restore_snapshots`.
+
+    Swarms run tree-free (migrants carry no path), so a swarm's result is its best score and first action, and the
+    swarms' results are merged with the `merge_policy`:
+        "best": the first action of the best scoring swarm.
+        "vote": the first action chosen by the most swarms, ties broken by the best score.
+
+    With the "spawn" start method, `make_vec_env` must be picklable.
+    """
+
+    def __init__(
+        self,
+        make_vec_env: Callable[[], VectorizedEnvironment],
+        num_swarms: int = None,
+        fmc_kwargs: dict = None,
+        exchange_interval: int = 16,
+        num_exchanged: int = 1,
+        exchange_topology: str = "ring",
+        merge_policy: str = "best",
+        start_method: str = None,
+    ):
+        self.num_swarms = num_swarms if num_swarms else mp.cpu_count()
+        self.exchange_interval = exchange_interval
+        self.num_exchanged = num_exchanged
+        self.exchange_topology = exchange_topology
+        self.merge_policy = merge_policy
+
+        if exchange_topology not in ("ring", "best_to_all"):
+            raise ValueError(f"Exchange topology {exchange_topology} is not supported.")
+        if merge_policy not in ("best", "vote"):
+            raise ValueError(f"Merge policy {merge_policy} is not supported.")
+
+        fmc_kwargs = dict(fmc_kwargs) if fmc_kwargs else {}
+        if fmc_kwargs.get("track_tree", False):
+            raise ValueError("Swarms exchange walkers, so they can't track a tree.")
+        fmc_kwargs["track_tree"] = False
+
+        ctx = mp.get_context(start_method)
+
+        board_shape = (self.num_swarms, 2, num_exchanged)
+        raw_board, self.board = _shared_array(ctx, board_shape, float)
+
+        self.connections = []
+        self.processes = []
+        seeds = np.random.randint(0, 2**31 - 1, size=self.num_swarms)
+        for swarm_index, seed in enumerate(seeds):
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(
+                target=_multi_swarm_worker,
+                args=(child_conn, make_vec_env, fmc_kwargs, int(seed), swarm_index, raw_board, board_shape),
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+
+            self.connections.append(parent_conn)
+            self.processes.append(process)
+
+        self.num_migrations = 0
+        self.closed = False
+
+    def _broadcast(self, command: str, data=None) -> List:
+        for conn in self.connections:
+            conn.send((command, data))
+        return [conn.recv() for conn in self.connections]
+
+    def reset(self):
+        self._broadcast("reset")
+        self.num_migrations = 0
+
+    def set_root(self, env, observation):
+        """Reset all swarms to search from the state of `env` (see `VectorizedEnvironment.set_all_states`)."""
+        self._broadcast("set_root", (env, observation))
+        self.num_migrations = 0
+
+    def _get_migration_routes(self) -> Dict[int, List[int]]:
+        """Returns the receiving swarms of each sending swarm."""
+
+        if self.exchange_topology == "ring":
+            return {i: [(i + 1) % self.num_swarms] for i in range(self.num_swarms)}
+
+        best_swarm = int(self.board[:, 0, 0].argmax())
+        return {best_swarm: [i for i in range(self.num_swarms) if i != best_swarm]}
+
+    def _exchange(self):
+        routes = {}
+        for sender, receivers in self._get_migration_routes().items():
+            # skip receivers whose worst walker already beats the sender's best.
+            receivers = [r for r in receivers if r != sender and self.board[sender, 0, 0] > self.board[r, 1, 0]]
+            if receivers:
+                routes[sender] = receivers
+
+        # all emigrants are exported before any are imported.
+        for sender in routes:
+            self.connections[sender].send(("export", self.num_exchanged))
+        emigrants = {sender: self.connections[sender].recv() for sender in routes}
+
+        immigrants = defaultdict(list)
+        for sender, receivers in routes.items():
+            for receiver in receivers:
+                immigrants[receiver].extend(emigrants[sender])
+
+        for receiver, walkers in immigrants.items():
+            # the best immigrants take the place of the worst walkers first.
+            walkers = sorted(walkers, key=lambda walker_data: float(walker_data["scores"]), reverse=True)
+            self.connections[receiver].send(("import", walkers))
+        for receiver in immigrants:
+            self.num_migrations += self.connections[receiver].recv()
+
+    def simulate(self, steps: int):
+        interval = self.exchange_interval if self.exchange_interval else steps
+
+        done_steps = 0
+        while done_steps < steps:
+            chunk = min(interval, steps - done_steps)
+            early_exits = self._broadcast("simulate", chunk)
+            done_steps += chunk
+
+            if all(early_exits):
+                break
+            if self.exchange_interval and done_steps < steps:
+                self._exchange()
+
+    def get_results(self) -> List[dict]:
+        """The best score and first action of each swarm."""
+        return self._broadcast("result")
+
+    @property
+    def best_first_action(self):
+        results = self.get_results()
+
+        if self.merge_policy == "best":
+            return max(results, key=lambda result: result["score"])["first_action"]
+
+        votes = defaultdict(list)
+        for result in results:
+            votes[result["first_action"]].append(result["score"])
+        return max(votes, key=lambda action: (len(votes[action]), max(votes[action])))
+
+    def close(self):
+        if self.closed:
+            return
+
+        for conn in self.connections:
+            try:
+                conn.send(("close", None))
+            except (BrokenPipeError, EOFError):
+                pass
+        for process in self.processes:
+            process.join()
+        self.closed = True
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
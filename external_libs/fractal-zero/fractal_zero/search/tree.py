@@ -255,23 +255,38 @@ class GameTree:
     def get_total_rewards(self):
         return torch.tensor([p.total_reward for p in self.walker_paths], dtype=float)
 
-    def render(self, label_type: str = "reward"):
-        colors = []
-        labels = {}
-        for node in self.g.nodes:
-            if node == self.root:
-                colors.append("green")
-            else:
-                colors.append("red")
+    @property
+    def nodes(self):
+        return self.g.nodes
 
-            if label_type == "reward":
-                labels[node] = f"{node.reward:.1f}"
-            elif label_type == "num_child_walkers":
-                labels[node] = f"{node.num_child_walkers}"
-            else:
-                raise NotImplementedError(label_type)
+    def iter_nodes_with_children(self):
+        """Yields each node along with a list of its (child node, action) pairs."""
 
-        nx.draw(
-            self.g, labels=labels, with_labels=True, node_color=colors, node_size=80
-        )
-        plt.show()
+        for node in self.g.nodes:
+            children = [(child_node, data["action"]) for _, child_node, data in self.g.out_edges(node, data=True)]
+            yield node, children
+
+    def render(self, label_type: str = "reward"):
+        render_tree(self.g, self.root, label_type=label_type)
+
+
+def render_tree(g: nx.DiGraph, root, label_type: str = "reward"):
+    colors = []
+    labels = {}
+    for node in g.nodes:
+        if node == root:
+            colors.append("green")
+        else:
+            colors.append("red")
+
+        if label_type == "reward":
+            labels[node] = f"{node.reward:.1f}"
+        elif label_type == "num_child_walkers":
+            labels[node] = f"{node.num_child_walkers}"
+        else:
+            raise NotImplementedError(label_type)
+
+    nx.draw(
+        g, labels=labels, with_labels=True, node_color=colors, node_size=80
+    )
+    plt.show()
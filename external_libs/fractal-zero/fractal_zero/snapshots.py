@@ -0,0 +1,93 @@
+from copy import deepcopy
+import pickle
+from typing import Any, Sequence
+import gym
+
+
+def _iter_layers(env: gym.Env):
+    """Yields the environment and each environment it wraps, outermost first."""
+
+    while True:
+        yield env
+        if not isinstance(env, gym.Wrapper):
+            break
+        env = env.env
+
+
+class _DeepcopySnapshot:
+    def __init__(self, env: gym.Env):
+        self.env = env
+        self.restored = False
+
+
+class EnvironmentSnapshotter:
+    """Takes and restores snapshots of an environment's state. Vectorized environments use this to clone walkers:
+    1 snapshot is taken for each distinct partner, and restored into all of the walkers that cloned it.
+
+    The default pickles the whole environment, subclasses can implement something more compact.
+    """
+
+    def get_state(self, env: gym.Env) -> Any:
+        try:
+            return pickle.dumps(env, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            # ie. locally defined environments. these can still be deep copied, but not sent to other processes.
+            return _DeepcopySnapshot(deepcopy(env))
+
+    def restore_state(self, env: gym.Env, snapshot: Any) -> gym.Env:
+        """Restore the snapshot into `env` and return it. `env` may be replaced by a new object."""
+
+        if isinstance(snapshot, _DeepcopySnapshot):
+            # the snapshot is already a copy, so the first receiver can take it.
+            if snapshot.restored:
+                return deepcopy(snapshot.env)
+            snapshot.restored = True
+            return snapshot.env
+
+        return pickle.loads(snapshot)
+
+
+class AttributeSnapshotter(EnvironmentSnapshotter):
+    """Only snapshots the given attributes of the environment (and each of its wrappers), for environments whose
+    dynamic state is fully held by a few attributes. Restoring is done in-place.
+    """
+
+    def __init__(self, attributes: Sequence[str]):
+        self.attributes = tuple(attributes)
+
+    def get_state(self, env: gym.Env):
+        # only look at each layer's own attributes, wrappers forward missing attributes to the wrapped env.
+        return [
+            {attr: deepcopy(value) for attr, value in vars(layer).items() if attr in self.attributes}
+            for layer in _iter_layers(env)
+        ]
+
+    def restore_state(self, env: gym.Env, snapshot):
+        for layer, attributes in zip(_iter_layers(env), snapshot):
+            for attr, value in attributes.items():
+                setattr(layer, attr, deepcopy(value))
+        return env
+
+
+# CartPole, Acrobot, MountainCar and Pendulum only keep their dynamics in `state` (`steps_beyond_done` for CartPole),
+# the rest are the attributes of the default wrappers (TimeLimit, OrderEnforcing).
+CLASSIC_CONTROL_ATTRIBUTES = ("state", "steps_beyond_done", "_elapsed_steps", "_has_reset")
+
+
+def classic_control_snapshotter() -> AttributeSnapshotter:
+    return AttributeSnapshotter(CLASSIC_CONTROL_ATTRIBUTES)
+
+
+class ALESnapshotter(AttributeSnapshotter):
+    """Atari environments, the emulator state is cloned through the ALE (along with the wrapper attributes)."""
+
+    def __init__(self, attributes: Sequence[str] = ("_elapsed_steps", "_has_reset")):
+        super().__init__(attributes)
+
+    def get_state(self, env: gym.Env):
+        return env.unwrapped.ale.cloneState(), super().get_state(env)
+
+    def restore_state(self, env: gym.Env, snapshot):
+        ale_state, attributes = snapshot
+        env.unwrapped.ale.restoreState(ale_state)
+        return super().restore_state(env, attributes)
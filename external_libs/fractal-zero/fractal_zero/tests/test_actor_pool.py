@@ -0,0 +1,102 @@
+from time import perf_counter, sleep
+from types import SimpleNamespace
+import numpy as np
+import torch
+
+from fractal_zero.data.actor_pool import ActorPool
+from fractal_zero.data.replay_buffer import GameHistory, ReplayBuffer
+
+
+class _ConstantActor:
+    def __init__(self):
+        self.model = torch.nn.Linear(1, 1, bias=False)
+        torch.nn.init.zeros_(self.model.weight)
+
+    def play_episode(self):
+        # the episode records the weight it was played with.
+        game = GameHistory(np.zeros(2))
+        weight = self.model.weight.item()
+        for _ in range(3):
+            game.append(0, np.ones(2), 1.0, weight)
+        return game
+
+
+def test_actor_pool():
+    config = SimpleNamespace(
+        max_replay_buffer_size=16,
+        replay_buffer_pop_strategy="oldest",
+        max_game_steps=8,
+        minimize_batch_padding=True,
+    )
+    replay_buffer = ReplayBuffer(config)
+
+    learner = torch.nn.Linear(1, 1, bias=False)
+    torch.nn.init.constant_(learner.weight, 1.0)
+
+    pool = ActorPool(_ConstantActor, num_actors=2, model=learner, weight_sync_interval=2, max_queued_episodes=4)
+
+    try:
+        # every episode is played with the learner's initial weights.
+        episodes = pool.get_episodes(min_episodes=4, timeout=30)
+        assert len(episodes) >= 4
+        assert all(episode.values[-1] == 1.0 for episode in episodes)
+
+        assert pool.fill_replay_buffer(replay_buffer, min_episodes=1, timeout=30) >= 1
+        assert len(replay_buffer) >= 1
+
+        # the 2nd step broadcasts the new weights, eventually every actor plays with them.
+        torch.nn.init.constant_(learner.weight, 2.0)
+        pool.step(learner)
+        pool.step(learner)
+        assert pool.weight_version == 2
+
+        values = []
+        for _ in range(100):
+            episodes = pool.get_episodes(min_episodes=1, timeout=30)
+            values.extend(episode.values[-1] for episode in episodes)
+            if values[-1] == 2.0 and len(set(values[-4:])) == 1:
+                break
+        assert values[-1] == 2.0
+        assert set(values) <= {1.0, 2.0}
+
+        stats = pool.get_stats()
+        assert stats["actors/num_episodes"] >= 5
+        assert 0 <= stats["actors/learner_utilisation"] <= 1
+    finally:
+        pool.close()
+
+
+class _SlowActor:
+    def __init__(self):
+        # bigger than a pipe's buffer.
+        self.model = torch.nn.Linear(256, 256)
+
+    def play_episode(self):
+        sleep(2)
+        game = GameHistory(np.zeros(2))
+        game.append(0, np.ones(2), 1.0, self.model.bias[0].item())
+        return game
+
+
+def test_broadcast_does_not_wait_on_busy_actors():
+    learner = torch.nn.Linear(256, 256)
+    pool = ActorPool(_SlowActor, num_actors=1, model=learner)
+
+    try:
+        # the actor is busy with it's first episode.
+        sleep(0.5)
+
+        start = perf_counter()
+        for i in range(5):
+            torch.nn.init.constant_(learner.bias, float(i))
+            pool.step(learner)
+        assert perf_counter() - start < 1.0
+
+        # stale weights were replaced, the actor eventually plays with the latest.
+        for _ in range(4):
+            episodes = pool.get_episodes(min_episodes=1, timeout=30)
+            if episodes[-1].values[-1] == 4.0:
+                break
+        assert episodes[-1].values[-1] == 4.0
+    finally:
+        pool.close()
@@ -236,3 +236,94 @@ def test_cartpole_consistently_high_reward():
 
     # 200 is the max reward accumulate-able in cartpole.
     _assert_mean_total_rewards(fmc, 400, 140)
+
+
+@pytest.mark.parametrize("with_freeze", [True, False])
+@pytest.mark.parametrize("track_tree", [True, False])
+def test_device_resident(with_freeze, track_tree):
+    class DummyEnvironment:
+        def __init__(self):
+            self.reset()
+            self.action_space = gym.spaces.Discrete(3)
+
+        def reset(self):
+            self.state = 0
+            return self.state
+
+        def step(self, action):
+            self.state += action
+            return float(self.state), action, False, {}
+
+    n = 16
+    steps = 16
+    vec_env = SerialVectorizedEnvironment(DummyEnvironment(), n=n)
+
+    fmc = FMC(
+        vec_env,
+        freeze_best=with_freeze,
+        track_tree=track_tree,
+        use_array_tree=True,
+        device_resident=True,
+    )
+
+    for step in range(steps):
+        fmc.simulate(1)
+
+        assert (fmc.scores <= (step + 1) * 2).all()
+        assert fmc.states.tolist() == fmc.observations
+        np.testing.assert_allclose(fmc.scores.numpy(), fmc.states.numpy())
+
+        if track_tree:
+            np.testing.assert_allclose(fmc.scores.numpy(), fmc.tree.get_total_rewards())
+            np.testing.assert_allclose(fmc.depths.numpy(), fmc.tree.get_depths())
+
+
+@pytest.mark.parametrize("use_average_rewards", [True, False])
+def test_freeze_mask_matches_device_resident(use_average_rewards):
+    n = 8
+    scores = torch.tensor([3, 1, 0, 5, 2, 0, 4, 1], dtype=float)
+    average_rewards = torch.tensor([0, 2, 1, 1, 0, 6, 1, 3], dtype=float)
+
+    freeze_masks = []
+    for device_resident in (True, False):
+        vec_env = SerialVectorizedEnvironment("CartPole-v0", n=n)
+        fmc = FMC(vec_env, use_average_rewards=use_average_rewards, device_resident=device_resident)
+        fmc.scores = scores.clone()
+        fmc.average_rewards = average_rewards.clone()
+
+        fmc._set_freeze_mask()
+        freeze_masks.append(fmc.freeze_mask.tolist())
+
+    expected = 5 if use_average_rewards else 3
+    assert freeze_masks[0] == freeze_masks[1] == [i == expected for i in range(n)]
+
+
+@pytest.mark.parametrize("use_array_tree", [True, False])
+@pytest.mark.parametrize("device_resident", [True, False])
+def test_walker_counters_match_tree(use_array_tree, device_resident):
+    n = 16
+    vec_env = SerialVectorizedEnvironment("CartPole-v0", n=n)
+    fmc = FMC(vec_env, use_array_tree=use_array_tree, device_resident=device_resident)
+
+    for _ in range(64):
+        fmc.simulate(1)
+        if fmc.did_early_exit:
+            break
+
+        np.testing.assert_allclose(fmc.depths.numpy(), fmc.tree.get_depths())
+        assert fmc.best_first_action == fmc.tree.best_path.first_action
+        assert [path.first_action for path in fmc.tree.walker_paths] == list(fmc.first_actions)
+
+
+@pytest.mark.parametrize("device_resident", [True, False])
+def test_tree_free(device_resident):
+    n = 16
+    vec_env = SerialVectorizedEnvironment("CartPole-v0", n=n)
+    fmc = FMC(vec_env, track_tree=False, use_average_rewards=True, device_resident=device_resident)
+
+    fmc.simulate(64)
+
+    assert fmc.tree is None
+    assert fmc.best_first_action in (0, 1)
+    assert fmc.scores.max() > 20
+    assert (fmc.depths <= 65).all()
@@ -9,6 +9,7 @@ from fractal_zero.loss.space_loss import (
     DictSpaceLoss,
     DiscreteSpaceLoss,
     SpaceLoss,
+    stack_dict_samples,
 )
 
 
@@ -126,3 +127,101 @@ def test_dict():
     bloss = criterion(a0_batch, a1_batch)
     bloss.backward()
     assert torch.isclose(bloss, torch.tensor(3.3352), rtol=0.0001)
+
+
+def _looped_weighted_loss(criterion, x, targets, weights, mask):
+    loss = 0
+    for y, action_targets, action_weights, action_mask in zip(x, targets, weights, mask):
+        for target, weight in zip(action_targets[action_mask], action_weights[action_mask]):
+            loss += criterion(y, target) * weight
+    return loss / len(x)
+
+
+def test_weighted_loss():
+    n, k = 6, 4
+    weights = torch.rand(n, k)
+    mask = torch.rand(n, k) < 0.7
+    mask[:, 0] = True
+    weights[~mask] = 0
+
+    # discrete mse (ie. a sigmoid policy output)
+    criterion = DiscreteSpaceLoss(spaces.Discrete(2))
+    x = torch.rand(n, 1)
+    targets = torch.randint(0, 2, (n, k))
+    expected = _looped_weighted_loss(criterion, x, targets, weights, mask)
+    assert torch.isclose(criterion.weighted_loss(x, targets, weights), expected)
+
+    # discrete cross entropy
+    criterion = DiscreteSpaceLoss(spaces.Discrete(5), loss_func=F.cross_entropy)
+    x = torch.randn(n, 5)
+    targets = torch.randint(0, 5, (n, k))
+    expected = _looped_weighted_loss(criterion, x, targets, weights, mask)
+    assert torch.isclose(criterion.weighted_loss(x, targets, weights), expected)
+
+    # box
+    criterion = BoxSpaceLoss(spaces.Box(low=0, high=2, shape=(3,)))
+    x = torch.rand(n, 3)
+    targets = torch.rand(n, k, 3)
+    expected = _looped_weighted_loss(criterion, x, targets, weights, mask)
+    assert torch.isclose(criterion.weighted_loss(x, targets, weights), expected)
+
+
+def test_batched_dict_loss():
+    n = 8
+    space = spaces.Dict(
+        {
+            "forward": spaces.Discrete(2),
+            "hotbar": spaces.Discrete(9),
+            "camera": spaces.Box(low=-180, high=180, shape=(2,)),
+            "nested": spaces.Dict({"jump": spaces.Discrete(2), "pitch": spaces.Box(low=0, high=1, shape=(3,))}),
+        }
+    )
+    criterion = DictSpaceLoss(space, loss_spec={"hotbar": F.cross_entropy})
+
+    def _prediction():
+        return {
+            "forward": torch.rand(()),
+            "hotbar": torch.randn(9),
+            "camera": torch.randn(2),
+            "nested": {"jump": torch.rand(()), "pitch": torch.rand(3)},
+        }
+
+    x = [_prediction() for _ in range(n)]
+    t = [space.sample() for _ in range(n)]
+    weights = torch.rand(n)
+
+    losses = torch.stack([criterion(x_sample, t_sample) for x_sample, t_sample in zip(x, t)])
+
+    x_batch = stack_dict_samples(x)
+    t_batch = stack_dict_samples(t)
+    assert x_batch["nested"]["pitch"].shape == (n, 3)
+
+    assert torch.isclose(criterion.batched_loss(x_batch, t_batch), losses.mean())
+    assert torch.isclose(criterion.batched_loss(x_batch, t_batch, weights), (losses * weights).sum() / n)
+    assert torch.isclose(criterion(x, t), losses.mean())
+
+
+def test_loss_func_without_reduction():
+    n, k = 6, 3
+    space = spaces.Dict({"forward": spaces.Discrete(2), "camera": spaces.Box(low=-180, high=180, shape=(2,))})
+
+    def _abs_loss(x, y):
+        return (x - y).abs().sum()
+
+    criterion = DictSpaceLoss(space, loss_spec={"forward": _abs_loss, "camera": _abs_loss})
+
+    x = [{"forward": torch.rand(()), "camera": torch.randn(2)} for _ in range(n)]
+    t = [space.sample() for _ in range(n)]
+    losses = torch.stack([criterion(x_sample, t_sample) for x_sample, t_sample in zip(x, t)])
+    assert torch.isclose(criterion(x, t), losses.mean())
+
+    weights = torch.rand(n, k)
+    mask = torch.rand(n, k) < 0.7
+    mask[:, 0] = True
+    weights[~mask] = 0
+
+    box_criterion = criterion.funcs["camera"]
+    x = torch.randn(n, 2)
+    targets = torch.randn(n, k, 2)
+    expected = _looped_weighted_loss(box_criterion, x, targets, weights, mask)
+    assert torch.isclose(box_criterion.weighted_loss(x, targets, weights), expected)
@@ -0,0 +1,128 @@
+import gym
+import numpy as np
+import torch
+
+from fractal_zero.models.dynamics import FullyConnectedDynamicsModel
+from fractal_zero.models.joint_model import JointModel
+from fractal_zero.models.prediction import FullyConnectedPredictionModel
+from fractal_zero.models.representation import FullyConnectedRepresentationModel
+from fractal_zero.search.fmc import FMC
+from fractal_zero.search.multi_swarm import MultiSwarmFMC
+from fractal_zero.vectorized_environment import SerialVectorizedEnvironment, VectorizedDynamicsModelEnvironment
+
+import pytest
+
+
+class _CountingEnvironment(gym.Env):
+    # the observation is the sum of all actions, which is also the walker's score.
+
+    action_space = gym.spaces.Discrete(3)
+    observation_space = gym.spaces.Box(low=0, high=np.inf, shape=())
+
+    def reset(self):
+        self.state = 0
+        return self.state
+
+    def step(self, action):
+        self.state += action
+        return float(self.state), action, False, {}
+
+
+def _make_vec_env():
+    return SerialVectorizedEnvironment(_CountingEnvironment(), n=8)
+
+
+def _make_dynamics_vec_env():
+    # every swarm builds it's own copy of the same dynamics model.
+    torch.manual_seed(0)
+    env = gym.make("CartPole-v0")
+    joint_model = JointModel(
+        FullyConnectedRepresentationModel(env, 8),
+        FullyConnectedDynamicsModel(env, 8),
+        FullyConnectedPredictionModel(env, 8),
+    )
+    return VectorizedDynamicsModelEnvironment(env, 8, joint_model)
+
+
+def _assert_consistent(fmc: FMC):
+    np.testing.assert_allclose(fmc.states.numpy(), fmc.scores.numpy())
+    assert [env.get_state().state for env in fmc.vec_env.envs] == fmc.scores.tolist()
+
+
+def test_import_walkers():
+    fmc_a = FMC(_make_vec_env(), track_tree=False)
+    fmc_b = FMC(_make_vec_env(), track_tree=False, balance=0.1)
+    fmc_a.simulate(8)
+    fmc_b.simulate(2)
+
+    top_walkers = torch.argsort(fmc_a.scores, descending=True)[:2].tolist()
+    worst_walkers = torch.argsort(fmc_b.scores)[:2].tolist()
+    fmc_b.import_walkers(worst_walkers, fmc_a.export_walkers(top_walkers))
+
+    np.testing.assert_allclose(fmc_b.scores[worst_walkers].numpy(), fmc_a.scores[top_walkers].numpy())
+    assert fmc_b.best_walker in worst_walkers
+    assert fmc_b.freeze_mask[fmc_b.best_walker]
+    _assert_consistent(fmc_b)
+
+    # imported walkers keep stepping from the state they were exported in.
+    for _ in range(4):
+        fmc_b.simulate(1)
+        _assert_consistent(fmc_b)
+
+
+def test_import_dynamics_model_walkers():
+    fmc_a = FMC(_make_dynamics_vec_env(), track_tree=False)
+    fmc_b = FMC(_make_dynamics_vec_env(), track_tree=False)
+    fmc_a.simulate(8)
+    fmc_b.simulate(2)
+
+    top_walkers = torch.argsort(fmc_a.scores, descending=True)[:2].tolist()
+    worst_walkers = torch.argsort(fmc_b.scores)[:2].tolist()
+    fmc_b.import_walkers(worst_walkers, fmc_a.export_walkers(top_walkers))
+
+    state_b = fmc_b.vec_env.dynamics_model.state
+    assert torch.equal(state_b[worst_walkers], fmc_a.vec_env.dynamics_model.state[top_walkers])
+    assert torch.equal(fmc_b.states, state_b)
+
+    fmc_b.simulate(2)
+    assert torch.equal(fmc_b.states, fmc_b.vec_env.dynamics_model.state)
+
+
+def test_multi_swarm_dynamics_model():
+    multi_swarm = MultiSwarmFMC(_make_dynamics_vec_env, num_swarms=2, exchange_interval=2, num_exchanged=2)
+
+    try:
+        multi_swarm.simulate(8)
+        assert multi_swarm.num_migrations > 0
+        assert multi_swarm.best_first_action in (0, 1)
+    finally:
+        multi_swarm.close()
+
+
+@pytest.mark.parametrize("exchange_topology", ["ring", "best_to_all"])
+@pytest.mark.parametrize("merge_policy", ["best", "vote"])
+def test_multi_swarm(exchange_topology, merge_policy):
+    multi_swarm = MultiSwarmFMC(
+        _make_vec_env,
+        num_swarms=3,
+        exchange_interval=2,
+        num_exchanged=2,
+        exchange_topology=exchange_topology,
+        merge_policy=merge_policy,
+    )
+
+    try:
+        multi_swarm.simulate(16)
+        assert multi_swarm.num_migrations > 0
+
+        results = multi_swarm.get_results()
+        assert len(results) == 3
+        assert all(0 < result["score"] <= 32 for result in results)
+        assert multi_swarm.best_first_action in (0, 1, 2)
+
+        root = _CountingEnvironment()
+        multi_swarm.set_root(root, root.reset())
+        multi_swarm.simulate(1)
+        assert all(result["score"] <= 2 for result in multi_swarm.get_results())
+    finally:
+        multi_swarm.close()
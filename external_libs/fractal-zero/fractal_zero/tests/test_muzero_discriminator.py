@@ -0,0 +1,56 @@
+import torch
+import torch.nn.functional as F
+
+from fractal_zero.trainers.muzero_discriminator import FMZGModel, pad_trajectories
+
+
+def _make_model(embedding_size: int = 8) -> FMZGModel:
+    torch.manual_seed(0)
+    return FMZGModel(
+        "CartPole-v0",
+        representation_model=torch.nn.Linear(4, embedding_size),
+        dynamics_model=torch.nn.Linear(embedding_size + 1, embedding_size),
+        discriminator_model=torch.nn.Sequential(torch.nn.Linear(embedding_size + 1, 1), torch.nn.Sigmoid()),
+        num_walkers=4,
+        action_vectorizer=lambda action: action,
+    )
+
+
+def _unroll_reference(model: FMZGModel, observations, embedded_actions):
+    # step by step, one trajectory at a time.
+    representations = model.representation.forward(observations)
+    latent_state = representations[0]
+
+    confusions = []
+    self_consistencies = []
+    for step in range(len(embedded_actions)):
+        x = torch.cat((latent_state, embedded_actions[step].unsqueeze(0)), dim=-1)
+        latent_state = model.dynamics.forward(x)
+        confusions.append(model.discriminator.forward(x))
+        self_consistencies.append(F.mse_loss(latent_state, representations[step]))
+    return torch.cat(confusions), torch.stack(self_consistencies)
+
+
+def test_discriminate_trajectories_matches_single():
+    model = _make_model()
+
+    lengths = [5, 1, 9, 3]
+    observations = [torch.randn(length, 4) for length in lengths]
+    actions = [torch.randint(0, 2, (length,)).float() for length in lengths]
+    labels = [torch.ones(length) for length in lengths]
+
+    x, y, _, mask = pad_trajectories(observations, actions, labels)
+    assert x.shape == (4, 9, 4) and mask.shape == (4, 9)
+
+    confusions, self_consistencies = model.discriminate_trajectories(x, y, mask)
+    assert confusions.shape == self_consistencies.shape == (4, 9)
+
+    for i, length in enumerate(lengths):
+        expected_confusions, expected_consistencies = _unroll_reference(model, observations[i], actions[i])
+        torch.testing.assert_close(confusions[i, :length], expected_confusions)
+        torch.testing.assert_close(self_consistencies[i, :length], expected_consistencies)
+        assert (confusions[i, length:] == 0).all()
+
+        single_confusions, consistency = model.discriminate_single_trajectory(observations[i], actions[i])
+        torch.testing.assert_close(single_confusions, expected_confusions)
+        torch.testing.assert_close(consistency, expected_consistencies.mean())
@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+import numpy as np
+
+from fractal_zero.data.replay_buffer import GameHistory, ReplayBuffer
+
+import pytest
+
+
+def _make_game(length: int, offset: float) -> GameHistory:
+    game = GameHistory(np.full(4, offset))
+    for i in range(1, length):
+        game.append(i % 2, np.full(4, offset + i), float(i), offset + i)
+    return game
+
+
+def _make_config(**kwargs):
+    config = dict(
+        max_replay_buffer_size=4,
+        replay_buffer_pop_strategy="oldest",
+        max_game_steps=8,
+        minimize_batch_padding=True,
+    )
+    config.update(kwargs)
+    return SimpleNamespace(**config)
+
+
+@pytest.mark.parametrize("minimize_batch_padding", [True, False])
+def test_clips_match_games(minimize_batch_padding):
+    config = _make_config(minimize_batch_padding=minimize_batch_padding)
+    replay_buffer = ReplayBuffer(config)
+
+    # the last game is longer than `max_game_steps`, and the first one is evicted.
+    lengths = [3, 9, 5, 7, 12]
+    games = [_make_game(length, offset=100 * i) for i, length in enumerate(lengths)]
+    for game in games:
+        replay_buffer.append(game)
+
+    assert len(replay_buffer) == 4
+    assert sorted(replay_buffer.get_episode_lengths()) == sorted(lengths[1:])
+    games_by_offset = {game.observations[0][0]: game for game in games[1:]}
+
+    clip_length = 6
+    observations, actions, rewards, values, mask = replay_buffer.sample_clips(64, clip_length)
+    assert observations.shape == (64, clip_length, 4)
+    assert mask.shape == rewards.shape == values.shape == actions.shape == (64, clip_length)
+
+    for i in range(64):
+        # each frame's observation encodes its game and position in it.
+        game = games_by_offset[observations[i, 0, 0] - rewards[i, 0]]
+        start = int(rewards[i, 0])
+        num_frames = int(mask[i].sum())
+
+        assert num_frames == min(clip_length, len(game) - start)
+        if minimize_batch_padding and len(game) > clip_length:
+            assert num_frames == clip_length
+
+        expected = [game[t] for t in range(start, start + num_frames)]
+        np.testing.assert_allclose(observations[i, :num_frames], [e[0] for e in expected])
+        np.testing.assert_allclose(actions[i, :num_frames], [e[1] for e in expected])
+        np.testing.assert_allclose(values[i, :num_frames], [e[3] for e in expected])
+
+        assert (observations[i, num_frames:] == 0).all()
+        assert (values[i, num_frames:] == 0).all()
+
+
+def test_random_pop_strategy():
+    replay_buffer = ReplayBuffer(_make_config(replay_buffer_pop_strategy="random"))
+
+    for i in range(10):
+        replay_buffer.append(_make_game(4, offset=i))
+
+    assert len(replay_buffer) == 4
+    observations, _, _, _, mask = replay_buffer.sample_clips(8, 4)
+    assert mask.all()
+    assert observations.shape == (8, 4, 4)
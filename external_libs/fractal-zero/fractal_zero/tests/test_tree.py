@@ -1,5 +1,11 @@
+import gym.spaces as spaces
+import networkx as nx
 import numpy as np
+import torch
 
+from fractal_zero.data.tree_sampler import TreeSampler
+from fractal_zero.loss.space_loss import DictSpaceLoss
+from fractal_zero.search.array_tree import ArrayGameTree
 from fractal_zero.search.tree import GameTree
 import pytest
 
@@ -44,3 +50,132 @@ def test_tree(prune):
 
     assert tree.g.in_degree(tree.root) == 0
     assert tree.root.num_child_walkers == n
+
+
+@pytest.mark.parametrize("prune", [True, False])
+@pytest.mark.parametrize("with_freeze", [True, False])
+def test_array_tree_matches_game_tree(prune, with_freeze):
+    n = 16
+    steps = 24
+    rng = np.random.default_rng(0)
+
+    tree = GameTree(n, root_observation=0, prune=prune)
+    array_tree = ArrayGameTree(n, root_observation=0, prune=prune, initial_capacity=8)
+
+    for _ in range(steps):
+        actions = rng.integers(0, 3, size=n).tolist()
+        observations = rng.normal(size=n).tolist()
+        rewards = rng.normal(size=n)
+        infos = [{} for _ in range(n)]
+        freeze_mask = np.zeros(n, dtype=bool)
+        if with_freeze:
+            freeze_mask[rng.integers(n)] = True
+
+        tree.build_next_level(actions, observations, rewards, infos, freeze_mask)
+        array_tree.build_next_level(actions, observations, rewards, infos, freeze_mask)
+
+        partners = rng.integers(0, n, size=n)
+        clone_mask = rng.random(n) < 0.3
+        tree.clone(partners, clone_mask)
+        array_tree.clone(partners, clone_mask)
+
+        np.testing.assert_allclose(array_tree.get_total_rewards(), tree.get_total_rewards())
+        np.testing.assert_allclose(array_tree.get_depths(), tree.get_depths())
+        assert array_tree.last_actions == tree.last_actions
+        assert len(array_tree.nodes) == tree.g.number_of_nodes()
+
+    assert array_tree.best_path.total_reward == tree.best_path.total_reward
+    assert array_tree.root.num_child_walkers == tree.root.num_child_walkers == n
+
+    for path, array_path in zip(tree.walker_paths, array_tree.walker_paths):
+        assert len(path) == len(array_path)
+        for state, array_state in zip(path.ordered_states, array_path.ordered_states):
+            assert state.observation == array_state.observation
+            assert state.num_child_walkers == array_state.num_child_walkers
+            assert state.visits == array_state.visits
+        assert [a for _, a in path] == [a for _, a in array_path]
+
+    g = array_tree.g
+    assert nx.is_tree(g)
+    assert g.number_of_edges() == tree.g.number_of_edges()
+
+
+@pytest.mark.parametrize("tree_class", [GameTree, ArrayGameTree])
+@pytest.mark.parametrize("weight_type", ["walker_children_ratio", "constant"])
+def test_padded_batch_matches_batch(tree_class, weight_type):
+    n = 16
+    rng = np.random.default_rng(0)
+
+    tree = tree_class(n, root_observation=np.zeros(3), prune=True)
+    for _ in range(12):
+        actions = rng.integers(0, 3, size=n).tolist()
+        observations = list(rng.normal(size=(n, 3)))
+        tree.build_next_level(actions, observations, rng.normal(size=n), [{} for _ in range(n)])
+        tree.clone(rng.integers(0, n, size=n), rng.random(n) < 0.3)
+
+    sampler = TreeSampler(tree, sample_type="all_nodes", weight_type=weight_type)
+    observations, actions, weights, _, _ = sampler.get_batch()
+    batch = sampler.get_padded_batch()
+
+    assert len(batch) == len(observations)
+    assert batch.child_actions.shape == batch.child_weights.shape == batch.mask.shape
+    assert batch.mask.shape[1] == max(len(a) for a in actions)
+
+    for i in range(len(batch)):
+        mask = batch.mask[i]
+        np.testing.assert_allclose(batch.observations[i].numpy(), observations[i])
+        assert batch.child_actions[i][mask].tolist() == actions[i]
+        np.testing.assert_allclose(batch.child_weights[i][mask].numpy(), weights[i])
+        assert (batch.child_weights[i][~mask] == 0).all()
+
+
+def test_padded_batch_of_reset_array_tree():
+    tree = ArrayGameTree(4, root_observation=np.zeros(3), prune=True)
+
+    assert tree.gather_observations(np.array([], dtype=np.int64)).shape == (0, 3)
+    assert tree.gather_actions(np.array([], dtype=np.int64)).shape == (0,)
+
+    batch = TreeSampler(tree, sample_type="all_nodes").get_padded_batch()
+    assert len(batch) == 0
+    assert batch.observations.shape == (0, 3)
+    assert batch.child_actions.shape == batch.child_weights.shape == batch.mask.shape == (0, 0)
+
+
+@pytest.mark.parametrize("tree_class", [GameTree, ArrayGameTree])
+def test_padded_batch_dict_actions(tree_class):
+    n = 8
+    rng = np.random.default_rng(0)
+    space = spaces.Dict({"forward": spaces.Discrete(2), "camera": spaces.Box(low=-1, high=1, shape=(2,))})
+    space.seed(0)
+
+    tree = tree_class(n, root_observation=np.zeros(3), prune=True)
+    for _ in range(6):
+        actions = [space.sample() for _ in range(n)]
+        observations = list(rng.normal(size=(n, 3)))
+        tree.build_next_level(actions, observations, rng.normal(size=n), [{} for _ in range(n)])
+        tree.clone(rng.integers(0, n, size=n), rng.random(n) < 0.3)
+
+    sampler = TreeSampler(tree, sample_type="all_nodes", weight_type="walker_children_ratio")
+    observations, actions, weights, _, _ = sampler.get_batch()
+    batch = sampler.get_padded_batch()
+
+    assert len(batch) == len(observations)
+    assert batch.child_actions["forward"].shape == batch.mask.shape
+    assert batch.child_actions["camera"].shape == (*batch.mask.shape, 2)
+
+    for i in range(len(batch)):
+        mask = batch.mask[i]
+        assert batch.child_actions["forward"][i][mask].tolist() == [a["forward"] for a in actions[i]]
+        np.testing.assert_allclose(batch.child_actions["camera"][i][mask].numpy(), [a["camera"] for a in actions[i]])
+
+    criterion = DictSpaceLoss(space)
+    predictions = {"forward": torch.rand(len(batch)), "camera": torch.randn(len(batch), 2)}
+    expected = 0
+    for i, (action_targets, action_weights) in enumerate(zip(actions, weights)):
+        prediction = {key: value[i] for key, value in predictions.items()}
+        for target, weight in zip(action_targets, action_weights):
+            expected += criterion(prediction, target) * weight
+    expected /= len(batch)
+
+    loss = criterion.weighted_loss(predictions, batch.child_actions, batch.child_weights)
+    assert torch.isclose(loss, torch.as_tensor(expected, dtype=loss.dtype))
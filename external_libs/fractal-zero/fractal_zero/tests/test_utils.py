@@ -2,7 +2,7 @@
 import numpy as np
 import torch
 
-from fractal_zero.utils import cloning_primitive
+from fractal_zero.utils import cloning_primitive, gather_cloning_primitive
 
 
 def test_cloning_primitive():
@@ -24,9 +24,13 @@ def test_cloning_primitive():
             torch.tensor(x.copy()), torch.tensor(partners), torch.tensor(clone_mask)
         )
         list_cloned = cloning_primitive(x.copy().tolist(), partners, clone_mask)
+        gather_cloned = gather_cloning_primitive(
+            torch.tensor(x.copy()), torch.tensor(partners), torch.tensor(clone_mask)
+        )
 
         np.testing.assert_equal(x, orig_x)
         assert np_cloned.tolist() == list_cloned
         assert th_cloned.tolist() == list_cloned
+        assert gather_cloned.tolist() == list_cloned
 
     np.random.seed()
@@ -0,0 +1,142 @@
+import gym
+import numpy as np
+import torch
+
+from fractal_zero.batched_classic_control import BatchedAcrobot, BatchedCartPole, BatchedMountainCar
+from fractal_zero.search.fmc import FMC
+from fractal_zero.snapshots import classic_control_snapshotter
+from fractal_zero.vectorized_environment import (
+    SerialVectorizedEnvironment,
+    SubprocessVectorizedEnvironment,
+)
+
+import pytest
+
+
+def _make_env(seed: int = 0):
+    env = gym.make("CartPole-v0")
+    env.reset(seed=seed)
+    return env
+
+
+@pytest.mark.parametrize("num_workers", [1, 3])
+def test_subprocess_matches_serial(num_workers):
+    n = 8
+    rng = np.random.default_rng(0)
+
+    # both copy the same (already reset) environment for each walker.
+    env = _make_env()
+    serial = SerialVectorizedEnvironment(env, n=n)
+    subprocess = SubprocessVectorizedEnvironment(env, n=n, num_workers=num_workers)
+
+    try:
+        for step in range(16):
+            actions = rng.integers(0, 2, size=n).tolist()
+            frozen_mask = torch.zeros(n, dtype=bool)
+            if step > 0:
+                frozen_mask[rng.integers(n)] = True
+
+            expected = serial.batch_step(actions, frozen_mask)
+            actual = subprocess.batch_step(actions, frozen_mask)
+
+            np.testing.assert_allclose(actual[0].numpy(), expected[0].numpy())
+            np.testing.assert_allclose(actual[2].numpy(), expected[2].numpy())
+            np.testing.assert_equal(actual[3].numpy(), expected[3].numpy())
+
+            partners = rng.integers(0, n, size=n)
+            clone_mask = rng.random(n) < 0.5
+            serial.clone(partners, clone_mask)
+            subprocess.clone(partners, clone_mask)
+    finally:
+        subprocess.close()
+
+
+def test_subprocess_fmc():
+    n = 16
+    vec_env = SubprocessVectorizedEnvironment("CartPole-v0", n=n, num_workers=4)
+
+    try:
+        fmc = FMC(vec_env, use_array_tree=True)
+        fmc.simulate(32)
+
+        np.testing.assert_allclose(fmc.scores.numpy(), fmc.tree.get_total_rewards())
+        assert fmc.tree.best_path.total_reward > 0
+    finally:
+        vec_env.close()
+
+
+@pytest.mark.parametrize("vec_env_class", [SerialVectorizedEnvironment, SubprocessVectorizedEnvironment])
+def test_classic_control_snapshots_match_pickle(vec_env_class):
+    n = 8
+    rng = np.random.default_rng(1)
+
+    env = _make_env()
+    pickled = SerialVectorizedEnvironment(env, n=n)
+    snapshotted = vec_env_class(env, n=n, snapshotter=classic_control_snapshotter())
+
+    try:
+        for _ in range(32):
+            actions = rng.integers(0, 2, size=n).tolist()
+            frozen_mask = torch.zeros(n, dtype=bool)
+
+            expected = pickled.batch_step(actions, frozen_mask)
+            actual = snapshotted.batch_step(actions, frozen_mask)
+
+            np.testing.assert_allclose(actual[0].numpy(), expected[0].numpy())
+            np.testing.assert_equal(actual[3].numpy(), expected[3].numpy())
+
+            # many walkers clone the same few partners.
+            partners = rng.integers(0, 2, size=n)
+            clone_mask = rng.random(n) < 0.5
+            pickled.clone(partners, clone_mask)
+            snapshotted.clone(partners, clone_mask)
+    finally:
+        if hasattr(snapshotted, "close"):
+            snapshotted.close()
+
+
+@pytest.mark.parametrize("batched_class", [BatchedCartPole, BatchedMountainCar])
+def test_batched_classic_control_matches_serial(batched_class):
+    n = 8
+    rng = np.random.default_rng(2)
+
+    env = gym.make(batched_class.env_id)
+    env.reset(seed=0)
+    serial = SerialVectorizedEnvironment(env, n=n)
+    batched = batched_class(n)
+    batched.set_all_states(env, None)
+
+    # long enough for cartpoles to fall (and keep stepping after they're done).
+    for step in range(64):
+        actions = batched.batched_action_space_sample()
+        frozen_mask = torch.zeros(n, dtype=bool)
+        if step > 0:
+            frozen_mask[rng.integers(n)] = True
+
+        expected = serial.batch_step(actions.tolist(), frozen_mask)
+        actual = batched.batch_step(actions, frozen_mask)
+
+        np.testing.assert_allclose(actual[1], np.stack(expected[1]), rtol=1e-5, atol=1e-6)
+        np.testing.assert_allclose(actual[2].numpy(), expected[2].numpy())
+        np.testing.assert_equal(actual[3].numpy(), expected[3].numpy())
+
+        partners = rng.integers(0, n, size=n)
+        clone_mask = rng.random(n) < 0.5
+        serial.clone(partners, clone_mask)
+        batched.clone(partners, clone_mask)
+
+
+@pytest.mark.parametrize("batched_class", [BatchedCartPole, BatchedAcrobot, BatchedMountainCar])
+def test_batched_classic_control_fmc(batched_class):
+    vec_env = batched_class(64, seed=0)
+
+    fmc = FMC(vec_env, use_array_tree=True)
+    fmc.simulate(32)
+
+    np.testing.assert_allclose(fmc.scores.numpy(), fmc.tree.get_total_rewards())
+    assert fmc.observations.shape == (64, vec_env.observations.shape[-1])
+
+    # snapshots round trip.
+    snapshots = vec_env.get_snapshots([0, 1])
+    vec_env.restore_snapshots({1: snapshots[0], 0: snapshots[1]})
+    np.testing.assert_equal(vec_env.get_snapshots([1, 0]), snapshots)
@@ -1,6 +1,7 @@
 import gym
 import torch
 import torch.nn.functional as F
+from torch.nn.utils.rnn import pad_sequence
 import numpy as np
 
 from typing import Callable, Union
@@ -106,34 +107,68 @@ class FMZGModel(VectorizedEnvironment):
     def clone(self, partners, clone_mask):
         self.states[clone_mask] = self.states[partners[clone_mask]]
 
-    def discriminate_single_trajectory(self, observations, embedded_actions):
-        # TODO: docstring
+    def discriminate_trajectories(self, observations, embedded_actions, mask):
+        """Discriminate a padded batch of B trajectories (of up to T steps) in a single unroll.
+
+        observations: (B, T, *observation_shape)
+        embedded_actions: (B, T) or (B, T, A)
+        mask: (B, T), False for the padded steps.
+
+        Returns the confusions and self consistencies, both (B, T) and 0 at the padded steps.
+        """
+
         # IMPORTANT NOTE: this forward function does not modify the internal self.states variable of the walkers!
 
+        batch_size, steps = mask.shape
+        if embedded_actions.dim() == 2:
+            embedded_actions = embedded_actions.unsqueeze(-1)
+
         # can use these for self-consistency loss too :D
-        observation_representations = self.representation.forward(observations)
-        assert len(observation_representations) == len(embedded_actions)
+        observation_representations = self.representation.forward(
+            observations.reshape(batch_size * steps, *observations.shape[2:])
+        ).reshape(batch_size, steps, -1)
 
-        steps = embedded_actions.shape[0]
-        confusions = torch.zeros(steps, dtype=float)
-        self_consistencies = torch.zeros(steps, dtype=float)
-        latent_state = observation_representations[0]
+        confusions = []
+        self_consistencies = []
+        latent_states = observation_representations[:, 0]
 
         for step in range(steps):
-            embedded_action = embedded_actions[step]
+            x = torch.cat((latent_states, embedded_actions[:, step]), dim=-1)
 
-            x = torch.cat((latent_state, embedded_action.unsqueeze(0)), dim=-1)
+            latent_states = self.dynamics.forward(x)
+            confusions.append(self.discriminator.forward(x).reshape(batch_size))
 
-            latent_state = self.dynamics.forward(x)
+            # self consistency is how well the latent representations match with the representation function
+            consistency = (latent_states - observation_representations[:, step]) ** 2
+            self_consistencies.append(consistency.mean(dim=-1))
 
-            confusion = self.discriminator.forward(x)
-            confusions[step] = confusion
+        mask = mask.to(latent_states.device)
+        confusions = torch.stack(confusions, dim=1) * mask
+        self_consistencies = torch.stack(self_consistencies, dim=1) * mask
+        return confusions, self_consistencies
 
-            # self consistency is how well the latent representations match with the representation function
-            consistency = F.mse_loss(latent_state, observation_representations[step])
-            self_consistencies[step] = consistency
+    def discriminate_single_trajectory(self, observations, embedded_actions):
+        mask = torch.ones((1, len(observations)), dtype=bool)
+        confusions, self_consistencies = self.discriminate_trajectories(
+            observations.unsqueeze(0), embedded_actions.unsqueeze(0), mask
+        )
+        return confusions[0], self_consistencies[0].mean()
+
+
+def pad_trajectories(observations, actions, labels):
+    """Pad lists of variable length trajectories (as returned by `sample_batch`) into (B, T, ...) tensors along with
+    a (B, T) mask.
+    """
+
+    lengths = torch.tensor([len(x) for x in observations])
+    mask = torch.arange(int(lengths.max())).unsqueeze(0) < lengths.unsqueeze(1)
 
-        return confusions, self_consistencies.mean()
+    return (
+        pad_sequence(list(observations), batch_first=True),
+        pad_sequence(list(actions), batch_first=True),
+        pad_sequence(list(labels), batch_first=True),
+        mask,
+    )
 
 
 class FractalMuZeroDiscriminatorTrainer:
@@ -229,20 +264,25 @@ class FractalMuZeroDiscriminatorTrainer:
                 }
             )
 
-    def _get_discriminator_loss(self, batch):
-        c = 0
-        loss = 0
-        for x, y, labels in zip(*batch):
-            # TODO: config for self consistency loss
-            (
-                confusions,
-                consistency,
-            ) = self.model_environment.discriminate_single_trajectory(
-                x.float(), y.float()
-            )
-            loss += F.mse_loss(confusions, labels)
-            c += 1
-        return loss / c
+    def _get_discriminator_losses(self, *batches):
+        """Scores all of the batches in a single call and returns the loss of each batch (the mean over its
+        trajectories of each trajectory's mean squared error).
+        """
+
+        batch_sizes = [len(batch[0]) for batch in batches]
+        observations, actions, labels = [
+            [item for batch in batches for item in batch[i]] for i in range(3)
+        ]
+        observations, actions, labels, mask = pad_trajectories(
+            [x.float() for x in observations], [y.float() for y in actions], labels
+        )
+
+        # TODO: config for self consistency loss
+        confusions, _ = self.model_environment.discriminate_trajectories(observations, actions, mask)
+
+        squared_errors = (confusions - labels.to(confusions.device)) ** 2 * mask
+        trajectory_losses = squared_errors.sum(dim=1) / mask.sum(dim=1)
+        return [losses.mean() for losses in torch.split(trajectory_losses, batch_sizes)]
 
     def train_step(self):
         self.model_environment.train()
@@ -256,8 +296,7 @@ class FractalMuZeroDiscriminatorTrainer:
         # TODO: both should OPTIONALLY share the dynamics function backbone. if the gen and discrim should NOT have
         # a shared backbone, the policy model's dynamics function should be used by FMC.
 
-        agent_loss = self._get_discriminator_loss(self.agent_batch)
-        expert_loss = self._get_discriminator_loss(self.expert_batch)
+        agent_loss, expert_loss = self._get_discriminator_losses(self.agent_batch, self.expert_batch)
         discriminator_loss = (agent_loss + expert_loss) / 2
 
         discriminator_loss.backward()
@@ -20,6 +20,7 @@ class OfflineFMCPolicyTrainer:
         policy_model: torch.nn.Module,
         optimizer: torch.optim.Optimizer,
         loss_spec=None,
+        param_tracking_interval: int = 16,
     ):
         self.fmc = fmc
         self.env = eval_env
@@ -31,6 +32,12 @@ class OfflineFMCPolicyTrainer:
         self.most_reward = float("-inf")
         self.best_model = None
 
+        # instead of copying the parameters every step, the parameter distance is measured every
+        # `param_tracking_interval` train steps (against the snapshot taken at the previous measurement).
+        self.param_tracking_interval = param_tracking_interval
+        self.train_steps = 0
+        self._params_snapshot = None
+
     def generate_episode_data(self, max_steps: int):
         self.fmc.reset()
 
@@ -45,34 +52,21 @@ class OfflineFMCPolicyTrainer:
             use_wandb=True,
         )
 
-    def _general_loss(self, action, action_targets, action_weights):
-        # TODO: vectorize better (if possible?)
-        loss = 0
-        for action_target, weight in zip(action_targets, action_weights):
-            loss += self.action_loss(action, action_target) * weight
-        return loss
-
     def train_on_latest_episode(self):
         self.policy_model.train()
         self.optimizer.zero_grad()
 
-        # TODO: make more efficient somehow?
-        self.params_before = deepcopy(list(self.policy_model.parameters()))
-
-        observations, actions, weights = self.sampler.get_batch()
+        batch = self.sampler.get_padded_batch()
 
-        # NOTE: loss for trajectories of weighted multi-target actions
-        loss = 0
-        action_predictions = self.policy_model.forward(observations)
-        for y, action_targets, action_weights in zip(
-            action_predictions, actions, weights
-        ):
-            trajectory_loss = self._general_loss(y, action_targets, action_weights)
-            loss += trajectory_loss
-        loss = loss / len(observations)
+        # NOTE: loss for trajectories of weighted multi-target actions, padded targets have a weight of 0.
+        action_predictions = self.policy_model.forward(batch.observations)
+        loss = self.action_loss.weighted_loss(
+            action_predictions, batch.child_actions, batch.child_weights
+        )
 
         loss.backward()
         self.optimizer.step()
+        self.train_steps += 1
 
         self._log_last_train_step(loss.item())
         return loss.item()
@@ -116,18 +110,21 @@ class OfflineFMCPolicyTrainer:
         best_path = self.fmc.tree.best_path
         last_episode_total_reward = best_path.total_reward
 
-        current_params = list(self.policy_model.parameters())
-        param_dist = dist_of_model_paramters(self.params_before, current_params)
-        param_norm = parameters_norm(current_params)
-
-        wandb.log(
-            {
-                "train/loss": train_loss,
-                "train/epsiode_reward": last_episode_total_reward,
-                "parameters/policy_norm": param_norm,
-                "parameters/policy_l2_distance": param_dist,
-            }
-        )
+        metrics = {
+            "train/loss": train_loss,
+            "train/epsiode_reward": last_episode_total_reward,
+        }
+
+        if self._params_snapshot is None or self.train_steps % self.param_tracking_interval == 0:
+            current_params = [param.detach() for param in self.policy_model.parameters()]
+            if self._params_snapshot is not None:
+                metrics["parameters/policy_l2_distance"] = dist_of_model_paramters(
+                    self._params_snapshot, current_params
+                )
+            metrics["parameters/policy_norm"] = parameters_norm(current_params)
+            self._params_snapshot = [param.clone() for param in current_params]
+
+        wandb.log(metrics)
 
     def _log_last_eval_step(self, rewards):
         if wandb.run is None:
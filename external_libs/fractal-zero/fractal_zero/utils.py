@@ -1,11 +1,13 @@
 from copy import deepcopy
-from typing import Any, Callable, List, Sequence
+from typing import Any, Callable, List, Mapping, Sequence
 import gym
 import numpy as np
 
 import torch
 import torch.nn.functional as F
 
+from fractal_zero.loss.space_loss import stack_dict_samples
+
 
 def parameters_norm(parameters):
     c = 0
@@ -48,6 +50,28 @@ def mean_min_max_dict(name: str, arr) -> dict:
     }
 
 
+def stack_items(items):
+    """Stack a sequence of tensors, arrays or scalars into a single tensor. Dict items (ie. samples of a `Dict` space)
+    are stacked into a columnar batch instead (see `stack_dict_samples`).
+    """
+
+    if isinstance(items, (torch.Tensor, Mapping)):
+        return items
+    if len(items) > 0 and isinstance(items[0], Mapping):
+        return stack_dict_samples(items)
+    if len(items) > 0 and isinstance(items[0], torch.Tensor):
+        return torch.stack(list(items))
+    return torch.as_tensor(np.asarray(items))
+
+
+def map_columns(func: Callable, columns):
+    """Apply `func` to a tensor, or to every tensor of a (possibly nested) columnar batch."""
+
+    if isinstance(columns, Mapping):
+        return {key: map_columns(func, value) for key, value in columns.items()}
+    return func(columns)
+
+
 def _clone_sequence(
     l: Sequence, clone_partners, clone_mask, clone_func: Callable = None
 ):
@@ -88,3 +112,17 @@ def cloning_primitive(
     else:
         raise NotImplementedError()
     return cloned_subject
+
+
+def gather_cloning_primitive(subject: Any, clone_partners: torch.Tensor, clone_mask: torch.Tensor):
+    """Same result as `cloning_primitive`, but tensors are cloned with a single gather (walkers that don't clone
+    gather themselves) instead of boolean mask indexing, so nothing has to be synchronized with the host when the
+    subject, partners and mask live on an accelerator. Non-tensor subjects are cloned on the host.
+    """
+
+    if isinstance(subject, torch.Tensor):
+        walkers = torch.arange(len(clone_mask), device=clone_mask.device)
+        sources = torch.where(clone_mask, clone_partners, walkers)
+        return subject[sources.to(subject.device)]
+
+    return cloning_primitive(subject, clone_partners.cpu(), clone_mask.cpu())
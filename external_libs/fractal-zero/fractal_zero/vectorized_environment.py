@@ -1,5 +1,6 @@
 from abc import ABC
 from copy import deepcopy
+import multiprocessing as mp
 from typing import Callable, List, Union
 import gym
 import ray
@@ -7,7 +8,8 @@ import torch
 import numpy as np
 
 from fractal_zero.models.joint_model import JointModel
-from fractal_zero.utils import get_space_shape
+from fractal_zero.snapshots import EnvironmentSnapshotter
+from fractal_zero.utils import gather_cloning_primitive, get_space_shape
 
 
 def load_environment(env: Union[str, gym.Env], copy: bool = False) -> gym.Env:
@@ -46,11 +48,38 @@ class VectorizedEnvironment(ABC):
     def clone(self, partners, clone_mask):
         raise NotImplementedError
 
+    def get_snapshots(self, walkers: List[int]) -> List:
+        """Snapshots of the given walkers' environments, which can be restored into any walker (of any vectorized
+        environment with the same snapshotter).
+        """
+        raise NotImplementedError
+
+    def restore_snapshots(self, assignments: dict):
+        """Restore each `{walker: snapshot}` assignment."""
+        raise NotImplementedError
+
+
+def _get_cloning_walkers(partners, clone_mask):
+    """Returns the walkers that clone, along with the distinct partners they clone (each distinct partner only
+    needs to be snapshotted once).
+    """
+
+    if isinstance(partners, torch.Tensor):
+        partners = partners.cpu()
+    if isinstance(clone_mask, torch.Tensor):
+        clone_mask = clone_mask.cpu()
+
+    partners = np.asarray(partners)
+    cloning_walkers = np.flatnonzero(np.asarray(clone_mask, dtype=bool))
+    return cloning_walkers, partners, np.unique(partners[cloning_walkers])
+
 
 @ray.remote
 class _RayWrappedEnvironment:
-    def __init__(self, env: Union[str, gym.Env]):
+    def __init__(self, env: Union[str, gym.Env], snapshotter: EnvironmentSnapshotter = None):
         self._env = load_environment(env)
+        self.snapshotter = snapshotter if snapshotter else EnvironmentSnapshotter()
+        self.last_ret = None
 
     def set_state(self, env: gym.Env):
         self.last_ret = None
@@ -63,6 +92,14 @@ class _RayWrappedEnvironment:
     def get_state(self) -> gym.Env:
         return self._env
 
+    def get_snapshot(self):
+        # the last return is needed for empty steps.
+        return self.snapshotter.get_state(self._env), self.last_ret
+
+    def restore_snapshot(self, snapshot):
+        env_snapshot, self.last_ret = snapshot
+        self._env = self.snapshotter.restore_state(self._env, env_snapshot)
+
     def reset(self, *args, **kwargs):
         self.last_ret = None
         return self._env.reset(*args, **kwargs)
@@ -80,8 +117,10 @@ class _RayWrappedEnvironment:
 
 
 class _WrappedEnvironment:
-    def __init__(self, env: Union[str, gym.Env]):
+    def __init__(self, env: Union[str, gym.Env], snapshotter: EnvironmentSnapshotter = None):
         self._env = load_environment(env, copy=True)
+        self.snapshotter = snapshotter if snapshotter else EnvironmentSnapshotter()
+        self.last_ret = None
 
     @property
     def action_space(self):
@@ -97,6 +136,14 @@ class _WrappedEnvironment:
     def get_state(self) -> gym.Env:
         return self._env
 
+    def get_snapshot(self):
+        # the last return is needed for empty steps.
+        return self.snapshotter.get_state(self._env), self.last_ret
+
+    def restore_snapshot(self, snapshot):
+        env_snapshot, self.last_ret = snapshot
+        self._env = self.snapshotter.restore_state(self._env, env_snapshot)
+
     def reset(self, *args, **kwargs):
         self.last_ret = None
         return self._env.reset(*args, **kwargs)
@@ -117,7 +164,11 @@ class RayVectorizedEnvironment(VectorizedEnvironment):
     envs: List[_RayWrappedEnvironment]
 
     def __init__(
-        self, env: Union[str, gym.Env], n: int, observation_encoder: Callable = None
+        self, 
+        env: Union[str, gym.Env], 
+        n: int, 
+        observation_encoder: Callable = None, 
+        snapshotter: EnvironmentSnapshotter = None,
     ):
         super().__init__(env, n)
 
@@ -126,7 +177,7 @@ class RayVectorizedEnvironment(VectorizedEnvironment):
             observation_encoder if observation_encoder else torch.tensor
         )
 
-        self.envs = [_RayWrappedEnvironment.remote(env) for _ in range(n)]
+        self.envs = [_RayWrappedEnvironment.remote(env, snapshotter) for _ in range(n)]
 
     def batch_reset(self, *args, **kwargs):
         return ray.get([env.reset.remote(*args, **kwargs) for env in self.envs])
@@ -171,19 +222,19 @@ class RayVectorizedEnvironment(VectorizedEnvironment):
     def clone(self, partners, clone_mask):
         assert len(clone_mask) == self.n
 
-        new_envs = []
+        cloning_walkers, partners, distinct_partners = _get_cloning_walkers(partners, clone_mask)
 
-        # TODO: this kind of cloning might not be the same as vectorized cloning!!!
-        for i, do_clone in enumerate(clone_mask):
-            wrapped_env = self.envs[i]
+        # 1 snapshot per distinct partner, the object refs are passed directly to the receivers.
+        snapshots = {partner: self.envs[partner].get_snapshot.remote() for partner in distinct_partners}
+        for walker in cloning_walkers:
+            self.envs[walker].restore_snapshot.remote(snapshots[partners[walker]])
 
-            if do_clone:
-                new_state = self.envs[partners[i]].get_state.remote()
-                wrapped_env.set_state.remote(new_state)
+    def get_snapshots(self, walkers: List[int]) -> List:
+        return ray.get([self.envs[walker].get_snapshot.remote() for walker in walkers])
 
-            new_envs.append(wrapped_env)
-
-        self.envs = new_envs
+    def restore_snapshots(self, assignments: dict):
+        for walker, snapshot in assignments.items():
+            self.envs[walker].restore_snapshot.remote(snapshot)
 
     def batched_action_space_sample(self):
         actions = []
@@ -197,7 +248,11 @@ class SerialVectorizedEnvironment(VectorizedEnvironment):
     envs: List[gym.Env]
 
     def __init__(
-        self, env: Union[str, gym.Env], n: int, observation_encoder: Callable = None
+        self, 
+        env: Union[str, gym.Env], 
+        n: int, 
+        observation_encoder: Callable = None, 
+        snapshotter: EnvironmentSnapshotter = None,
     ):
         super().__init__(env, n)
 
@@ -206,7 +261,8 @@ class SerialVectorizedEnvironment(VectorizedEnvironment):
             observation_encoder if observation_encoder else torch.tensor
         )
 
-        self.envs = [_WrappedEnvironment(env) for _ in range(n)]
+        self.snapshotter = snapshotter
+        self.envs = [_WrappedEnvironment(env, snapshotter) for _ in range(n)]
 
     def batch_reset(self, *args, **kwargs):
         return [env.reset(*args, **kwargs) for env in self.envs]
@@ -242,18 +298,23 @@ class SerialVectorizedEnvironment(VectorizedEnvironment):
         )
 
     def set_all_states(self, new_env: gym.Env, obs: np.ndarray):
-        self.envs = [deepcopy(new_env) for _ in range(self.n)]
+        self.envs = [_WrappedEnvironment(new_env, self.snapshotter) for _ in range(self.n)]
 
     def clone(self, partners, clone_mask):
         assert len(clone_mask) == self.n
 
-        new_envs = []
-        for i, do_clone in enumerate(clone_mask):
-            env = self.envs[i]
-            if do_clone:
-                env = deepcopy(self.envs[partners[i]])
-            new_envs.append(env)
-        self.envs = new_envs
+        cloning_walkers, partners, distinct_partners = _get_cloning_walkers(partners, clone_mask)
+
+        # all snapshots are taken before restoring any, so walkers can be partners and receivers at the same time.
+        snapshots = dict(zip(distinct_partners, self.get_snapshots(distinct_partners)))
+        self.restore_snapshots({walker: snapshots[partners[walker]] for walker in cloning_walkers})
+
+    def get_snapshots(self, walkers: List[int]) -> List:
+        return [self.envs[walker].get_snapshot() for walker in walkers]
+
+    def restore_snapshots(self, assignments: dict):
+        for walker, snapshot in assignments.items():
+            self.envs[walker].restore_snapshot(snapshot)
 
     def batched_action_space_sample(self):
         actions = []
@@ -264,6 +325,266 @@ class SerialVectorizedEnvironment(VectorizedEnvironment):
         return actions
 
 
+def _get_observation_buffer_spec(env: gym.Env):
+    """Shape and dtype of the shared memory buffer for the observations of `env`, or None if its observations
+    can't be stored in a fixed size array (they'll be sent through the pipe instead).
+    """
+
+    space = getattr(env, "observation_space", None)
+    if isinstance(space, gym.spaces.Box):
+        return space.shape, np.dtype(space.dtype)
+    if isinstance(space, gym.spaces.Discrete):
+        return (), np.dtype(np.int64)
+    return None
+
+
+def _shared_array(ctx, shape, dtype) -> np.ndarray:
+    dtype = np.dtype(dtype)
+    raw = ctx.RawArray("b", max(1, int(np.prod(shape)) * dtype.itemsize))
+    return raw, np.frombuffer(raw, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+
+def _subprocess_worker(
+    conn, 
+    env: gym.Env, 
+    snapshotter: EnvironmentSnapshotter, 
+    num_envs: int, 
+    offset: int, 
+    raw_buffers, 
+    buffer_specs,
+):
+    envs = [_WrappedEnvironment(env, snapshotter) for _ in range(num_envs)]
+
+    observations, rewards, dones = [
+        np.frombuffer(raw, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+        for raw, (shape, dtype) in zip(raw_buffers, buffer_specs)
+    ]
+    has_observation_buffer = raw_buffers[0] is not None
+
+    def _write_observations(rets):
+        # returns the observations that couldn't be written to the shared buffer.
+        if has_observation_buffer:
+            for i, obs in enumerate(rets):
+                observations[offset + i] = obs
+            return None
+        return rets
+
+    try:
+        while True:
+            command, data = conn.recv()
+
+            if command == "step":
+                actions, frozen_mask = data
+
+                infos = []
+                step_observations = []
+                for i, env in enumerate(envs):
+                    if frozen_mask[i]:
+                        ret = env.empty_step()
+                    else:
+                        ret = env.step(actions[i])
+
+                    obs, rew, done, info = ret
+                    step_observations.append(obs)
+                    rewards[offset + i] = rew
+                    dones[offset + i] = done
+                    infos.append(info)
+
+                conn.send((_write_observations(step_observations), infos))
+            elif command == "reset":
+                conn.send(_write_observations([env.reset() for env in envs]))
+            elif command == "get_snapshots":
+                conn.send([envs[i].get_snapshot() for i in data])
+            elif command == "restore_snapshots":
+                for i, snapshot in data.items():
+                    envs[i].restore_snapshot(snapshot)
+            elif command == "set_all_states":
+                envs = [_WrappedEnvironment(data, snapshotter) for _ in range(num_envs)]
+            elif command == "close":
+                break
+            else:
+                raise NotImplementedError(command)
+    finally:
+        conn.close()
+
+
+class SubprocessVectorizedEnvironment(VectorizedEnvironment):
+    """Steps the environments in persistent worker processes, each one owning a contiguous slice of the walkers.
+
+    Observations (when the observation space is a Box or Discrete), rewards and dones are written by the workers
+    into shared memory buffers, so a `batch_step` is a single round trip: each worker is sent its slice of the actions,
+    and only the infos are sent back. Actions are sampled from a locally cached copy of the action space.
+    """
+
+    def __init__(
+        self,
+        env: Union[str, gym.Env],
+        n: int,
+        observation_encoder: Callable = None,
+        num_workers: int = None,
+        start_method: str = None,
+        snapshotter: EnvironmentSnapshotter = None,
+    ):
+        super().__init__(env, n)
+
+        # TODO: explain
+        self.observation_encoder = (
+            observation_encoder if observation_encoder else torch.tensor
+        )
+
+        env = load_environment(env)
+
+        num_workers = min(n, num_workers if num_workers else mp.cpu_count())
+        self.num_workers = num_workers
+        # contiguous slices of walkers, the first `n % num_workers` workers get 1 more.
+        self.slices = [
+            (walkers[0], walkers[-1] + 1) for walkers in np.array_split(np.arange(n), num_workers)
+        ]
+        self._walker_workers = np.concatenate([np.full(end - start, i) for i, (start, end) in enumerate(self.slices)])
+        self._walker_local_indices = np.concatenate([np.arange(end - start) for start, end in self.slices])
+
+        ctx = mp.get_context(start_method)
+
+        observation_spec = _get_observation_buffer_spec(env)
+        buffer_specs = [
+            ((n, *observation_spec[0]), observation_spec[1]) if observation_spec else ((0,), np.dtype(np.uint8)),
+            ((n,), np.dtype(float)),
+            ((n,), np.dtype(bool)),
+        ]
+
+        raw_buffers = []
+        self._buffers = []
+        for shape, dtype in buffer_specs:
+            raw, buffer = _shared_array(ctx, shape, dtype)
+            raw_buffers.append(raw)
+            self._buffers.append(buffer)
+        if observation_spec is None:
+            raw_buffers[0] = None
+
+        self.connections = []
+        self.processes = []
+        for start, end in self.slices:
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(
+                target=_subprocess_worker,
+                args=(child_conn, env, snapshotter, end - start, start, raw_buffers, buffer_specs),
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+
+            self.connections.append(parent_conn)
+            self.processes.append(process)
+
+        self.closed = False
+
+    @property
+    def _has_observation_buffer(self) -> bool:
+        return self._buffers[0].shape[0] == self.n
+
+    def _read_observations(self, returned_observations: List):
+        if self._has_observation_buffer:
+            # copy, the buffer is overwritten by the next step.
+            return self._buffers[0].copy()
+        return [obs for worker_observations in returned_observations for obs in worker_observations]
+
+    def batch_reset(self, *args, **kwargs):
+        for conn in self.connections:
+            conn.send(("reset", None))
+        return self._read_observations([conn.recv() for conn in self.connections])
+
+    def batch_step(self, actions, frozen_mask):
+        assert len(actions) == self.n
+
+        frozen_mask = np.asarray(frozen_mask, dtype=bool)
+
+        # scatter
+        for conn, (start, end) in zip(self.connections, self.slices):
+            conn.send(("step", (actions[start:end], frozen_mask[start:end])))
+
+        # gather
+        returned_observations = []
+        infos = []
+        for conn in self.connections:
+            worker_observations, worker_infos = conn.recv()
+            returned_observations.append(worker_observations)
+            infos.extend(worker_infos)
+
+        observations = self._read_observations(returned_observations)
+        states = self.observation_encoder(observations)
+
+        return (
+            states,
+            observations,
+            torch.tensor(self._buffers[1], dtype=float),
+            torch.tensor(self._buffers[2], dtype=bool),
+            infos,
+        )
+
+    def set_all_states(self, new_env: gym.Env, obs: np.ndarray):
+        for conn in self.connections:
+            conn.send(("set_all_states", new_env))
+
+    def clone(self, partners, clone_mask):
+        assert len(clone_mask) == self.n
+
+        cloning_walkers, partners, distinct_partners = _get_cloning_walkers(partners, clone_mask)
+        if len(cloning_walkers) == 0:
+            return
+
+        # snapshot each distinct partner only once.
+        snapshots = dict(zip(distinct_partners, self.get_snapshots(distinct_partners)))
+        self.restore_snapshots({walker: snapshots[partners[walker]] for walker in cloning_walkers})
+
+    def get_snapshots(self, walkers: List[int]) -> List:
+        requests = {}
+        for position, walker in enumerate(walkers):
+            worker, local_index = self._walker_workers[walker], self._walker_local_indices[walker]
+            requests.setdefault(worker, []).append((position, int(local_index)))
+
+        for worker, worker_requests in requests.items():
+            self.connections[worker].send(("get_snapshots", [i for _, i in worker_requests]))
+
+        snapshots = [None] * len(walkers)
+        for worker, worker_requests in requests.items():
+            worker_snapshots = self.connections[worker].recv()
+            for (position, _), snapshot in zip(worker_requests, worker_snapshots):
+                snapshots[position] = snapshot
+        return snapshots
+
+    def restore_snapshots(self, assignments: dict):
+        # the order of the pipe guarantees these are applied before the next command.
+        worker_assignments = {}
+        for walker, snapshot in assignments.items():
+            worker, local_index = self._walker_workers[walker], self._walker_local_indices[walker]
+            worker_assignments.setdefault(worker, {})[int(local_index)] = snapshot
+
+        for worker, local_assignments in worker_assignments.items():
+            self.connections[worker].send(("restore_snapshots", local_assignments))
+
+    def batched_action_space_sample(self):
+        return [self._action_space.sample() for _ in range(self.n)]
+
+    def close(self):
+        if self.closed:
+            return
+
+        for conn in self.connections:
+            try:
+                conn.send(("close", None))
+            except (BrokenPipeError, EOFError):
+                pass
+        for process in self.processes:
+            process.join()
+        self.closed = True
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
 class VectorizedDynamicsModelEnvironment(VectorizedEnvironment):
     def __init__(self, env: Union[str, gym.Env], n: int, joint_model: JointModel):
         super().__init__(env, n)
@@ -288,21 +609,30 @@ class VectorizedDynamicsModelEnvironment(VectorizedEnvironment):
         self.set_all_states(self._env, obs)
         return obs
 
+    @torch.no_grad()
     def batch_step(self, actions, frozen_mask=None, *args, **kwargs):
         device = self.joint_model.device
 
-        if frozen_mask is not None:
-            raise NotImplementedError
-
         if not isinstance(actions, torch.Tensor):
             actions = torch.tensor(actions, device=device).float().unsqueeze(-1)
 
-        rewards = self.dynamics_model.forward(actions)
-        observations = self.dynamics_model.state
+        previous_state = self.dynamics_model.state
+        rewards = self.dynamics_model.forward(actions).squeeze(-1)
+
+        # frozen walkers don't step, they keep their state with 0 reward.
+        if frozen_mask is not None:
+            frozen = torch.as_tensor(frozen_mask, device=device).bool()
+            self.dynamics_model.set_state(
+                torch.where(frozen.unsqueeze(-1), previous_state, self.dynamics_model.state)
+            )
+            rewards = torch.where(frozen, torch.zeros_like(rewards), rewards)
+
+        # the latent state is also the observation.
+        states = self.dynamics_model.state.clone()
         dones = torch.zeros(self.n, dtype=bool, device=device)
         infos = [{} for _ in range(self.n)]
 
-        return observations, rewards, dones, infos
+        return states, states, rewards, dones, infos
 
     def set_all_states(self, new_env: gym.Env, obs: np.ndarray):
         # TODO: explain, also how this interacts with FMC.
@@ -320,4 +650,15 @@ class VectorizedDynamicsModelEnvironment(VectorizedEnvironment):
 
     def clone(self, partners, clone_mask):
         state = self.dynamics_model.state
-        state[clone_mask] = state[partners[clone_mask]]
+        state.copy_(gather_cloning_primitive(state, partners, clone_mask))
+
+    def get_snapshots(self, walkers: List[int]) -> List:
+        # a walker is just it's row of the latent state.
+        state = self.dynamics_model.state
+        return [state[walker].detach().clone() for walker in walkers]
+
+    @torch.no_grad()
+    def restore_snapshots(self, assignments: dict):
+        state = self.dynamics_model.state
+        for walker, snapshot in assignments.items():
+            state[walker].copy_(snapshot)
@@ -0,0 +1,42 @@
+import torch
+
+
+def soft_nearest_neighbors(
+    frame_embeddings: torch.Tensor,
+    other_embeddings: torch.Tensor,
+    temperature: float,
+):
+    """For every frame embedding `(B, D)`, the softmax over it's (temperature scaled) negative l2 distances to
+    all of the other embeddings `(N, D)`. Returns `(B, N)`.
+    """
+
+    # NOTE: not using the matmul approach for euclidean distances keeps this numerically identical to `torch.norm`.
+    similarity = -torch.cdist(frame_embeddings, other_embeddings, compute_mode="donot_use_mm_for_euclid_dist")
+    similarity /= temperature
+
+    return torch.softmax(similarity, dim=-1)
+
+
+def cycle_back(
+    embedded_chosen_frames: torch.Tensor,
+    embedded_t0: torch.Tensor,
+    embedded_t1: torch.Tensor,
+    temperature: float,
+):
+    """Temporal Cycle-Consistency (https://arxiv.org/pdf/1904.07846.pdf) cycle-back regression for a batch of chosen frames
+    from t0 `(B, D)`. Each chosen frame is soft nearest neighbor'd into t1, then back into t0.
+
+    Returns the predicted (1-indexed) frame index `(B,)` and the cycle-back similarities over t0 `(B, len(t0))`.
+    """
+
+    alpha_k = soft_nearest_neighbors(embedded_chosen_frames, embedded_t1, temperature)
+    v_squiggly = torch.matmul(alpha_k, embedded_t1)
+
+    beta = soft_nearest_neighbors(v_squiggly, embedded_t0, temperature)
+
+    frame_mult = torch.arange(
+        start=1, end=beta.shape[-1] + 1, dtype=beta.dtype, device=beta.device
+    )# / len(beta)
+    mu = torch.matmul(beta, frame_mult) # / len(beta)
+
+    return mu, beta
@@ -1,4 +1,7 @@
 
+from typing import List
+import hashlib
+
 from vpt.agent import AGENT_RESOLUTION, MineRLAgent, resize_image
 from xirl_zero.architecture.dynamics_function import DynamicsFunction
 
@@ -30,18 +33,76 @@ class XIRLModel(torch.nn.Module):
             c += 1
         print(f"Unfrozen: {num_unfrozen}/{c}")
 
+        self._frozen_prefix_key = None
+        self._frozen_prefix_hash = None
+
     def prepare_observation(self, minerl_obs):
         agent_input = resize_image(minerl_obs["pov"], AGENT_RESOLUTION)[None]
         img = torch.from_numpy(agent_input)
         return img
 
-    def embed(self, frames):
+    def _get_stages(self) -> List[torch.nn.Module]:
+        # `img_process` split into it's modules: each impala stack, the impala dense layer, then the final linear layer.
+        cnn = self.img_process.cnn
+        return [*cnn.stacks, cnn.dense, self.img_process.linear]
+
+    @property
+    def num_frozen_stages(self) -> int:
+        """The number of leading stages where every parameter is frozen. Their outputs never change while training,
+        so they can be cached (see `fgz/data_utils/feature_cache.py`).
+        """
+
+        c = 0
+        for stage in self._get_stages():
+            if any(param.requires_grad for param in stage.parameters()):
+                break
+            c += 1
+        return c
+
+    def _run_stages(self, x, start: int, end: int):
+        num_stacks = len(self.img_process.cnn.stacks)
+        stages = self._get_stages()
+        for i in range(start, end):
+            if i == num_stacks:
+                # flatten the image before the dense layer (like `ImpalaCNN`).
+                x = x.flatten(start_dim=1)
+            x = stages[i](x)
+        return x
+
+    def embed_frozen_prefix(self, frames):
         if frames.dim() == 3:
             frames = frames.unsqueeze(0)
         elif frames.dim() != 4:
             raise NotImplementedError(frames.shape)
 
-        x = self.img_preprocess(frames).unsqueeze(0)  # ficticious time-dimension
-        x = self.img_process(x)
-        x = x[0]  # remove time dim
-        return x
\ No newline at end of file
+        x = self.img_preprocess(frames)
+        x = x.permute(0, 3, 1, 2)  # bhwc -> bchw
+        return self._run_stages(x, 0, self.num_frozen_stages)
+
+    def embed_features(self, features):
+        """Runs the trainable tail on the outputs of `embed_frozen_prefix`, same result as `embed` on the frames."""
+        return self._run_stages(features, self.num_frozen_stages, len(self._get_stages()))
+
+    def get_frozen_prefix_hash(self) -> str:
+        """Identifies which stages are frozen and their weights, so it changes when either of them does."""
+
+        modules = [self.img_preprocess, *self._get_stages()[:self.num_frozen_stages]]
+        tensors = [(f"{i}.{name}", t) for i, m in enumerate(modules) for name, t in [*m.named_parameters(), *m.named_buffers()]]
+
+        # only rehash when the frozen set changes, or any of it's tensors were modified in-place (ie. `load_state_dict`).
+        key = (len(modules), tuple((name, t.data_ptr(), t._version) for name, t in tensors))
+        if key != self._frozen_prefix_key:
+            h = hashlib.sha1()
+            h.update(f"{len(modules)}:{getattr(self.img_preprocess, 'ob_scale', None)}".encode())
+            for name, t in tensors:
+                t = t.detach().cpu().contiguous()
+                h.update(f"{name}:{tuple(t.shape)}:{t.dtype}".encode())
+                h.update(t.reshape(-1).view(torch.uint8).numpy().tobytes())
+
+            self._frozen_prefix_key = key
+            self._frozen_prefix_hash = h.hexdigest()
+
+        return self._frozen_prefix_hash
+
+    def embed(self, frames):
+        return self.embed_features(self.embed_frozen_prefix(frames))
@@ -4,15 +4,74 @@
 from collections import defaultdict
 from glob import glob
 from logging import warn
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
 from typing import Sequence, Tuple
 import os
+import time
 import torch
 
 import numpy as np
 
 from fgz.data_utils.data_handler import ChunkedContiguousTrajectory, get_trajectories
+from fgz.data_utils.trajectory_cache import CachedTrajectory, is_cached
+
+def _get_frames_to_use(num_frames: int, num_frame_samples: int):
+    nframes_to_use = min(num_frame_samples, num_frames)
+    return torch.round(torch.linspace(start=0, end=num_frames, steps=nframes_to_use)).int().tolist()
+
+
+def read_frames_and_actions_sparse(trajectory: ChunkedContiguousTrajectory, num_frame_samples: int, max_frames: int = None, feature_cache=None):
+    """Same outputs as `read_frames_and_actions`, but the json files are read first to determine which video
+    frames survive the null action filtering, then only the frames that will be used are decoded. The actions
+    between the sampled frames come from the json alone.
+
+    With a `FeatureCache` (see `fgz/data_utils/feature_cache.py`), the frozen prefix features of the frames are
+    returned instead of the frames.
+    """
+
+    steps = trajectory.get_non_null_steps()
+    if max_frames is not None:
+        steps = steps[:max_frames]
+
+    num_frames = len(steps)
+    frames_to_use = _get_frames_to_use(num_frames, num_frame_samples)
+
+    # the last index in `frames_to_use` is `num_frames`, which is never an actual frame.
+    chosen_indices = sorted(set(i for i in frames_to_use if i < num_frames))
+
+    # actions are stored as sub-lists of actions, where each sublist corresponds to all actions
+    # between the frame samples.
+    sup_actions: Sequence[Tuple] = []
+    for start, end in zip(chosen_indices, chosen_indices[1:] + [num_frames]):
+        if isinstance(trajectory, CachedTrajectory):
+            # cached steps don't hold their actions, only the used ranges are decoded.
+            sup_actions.append(tuple(trajectory.get_actions(start, end)))
+        else:
+            sup_actions.append(tuple(step[-1] for step in steps[start:end]))
+
+    with torch.no_grad():
+        chosen_steps = [steps[i] for i in chosen_indices]
+        if feature_cache is not None:
+            frames = list(feature_cache.read_features(trajectory, chosen_steps))
+        else:
+            frames = [torch.tensor(frame).float() for frame in trajectory.read_frames(chosen_steps)]
+
+        # ensure we always have the last frame in the sequence.
+        if len(frames) > 0 and len(frames) < len(frames_to_use):
+            frames.append(frames[-1])
+
+    frames = torch.stack(frames)
+    frames.requires_grad = True
+
+    return frames, sup_actions
+
+
+def read_frames_and_actions(trajectory: ChunkedContiguousTrajectory, num_frame_samples: int, max_frames: int = None, sparse: bool = False, feature_cache=None):
+    # cached trajectories are memory-mapped, so there's never a reason to read every frame.
+    if sparse or isinstance(trajectory, CachedTrajectory) or feature_cache is not None:
+        return read_frames_and_actions_sparse(trajectory, num_frame_samples=num_frame_samples, max_frames=max_frames, feature_cache=feature_cache)
 
-def read_frames_and_actions(trajectory: ChunkedContiguousTrajectory, num_frame_samples: int, max_frames: int = None):
     # reset hidden state.
     # self.agent.reset()
 
@@ -31,8 +90,7 @@ def read_frames_and_actions(trajectory: ChunkedContiguousTrajectory, num_frame_s
 
         # we can't load more frames than are available
         num_frames = len(trajectory) if max_frames is None else min(max_frames, len(trajectory))
-        nframes_to_use = min(num_frame_samples, num_frames)
-        frames_to_use = torch.round(torch.linspace(start=0, end=num_frames, steps=nframes_to_use)).int().tolist()
+        frames_to_use = _get_frames_to_use(num_frames, num_frame_samples)
 
         c = 0
 
@@ -77,7 +135,7 @@ def read_frames_and_actions(trajectory: ChunkedContiguousTrajectory, num_frame_s
     return frames, sup_actions
 
 
-def get_trajectories(dataset_path: str, train_split: float):
+def get_trajectories(dataset_path: str, train_split: float, cache_dir: str = None):
     assert train_split > 0 and train_split < 1
 
     # gather all unique IDs for every video/json file pair.
@@ -112,6 +170,11 @@ def get_trajectories(dataset_path: str, train_split: float):
 
         try:
             chunked_traj = ChunkedContiguousTrajectory(trajectory_prefix, sorted_date_times, trajectory_prefix)#, task_id=task_id)
+
+            # use the compiled trajectory when available (see `fgz/data_utils/trajectory_cache.py`).
+            if cache_dir is not None and is_cached(cache_dir, chunked_traj.uid):
+                chunked_traj = CachedTrajectory(cache_dir, chunked_traj.uid)
+
             traj_list.append(chunked_traj)
         except ValueError:
             warn(f"Missing video/json path! Skipping... {trajectory_prefix} {sorted_date_times}")
@@ -123,9 +186,15 @@ def get_trajectories(dataset_path: str, train_split: float):
 class ContiguousTrajectoryLoader:
     trajectories: Sequence[ChunkedContiguousTrajectory]
 
-    def __init__(self, trajectories: Sequence[ChunkedContiguousTrajectory]):
+    def __init__(self, trajectories: Sequence[ChunkedContiguousTrajectory], sparse_decoding: bool = False, feature_cache=None):
         self.trajectories = trajectories
 
+        # when true, only the sampled frames are decoded from the videos.
+        self.sparse_decoding = sparse_decoding
+
+        # when given, samples are the frozen prefix features of the frames instead.
+        self.feature_cache = feature_cache
+
         self.minimum_steps = 64
 
     def sample_trajectory_object(self) -> ChunkedContiguousTrajectory:
@@ -144,17 +213,111 @@ class ContiguousTrajectoryLoader:
 
     def sample(self, num_frame_samples: int, max_frames: int=None):
         t = self.sample_trajectory_object()
-        return read_frames_and_actions(t, num_frame_samples=num_frame_samples, max_frames=max_frames)
+        return read_frames_and_actions(t, num_frame_samples=num_frame_samples, max_frames=max_frames, sparse=self.sparse_decoding, feature_cache=self.feature_cache)
 
     @staticmethod
-    def get_train_and_eval_loaders(dataset_path: str, train_split: float=0.8, max_trajectories: int = None):
-        train_trajectories, eval_trajectories = get_trajectories(dataset_path, train_split=train_split)
+    def get_train_and_eval_loaders(dataset_path: str, train_split: float=0.8, max_trajectories: int = None, sparse_decoding: bool = False, cache_dir: str = None, feature_cache=None):
+        train_trajectories, eval_trajectories = get_trajectories(dataset_path, train_split=train_split, cache_dir=cache_dir)
 
         if max_trajectories is not None:
             train_trajectories = train_trajectories[:max_trajectories]
             eval_trajectories = eval_trajectories[:max_trajectories]
 
-        train_loader = ContiguousTrajectoryLoader(train_trajectories)
-        eval_loader = ContiguousTrajectoryLoader(eval_trajectories)
+        train_loader = ContiguousTrajectoryLoader(train_trajectories, sparse_decoding=sparse_decoding, feature_cache=feature_cache)
+        eval_loader = ContiguousTrajectoryLoader(eval_trajectories, sparse_decoding=sparse_decoding, feature_cache=feature_cache)
+
+        return train_loader, eval_loader
+
+
+class PrefetchingTrajectorySampler:
+    """Samples pairs of trajectories `(t0, t0_actions, t1, t1_actions)` from a `ContiguousTrajectoryLoader` in background
+    worker threads, and keeps a bounded queue of them ready so the training step doesn't have to wait on decoding.
+    Threads are enough here, because OpenCV releases the GIL while decoding.
+    """
+
+    def __init__(
+        self,
+        loader: ContiguousTrajectoryLoader,
+        num_frame_samples: int,
+        max_frames: int = None,
+        num_workers: int = 2,
+        queue_size: int = 4,
+    ):
+        assert num_workers > 0
+        assert queue_size > 0
+
+        self.loader = loader
+        self.num_frame_samples = num_frame_samples
+        self.max_frames = max_frames
+        self.num_workers = num_workers
+
+        self.queue = Queue(maxsize=queue_size)
+
+        # the loader may remove trajectories from it's list when sampling, so only 1 worker can choose at a time.
+        self._choice_lock = Lock()
+        self._stop_event = Event()
+
+        self.last_wait_seconds = 0.0
+
+        self.workers = [Thread(target=self._worker, daemon=True) for _ in range(num_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def _read_one(self):
+        with self._choice_lock:
+            t = self.loader.sample_trajectory_object()
+
+        return read_frames_and_actions(
+            t,
+            num_frame_samples=self.num_frame_samples,
+            max_frames=self.max_frames,
+            sparse=self.loader.sparse_decoding,
+            feature_cache=self.loader.feature_cache,
+        )
+
+    def _worker(self):
+        while not self._stop_event.is_set():
+            try:
+                t0, t0_actions = self._read_one()
+                t1, t1_actions = self._read_one()
+                item = (t0, t0_actions, t1, t1_actions)
+            except Exception as e:
+                # raised in the main thread by `sample`.
+                item = e
+
+            while not self._stop_event.is_set():
+                try:
+                    self.queue.put(item, timeout=1)
+                    break
+                except Full:
+                    continue
+
+    def sample(self):
+        start = time.time()
+        item = self.queue.get()
+        self.last_wait_seconds = time.time() - start
+
+        if isinstance(item, Exception):
+            raise item
+
+        return item
+
+    def get_stats(self):
+        return {
+            "prefetch_queue_depth": self.queue.qsize(),
+            "prefetch_workers": self.num_workers,
+            "wait_seconds": self.last_wait_seconds,
+        }
+
+    def close(self):
+        self._stop_event.set()
+
+        # unblock any workers waiting to put into a full queue.
+        try:
+            while True:
+                self.queue.get_nowait()
+        except Empty:
+            pass
 
-        return train_loader, eval_loader
\ No newline at end of file
+        for worker in self.workers:
+            worker.join()
@@ -6,7 +6,8 @@ from warnings import warn
 import minerl
 from typing import List, Sequence, Tuple
 
-from fgz.data_utils.data_loader import get_json_length_without_null_actions, trajectory_generator
+from fgz.data_utils.data_loader import get_non_null_steps, load_null_action_index, read_video_frames, trajectory_generator
+from fgz.data_utils.trajectory_cache import CachedTrajectory, is_cached
 import torch
 
 from vpt.agent import AGENT_RESOLUTION, MineRLAgent, resize_image
@@ -26,11 +27,20 @@ class ContiguousTrajectory:
         self.uid = uid
         self.task_id = task_id
 
+        self._index = None
+
+    @property
+    def index(self):
+        """The null action index is loaded from it's sidecar file (or built) once, then kept in memory."""
+        if self._index is None:
+            self._index = load_null_action_index(self.json_path)
+        return self._index
+
     def __len__(self):
         # with open(self.json_path) as json_file:
         #     return len(json_file.readlines())
 
-        return get_json_length_without_null_actions(self.json_path)
+        return self.index["length"]
 
     def __str__(self) -> str:
         return f"T({self.uid})"
@@ -43,6 +53,13 @@ class ContiguousTrajectory:
             self.video_path, self.json_path, start_frame=start_frame
         )
 
+    def get_non_null_steps(self):
+        return get_non_null_steps(self.json_path, index=self.index)
+
+    def read_frames(self, steps: Sequence[Tuple]):
+        """Decode only the frames for the given `(frame_index, step_data, action)` steps."""
+        return read_video_frames(self.video_path, [(frame_index, step_data) for frame_index, step_data, _ in steps])
+
 
 class ChunkedContiguousTrajectory:
 
@@ -111,6 +128,29 @@ class ChunkedContiguousTrajectory:
 
             return self.__next__()
 
+    def get_non_null_steps(self):
+        """Returns `(clip_index, frame_index, step_data, action)` for every non-null step in all of the clips,
+        in order. Only the json files are read.
+        """
+
+        steps = []
+        for clip_index, clip in enumerate(self.contiguous_clips):
+            for step in clip.get_non_null_steps():
+                steps.append((clip_index, *step))
+        return steps
+
+    def read_frames(self, steps: Sequence[Tuple]):
+        """Decode only the frames for the given `(clip_index, frame_index, step_data, action)` steps, which
+        must be in order. Each clip's video is opened at most once.
+        """
+
+        frames = []
+        for clip_index, clip in enumerate(self.contiguous_clips):
+            clip_steps = [step[1:] for step in steps if step[0] == clip_index]
+            if len(clip_steps) > 0:
+                frames.extend(clip.read_frames(clip_steps))
+        return frames
+
     def get_last_frame(self):
         clip = self.contiguous_clips[-1]
         video = cv2.VideoCapture(clip.video_path)
@@ -215,7 +255,7 @@ class ContiguousTrajectoryWindow:
         return self.window
 
 
-def get_trajectories(dataset_path: str, for_training: bool, train_split: float, task_id):
+def get_trajectories(dataset_path: str, for_training: bool, train_split: float, task_id, cache_dir: str = None):
     assert train_split > 0 and train_split < 1
 
     # gather all unique IDs for every video/json file pair.
@@ -251,6 +291,11 @@ def get_trajectories(dataset_path: str, for_training: bool, train_split: float,
 
         try:
             chunked_traj = ChunkedContiguousTrajectory(trajectory_prefix, sorted_date_times, trajectory_prefix, task_id=task_id)
+
+            # use the compiled trajectory when available (see `fgz/data_utils/trajectory_cache.py`).
+            if cache_dir is not None and is_cached(cache_dir, chunked_traj.uid):
+                chunked_traj = CachedTrajectory(cache_dir, chunked_traj.uid, task_id=task_id)
+
             trajectories.append(chunked_traj)
         except ValueError:
             warn(f"Missing video/json path! Skipping... {trajectory_prefix} {sorted_date_times}")
@@ -260,13 +305,13 @@ def get_trajectories(dataset_path: str, for_training: bool, train_split: float,
 
 
 class ContiguousTrajectoryDataLoader:
-    def __init__(self, dataset_path: str, task_id: int = None, minimum_steps: int = 64, is_train: bool=True, train_split: float=0.8):
+    def __init__(self, dataset_path: str, task_id: int = None, minimum_steps: int = 64, is_train: bool=True, train_split: float=0.8, cache_dir: str = None):
         self.dataset_path = dataset_path
         self.task_id = task_id
         self.minimum_steps = minimum_steps
         self.is_train = is_train
 
-        self.trajectories = get_trajectories(dataset_path, for_training=is_train, train_split=train_split, task_id=task_id)
+        self.trajectories = get_trajectories(dataset_path, for_training=is_train, train_split=train_split, task_id=task_id, cache_dir=cache_dir)
         # create ContiguousTrajectory objects for every mp4/json file pair.
         # self.trajectories = []
         # for unique_id in sorted(unique_ids):
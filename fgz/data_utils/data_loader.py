@@ -4,7 +4,9 @@ import json
 import glob
 import os
 import random
+from typing import Dict, Sequence, Tuple
 from multiprocessing import Process, Queue, Event
+from warnings import warn
 
 import numpy as np
 import cv2
@@ -169,14 +171,36 @@ def get_json_length_without_null_actions(json_path: str):
     return c
 
 
-def trajectory_generator(video_path, json_path, start_frame: int = None):
+def load_cursor():
     cursor_image = cv2.imread(CURSOR_FILE, cv2.IMREAD_UNCHANGED)
     # Assume 16x16
     cursor_image = cursor_image[:16, :16, :]
     cursor_alpha = cursor_image[:, :, 3:] / 255.0
     cursor_image = cursor_image[:, :, :3]
+    return cursor_image, cursor_alpha
+
+
+def process_frame(frame, step_data, cursor_image, cursor_alpha):
+    """Composite the cursor (if the GUI is open), convert to RGB and resize to the agent's resolution."""
+
+    if step_data["isGuiOpen"]:
+        camera_scaling_factor = frame.shape[0] / MINEREC_ORIGINAL_HEIGHT_PX
+        cursor_x = int(step_data["mouse"]["x"] * camera_scaling_factor)
+        cursor_y = int(step_data["mouse"]["y"] * camera_scaling_factor)
+        composite_images_with_alpha(
+            frame, cursor_image, cursor_alpha, cursor_x, cursor_y
+        )
+    cv2.cvtColor(frame, code=cv2.COLOR_BGR2RGB, dst=frame)
+    frame = np.asarray(np.clip(frame, 0, 255), dtype=np.uint8)
+    frame = resize_image(frame, AGENT_RESOLUTION)
+    return frame
+
+
+def step_state_generator(json_data):
+    """Yields `(step_data, attack_is_stuck, last_hotbar)` for every step in the json data. This is the
+    sequential state needed to convert a step into an action with `get_step_action`.
+    """
 
-    video = cv2.VideoCapture(video_path)
     # Note: In some recordings, the game seems to start
     #       with attack always down from the beginning, which
     #       is stuck down until player actually presses attack
@@ -187,13 +211,6 @@ def trajectory_generator(video_path, json_path, start_frame: int = None):
     # and updating "hotbar.#" actions when hotbar selection changes.
     last_hotbar = 0
 
-    json_data = get_json_data(json_path)
-
-    # if the start frame was provided, start there.
-    if start_frame is not None:
-        video.set(1, start_frame)
-        json_data = json_data[start_frame:]
-
     for i in range(len(json_data)):
         step_data = json_data[i]
 
@@ -205,20 +222,203 @@ def trajectory_generator(video_path, json_path, start_frame: int = None):
             # Check if we press attack down, then it might not be stuck
             if 0 in step_data["mouse"]["newButtons"]:
                 attack_is_stuck = False
-        # If still stuck, remove the action
+
+        yield step_data, attack_is_stuck, last_hotbar
+
+        last_hotbar = step_data["hotbar"]
+
+
+def get_step_action(step_data, attack_is_stuck: bool, last_hotbar: int):
+    """Converts a single json step into a MineRL action, returns (minerl_action, is_null_action).
+    NOTE: if the attack is stuck, it's removed from `step_data` in-place.
+    """
+
+    # If still stuck, remove the action
+    if attack_is_stuck:
+        step_data["mouse"]["buttons"] = [
+            button for button in step_data["mouse"]["buttons"] if button != 0
+        ]
+
+    action, is_null_action = json_action_to_env_action(step_data)
+
+    # Update hotbar selection
+    current_hotbar = step_data["hotbar"]
+    if current_hotbar != last_hotbar:
+        action["hotbar.{}".format(current_hotbar + 1)] = 1
+
+    return action, is_null_action
+
+
+def env_action_generator(json_data):
+    """Yields `(step_data, action, is_null_action)` for every step in the json data, with the
+    stuck-attack and hotbar workarounds applied.
+    """
+
+    for step_data, attack_is_stuck, last_hotbar in step_state_generator(json_data):
+        action, is_null_action = get_step_action(step_data, attack_is_stuck, last_hotbar)
+        yield step_data, action, is_null_action
+
+
+# bump this whenever the contents of the null action index change.
+NULL_ACTION_INDEX_VERSION = 1
+
+
+def get_null_action_index_path(json_path: str) -> str:
+    return os.path.splitext(json_path)[0] + ".index.json"
+
+
+def build_null_action_index(json_path: str, json_data=None) -> Dict:
+    """Parse the json file once and record everything needed to know which steps survive the
+    null action filtering, without having to parse the json again:
+
+    -   length: the number of non-null steps.
+    -   frame_indices: the video frame index of every non-null step.
+    -   attack_stuck_until: the stuck attack is always a prefix of the recording, steps before this index have it removed.
+    -   last_hotbars: the hotbar selection preceding every non-null step.
+    """
+
+    if json_data is None:
+        json_data = get_json_data(json_path)
+
+    frame_indices = []
+    last_hotbars = []
+    attack_stuck_until = 0
+
+    for frame_index, (step_data, attack_is_stuck, last_hotbar) in enumerate(step_state_generator(json_data)):
         if attack_is_stuck:
-            step_data["mouse"]["buttons"] = [
-                button for button in step_data["mouse"]["buttons"] if button != 0
-            ]
+            attack_stuck_until = frame_index + 1
 
-        action, is_null_action = json_action_to_env_action(step_data)
+        _, is_null_action = get_step_action(step_data, attack_is_stuck, last_hotbar)
+        if not is_null_action:
+            frame_indices.append(frame_index)
+            last_hotbars.append(last_hotbar)
+
+    stat = os.stat(json_path)
+
+    return {
+        "version": NULL_ACTION_INDEX_VERSION,
+        "json_mtime": stat.st_mtime,
+        "json_size": stat.st_size,
+        "length": len(frame_indices),
+        "frame_indices": frame_indices,
+        "attack_stuck_until": attack_stuck_until,
+        "last_hotbars": last_hotbars,
+    }
+
+
+def _is_index_valid(index: Dict, json_path: str) -> bool:
+    stat = os.stat(json_path)
+    return (
+        index.get("version") == NULL_ACTION_INDEX_VERSION
+        and index.get("json_mtime") == stat.st_mtime
+        and index.get("json_size") == stat.st_size
+    )
+
+
+def load_null_action_index(json_path: str, json_data=None) -> Dict:
+    """Loads the sidecar null action index for the json file, building (and saving) it if it doesn't
+    exist yet or if the json file was modified since it was built.
+    """
 
-        # Update hotbar selection
-        current_hotbar = step_data["hotbar"]
-        if current_hotbar != last_hotbar:
-            action["hotbar.{}".format(current_hotbar + 1)] = 1
-        last_hotbar = current_hotbar
+    index_path = get_null_action_index_path(json_path)
+
+    if os.path.exists(index_path):
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+            if _is_index_valid(index, json_path):
+                return index
+        except ValueError:
+            warn(f"Rebuilding corrupt null action index {index_path}")
+
+    index = build_null_action_index(json_path, json_data=json_data)
+
+    # write to a temporary file first, so concurrent readers never see a partially written index.
+    try:
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+    except OSError:
+        warn(f"Could not save the null action index to {index_path}, it will be rebuilt next time.")
+
+    return index
+
+
+def get_non_null_steps(json_path: str, index: Dict = None):
+    """Returns a list of `(frame_index, step_data, action)` for every step that is not a null action,
+    where `frame_index` is the index of the corresponding frame in the video. Only the json file is read.
+    """
+
+    json_data = get_json_data(json_path)
+
+    if index is None:
+        index = load_null_action_index(json_path, json_data=json_data)
+
+    # with the index, only the non-null steps need to be converted into actions.
+    steps = []
+    for frame_index, last_hotbar in zip(index["frame_indices"], index["last_hotbars"]):
+        step_data = json_data[frame_index]
+        attack_is_stuck = frame_index < index["attack_stuck_until"]
+        action, _ = get_step_action(step_data, attack_is_stuck, last_hotbar)
+        steps.append((frame_index, step_data, action))
+    return steps
+
+
+# when the next requested frame is at most this many frames ahead, it's cheaper to
+# grab through the frames in between than it is to seek to it.
+MAX_GRAB_GAP = 32
+
+
+def read_video_frames(video_path: str, steps: Sequence[Tuple[int, Dict]]):
+    """Decode only the requested frames from the video. `steps` are `(frame_index, step_data)`
+    pairs sorted by frame index, the step data is needed to composite the cursor.
+
+    NOTE: unlike `trajectory_generator`, frames that fail to read are not skipped over when
+    counting frame indices, so corrupt videos may yield fewer frames than requested.
+    """
+
+    cursor_image, cursor_alpha = load_cursor()
+
+    video = cv2.VideoCapture(video_path)
+    position = 0
+
+    frames = []
+    for frame_index, step_data in steps:
+        assert frame_index >= position, "Frame indices must be sorted."
+
+        gap = frame_index - position
+        if gap > MAX_GRAB_GAP:
+            video.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+        else:
+            for _ in range(gap):
+                video.grab()
+
+        ret, frame = video.read()
+        position = frame_index + 1
+
+        if ret:
+            frames.append(process_frame(frame, step_data, cursor_image, cursor_alpha))
+        else:
+            print(f"Could not read frame {frame_index} from video {video_path}")
+    video.release()
+
+    return frames
+
+
+def trajectory_generator(video_path, json_path, start_frame: int = None):
+    cursor_image, cursor_alpha = load_cursor()
+
+    video = cv2.VideoCapture(video_path)
+
+    json_data = get_json_data(json_path)
+
+    # if the start frame was provided, start there.
+    if start_frame is not None:
+        video.set(1, start_frame)
+        json_data = json_data[start_frame:]
 
+    for step_data, action, is_null_action in env_action_generator(json_data):
         # Read frame even if this is null so we progress forward
         ret, frame = video.read()
         if ret:
@@ -227,16 +427,7 @@ def trajectory_generator(video_path, json_path, start_frame: int = None):
             #       We do this here as well to reduce amount of data sent over.
             if is_null_action:
                 continue
-            if step_data["isGuiOpen"]:
-                camera_scaling_factor = frame.shape[0] / MINEREC_ORIGINAL_HEIGHT_PX
-                cursor_x = int(step_data["mouse"]["x"] * camera_scaling_factor)
-                cursor_y = int(step_data["mouse"]["y"] * camera_scaling_factor)
-                composite_images_with_alpha(
-                    frame, cursor_image, cursor_alpha, cursor_x, cursor_y
-                )
-            cv2.cvtColor(frame, code=cv2.COLOR_BGR2RGB, dst=frame)
-            frame = np.asarray(np.clip(frame, 0, 255), dtype=np.uint8)
-            frame = resize_image(frame, AGENT_RESOLUTION)
+            frame = process_frame(frame, step_data, cursor_image, cursor_alpha)
             yield frame, action
 
         else:
@@ -0,0 +1,151 @@
+# An on-disk cache of the XIRLModel's frozen prefix activations (see `XIRLModel.embed_frozen_prefix`), so the frozen
+# layers only ever run once per dataset frame and training only runs the trainable tail (`XIRLModel.embed_features`).
+#
+# <cache_dir>/<frozen prefix hash>/
+#     meta.json              {"num_frozen_stages": ..., "feature_shape": [...], "dtype": ...}
+#     <trajectory name>/
+#         features.npy       (N, *feature_shape), memory-mapped, rows are written as their frames are first read.
+#         computed.npy       (N,) bool, which rows of features.npy are valid.
+#
+# Only compiled trajectories (see `fgz/data_utils/trajectory_cache.py`) are cached, they're keyed by their uid and frame
+# index. Features for other trajectories are computed on the fly. The hash covers which stages are frozen and their
+# weights, so changing either switches to a fresh directory (old ones can be removed with `remove_stale`).
+#
+# NOTE: the frozen stages must behave the same in train and eval mode (true for VPT's impala cnn, it has no batch norm
+# or dropout).
+
+import json
+import os
+import shutil
+from threading import Lock
+from typing import Dict, Sequence
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from fgz.architecture.xirl_model import XIRLModel
+from fgz.data_utils.trajectory_cache import CachedTrajectory, get_cache_path
+
+
+META_FILENAME = "meta.json"
+
+
+class FeatureCache:
+    def __init__(self, cache_dir: str, model: XIRLModel, batch_size: int = 64, dtype=np.float32):
+        self.cache_dir = cache_dir
+        self.model = model
+        self.batch_size = batch_size
+        self.dtype = np.dtype(dtype)
+
+        self._hash = None
+        self._stores: Dict[str, tuple] = {}
+
+        # prefetching worker threads may read features concurrently.
+        self._lock = Lock()
+
+    @property
+    def device(self):
+        return next(self.model.parameters()).device
+
+    @torch.no_grad()
+    def _compute(self, frames) -> np.ndarray:
+        features = []
+        for i in range(0, len(frames), self.batch_size):
+            batch = torch.as_tensor(np.array(frames[i:i + self.batch_size]), device=self.device)
+            features.append(self.model.embed_frozen_prefix(batch).cpu().numpy().astype(self.dtype))
+        return np.concatenate(features)
+
+    def get_path(self) -> str:
+        frozen_hash = self.model.get_frozen_prefix_hash()
+
+        with self._lock:
+            if frozen_hash != self._hash:
+                # the frozen set or it's weights changed, all open stores are stale.
+                self._stores = {}
+                self._hash = frozen_hash
+
+        return os.path.join(self.cache_dir, frozen_hash)
+
+    def _write_meta(self, path: str, feature_shape):
+        meta_path = os.path.join(path, META_FILENAME)
+        if os.path.exists(meta_path):
+            return
+
+        os.makedirs(path, exist_ok=True)
+        with open(meta_path, "w") as f:
+            meta = {
+                "num_frozen_stages": self.model.num_frozen_stages,
+                "feature_shape": list(feature_shape),
+                "dtype": self.dtype.name,
+            }
+            json.dump(meta, f)
+
+    def _open(self, trajectory: CachedTrajectory):
+        path = self.get_path()
+
+        with self._lock:
+            if trajectory.uid in self._stores:
+                return self._stores[trajectory.uid]
+
+            store_path = get_cache_path(path, trajectory.uid)
+            features_path = os.path.join(store_path, "features.npy")
+            computed_path = os.path.join(store_path, "computed.npy")
+
+            if os.path.exists(computed_path):
+                features = np.load(features_path, mmap_mode="r+")
+                computed = np.load(computed_path, mmap_mode="r+")
+            else:
+                # the feature shape is only known after running the prefix once.
+                feature_shape = self._compute(trajectory.frames[:1]).shape[1:]
+                self._write_meta(path, feature_shape)
+
+                os.makedirs(store_path, exist_ok=True)
+                features = np.lib.format.open_memmap(
+                    features_path, mode="w+", dtype=self.dtype, shape=(len(trajectory), *feature_shape)
+                )
+                # created last, so a store is never considered complete before it's features file is.
+                computed = np.lib.format.open_memmap(computed_path, mode="w+", dtype=bool, shape=(len(trajectory),))
+
+            self._stores[trajectory.uid] = (features, computed)
+            return features, computed
+
+    def read_features(self, trajectory, steps: Sequence) -> torch.Tensor:
+        """Drop-in replacement for `trajectory.read_frames(steps)` that returns the frozen prefix's activations."""
+
+        if not isinstance(trajectory, CachedTrajectory):
+            return torch.from_numpy(self._compute(trajectory.read_frames(steps)))
+
+        indices = [step[0] for step in steps]
+        features, computed = self._open(trajectory)
+
+        missing = sorted(set(i for i in indices if not computed[i]))
+        if missing:
+            features[missing] = self._compute(trajectory.frames[missing])
+
+            # the features must reach the disk before they're marked as computed, otherwise a crash in between could
+            # leave rows of zeros that are considered valid.
+            features.flush()
+            computed[missing] = True
+            computed.flush()
+
+        return torch.from_numpy(np.array(features[indices]))
+
+    def compile_trajectories(self, trajectories: Sequence, use_tqdm: bool = True):
+        """Compute the features of every frame of the compiled trajectories ahead of time."""
+
+        for trajectory in tqdm(trajectories, desc="Caching features", disable=not use_tqdm):
+            if isinstance(trajectory, CachedTrajectory):
+                self.read_features(trajectory, trajectory.get_non_null_steps())
+
+    def remove_stale(self):
+        """Delete the features of every other frozen prefix hash."""
+
+        current = os.path.basename(self.get_path())
+        if not os.path.isdir(self.cache_dir):
+            return
+
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name != current and os.path.exists(os.path.join(path, META_FILENAME)):
+                shutil.rmtree(path)
@@ -0,0 +1,225 @@
+# A one-time "compile dataset" step that decodes every chunked trajectory once, and writes it to an on-disk cache:
+#
+# <cache_dir>/<trajectory name>/
+#     frames.npy   (N, 128, 128, 3) uint8, memory-mapped when read.
+#     buttons.npy  (N,) uint32 bitmask over `BUTTON_KEYS` (including the hotbar keys).
+#     camera.npy   (N, 2) float64, like the uncached actions.
+#     meta.json    {"uid": ..., "length": ..., "version": ...}
+#
+# Only frames/actions that survive null action filtering are stored, so no video decoding or json parsing
+# is needed to sample from a cached trajectory. Trajectories compiled with an older `CACHE_VERSION` are not
+# considered cached.
+
+import argparse
+import json
+import os
+from typing import Dict, List, Sequence
+
+import numpy as np
+from tqdm import tqdm
+
+from vpt.agent import AGENT_RESOLUTION
+
+from fgz.data_utils.data_loader import NOOP_ACTION
+
+
+BUTTON_KEYS = [key for key in NOOP_ACTION.keys() if key != "camera"]
+assert len(BUTTON_KEYS) <= 32
+
+META_FILENAME = "meta.json"
+
+# version 2: the hotbar keys are part of the buttons bitmask (multiple hotbar keys can be pressed in a step), and
+# the camera is no longer rounded to float32.
+CACHE_VERSION = 2
+
+
+def get_cache_path(cache_dir: str, uid: str) -> str:
+    return os.path.join(cache_dir, os.path.basename(uid))
+
+
+def is_cached(cache_dir: str, uid: str) -> bool:
+    meta_path = os.path.join(get_cache_path(cache_dir, uid), META_FILENAME)
+    if not os.path.exists(meta_path):
+        return False
+
+    with open(meta_path) as f:
+        return json.load(f).get("version") == CACHE_VERSION
+
+
+def actions_to_columns(actions: Sequence[Dict]):
+    """Convert a list of MineRL action dicts into dense columnar arrays."""
+
+    n = len(actions)
+    buttons = np.zeros(n, dtype=np.uint32)
+    camera = np.zeros((n, 2), dtype=float)
+
+    for i, action in enumerate(actions):
+        for bit, key in enumerate(BUTTON_KEYS):
+            if action[key]:
+                buttons[i] |= 1 << bit
+
+        camera[i] = np.asarray(action["camera"]).flatten()
+
+    return buttons, camera
+
+
+def unpack_columns(buttons: np.ndarray, camera: np.ndarray) -> Dict[str, np.ndarray]:
+    """Columnar batch (1 array per action key, see `vectorize_minerl_actions`) of the given columns."""
+
+    columns = {key: ((buttons >> bit) & 1).astype(np.int64) for bit, key in enumerate(BUTTON_KEYS)}
+    columns["camera"] = np.asarray(camera, dtype=float)
+    return columns
+
+
+def columns_to_actions(buttons: np.ndarray, camera: np.ndarray) -> List[Dict]:
+    """Convert columnar arrays back into a list of MineRL action dicts."""
+
+    actions = []
+    for i in range(len(buttons)):
+        action = NOOP_ACTION.copy()
+
+        button_mask = int(buttons[i])
+        for bit, key in enumerate(BUTTON_KEYS):
+            action[key] = (button_mask >> bit) & 1
+
+        action["camera"] = np.array(camera[i], dtype=float)
+        actions.append(action)
+
+    return actions
+
+
+def compile_trajectory(trajectory, cache_dir: str):
+    """Decode all frames of a `ChunkedContiguousTrajectory` and write them (with their actions) to the cache."""
+
+    path = get_cache_path(cache_dir, trajectory.uid)
+    os.makedirs(path, exist_ok=True)
+
+    meta_path = os.path.join(path, META_FILENAME)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    # corrupt frames are skipped by the trajectory iterator, so this is only an upper bound.
+    # (an empty memmap can't be created, hence the minimum of 1)
+    steps = trajectory.get_non_null_steps()
+    max_length = max(1, len(steps))
+
+    frames = np.lib.format.open_memmap(
+        os.path.join(path, "frames.npy"),
+        mode="w+",
+        dtype=np.uint8,
+        shape=(max_length, *AGENT_RESOLUTION, 3),
+    )
+
+    actions = []
+    for i, (frame, action) in enumerate(trajectory):
+        frames[i] = frame
+        actions.append(action)
+    frames.flush()
+    del frames
+
+    buttons, camera = actions_to_columns(actions)
+    np.save(os.path.join(path, "buttons.npy"), buttons)
+    np.save(os.path.join(path, "camera.npy"), camera)
+
+    # written last, so a partially compiled trajectory is never considered cached.
+    with open(meta_path, "w") as f:
+        json.dump({"uid": trajectory.uid, "length": len(actions), "version": CACHE_VERSION}, f)
+
+    return path
+
+
+class CachedTrajectory:
+    """Drop-in replacement for `ChunkedContiguousTrajectory` that reads from the compiled cache. Frames
+    are memory-mapped, so only the frames that are actually indexed are read from the disk.
+    """
+
+    def __init__(self, cache_dir: str, uid: str, task_id: int = None):
+        self.path = get_cache_path(cache_dir, uid)
+        self.uid = uid
+        self.task_id = task_id
+
+        with open(os.path.join(self.path, META_FILENAME)) as f:
+            self.length = json.load(f)["length"]
+
+        self._frames = None
+        self._buttons = None
+        self._camera = None
+
+    def _load(self):
+        if self._frames is None:
+            self._frames = np.load(os.path.join(self.path, "frames.npy"), mmap_mode="r")
+            self._buttons = np.load(os.path.join(self.path, "buttons.npy"), mmap_mode="r")
+            self._camera = np.load(os.path.join(self.path, "camera.npy"), mmap_mode="r")
+
+    @property
+    def frames(self) -> np.ndarray:
+        self._load()
+        return self._frames[:self.length]
+
+    def get_actions(self, start: int = 0, end: int = None) -> List[Dict]:
+        self._load()
+        end = self.length if end is None else min(end, self.length)
+        return columns_to_actions(self._buttons[start:end], self._camera[start:end])
+
+    def get_columnar_actions(self, start: int = 0, end: int = None) -> Dict[str, np.ndarray]:
+        """Same actions as `get_actions`, as a columnar batch (no per-step python)."""
+
+        self._load()
+        end = self.length if end is None else min(end, self.length)
+        return unpack_columns(self._buttons[start:end], self._camera[start:end])
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self) -> str:
+        return f"CachedT({self.uid}, n={self.length})"
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
+    def __iter__(self):
+        return zip(self.frames, self.get_actions())
+
+    def get_non_null_steps(self) -> np.ndarray:
+        """Null actions were already filtered out when compiling, so every step is `(index,)`, returned as a single
+        `(N, 1)` array. Unlike the other trajectories the steps don't hold their actions, use `get_actions` or
+        `get_columnar_actions` for the ranges that are needed.
+        """
+
+        return np.arange(self.length)[:, None]
+
+    def read_frames(self, steps: Sequence):
+        indices = [step[0] for step in steps]
+        return self.frames[indices]
+
+    def get_last_frame(self):
+        return np.array(self.frames[-1])
+
+    # memory maps should not be pickled (ie. when sending to a worker process), they'll be re-opened lazily.
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_frames"] = state["_buttons"] = state["_camera"] = None
+        return state
+
+
+def compile_dataset(dataset_path: str, cache_dir: str, overwrite: bool = False, use_tqdm: bool = True):
+    # import here to avoid a circular import.
+    from fgz.data_utils.contiguous_trajectory_loader import get_trajectories
+
+    train_trajectories, eval_trajectories = get_trajectories(dataset_path, train_split=0.8)
+    trajectories = train_trajectories + eval_trajectories
+
+    for trajectory in tqdm(trajectories, desc="Compiling trajectories", disable=not use_tqdm):
+        if not overwrite and is_cached(cache_dir, trajectory.uid):
+            continue
+        compile_trajectory(trajectory, cache_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode a MineRL dataset once into a memory-mapped trajectory cache.")
+    parser.add_argument("--dataset-path", type=str, required=True, help="Directory with the .mp4/.jsonl pairs.")
+    parser.add_argument("--cache-dir", type=str, required=True, help="Directory to write the compiled trajectories to.")
+    parser.add_argument("--overwrite", action="store_true", help="Recompile trajectories that are already cached.")
+    args = parser.parse_args()
+
+    compile_dataset(args.dataset_path, args.cache_dir, overwrite=args.overwrite)
@@ -0,0 +1,93 @@
+import numpy as np
+import torch
+from vpt.agent import AGENT_RESOLUTION
+
+from fgz.data_utils.contiguous_trajectory_loader import read_frames_and_actions_sparse
+from fgz.data_utils.data_loader import NOOP_ACTION
+from fgz.data_utils.trajectory_cache import (
+    BUTTON_KEYS,
+    CachedTrajectory,
+    actions_to_columns,
+    columns_to_actions,
+    compile_trajectory,
+    is_cached,
+)
+
+
+def _random_actions(n: int, rng):
+    actions = []
+    for _ in range(n):
+        action = NOOP_ACTION.copy()
+        for key in BUTTON_KEYS:
+            action[key] = int(rng.random() < 0.3)
+        action["camera"] = rng.normal(size=2) * 10
+        actions.append(action)
+    return actions
+
+
+def _assert_actions_equal(actions, expected):
+    assert len(actions) == len(expected)
+    for action, expected_action in zip(actions, expected):
+        assert action.keys() == expected_action.keys()
+        for key, value in expected_action.items():
+            np.testing.assert_array_equal(action[key], value)
+
+
+class _SourceTrajectory:
+    """In memory stand-in for a `ContiguousTrajectory` with only non-null steps."""
+
+    def __init__(self, n: int, rng):
+        self.uid = "source-trajectory"
+        self.frames = rng.integers(0, 256, size=(n, *AGENT_RESOLUTION, 3), dtype=np.uint8)
+        self.actions = _random_actions(n, rng)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __iter__(self):
+        return zip(self.frames, self.actions)
+
+    def get_non_null_steps(self):
+        return list(enumerate(self.actions))
+
+    def read_frames(self, steps):
+        return self.frames[[step[0] for step in steps]]
+
+
+def test_columns_round_trip():
+    actions = _random_actions(64, np.random.default_rng(0))
+
+    # several hotbar keys pressed in the same step must survive.
+    actions[0].update({"hotbar.1": 1, "hotbar.5": 1, "hotbar.9": 1})
+
+    _assert_actions_equal(columns_to_actions(*actions_to_columns(actions)), actions)
+
+
+def test_cached_trajectory_matches_source(tmp_path):
+    source = _SourceTrajectory(20, np.random.default_rng(1))
+
+    cache_dir = str(tmp_path)
+    compile_trajectory(source, cache_dir)
+    assert is_cached(cache_dir, source.uid)
+
+    cached = CachedTrajectory(cache_dir, source.uid)
+    assert len(cached) == len(source)
+
+    steps = cached.get_non_null_steps()
+    assert len(steps) == len(source)
+    np.testing.assert_array_equal(cached.read_frames(steps[[0, 3, 19]]), source.frames[[0, 3, 19]])
+
+    _assert_actions_equal(cached.get_actions(), source.actions)
+    _assert_actions_equal(cached.get_actions(4, 9), source.actions[4:9])
+
+    columns = cached.get_columnar_actions(4, 9)
+    for i, action in enumerate(source.actions[4:9]):
+        for key, value in action.items():
+            np.testing.assert_array_equal(columns[key][i], value)
+
+    frames, sup_actions = read_frames_and_actions_sparse(cached, num_frame_samples=6)
+    expected_frames, expected_sup_actions = read_frames_and_actions_sparse(source, num_frame_samples=6)
+    assert torch.equal(frames, expected_frames)
+    assert len(sup_actions) == len(expected_sup_actions)
+    for actions, expected in zip(sup_actions, expected_sup_actions):
+        _assert_actions_equal(actions, expected)
@@ -6,6 +6,7 @@ from fgz.architecture.dynamics_function import DynamicsFunction
 
 from fgz.data_utils.xirl_data import MultiProcessXIRLDataHandler, XIRLDataHandler
 from xirl_config import XIRLConfig
+from fgz.architecture.tcc import cycle_back
 from fgz.architecture.xirl_model import XIRLModel
 
 import wandb
@@ -44,23 +45,6 @@ class XIRLTrainer:
 
         self.get_next_data()
 
-    def soft_nearest_neighbor(
-        self, frame_embedding: torch.Tensor,
-        other_embeddings: List[torch.Tensor],
-    ):
-        expanded_frame_embedding = frame_embedding.expand(
-            len(other_embeddings), -1
-        )
-
-        # l2 similarity
-        similarity = -torch.norm(expanded_frame_embedding - other_embeddings, dim=1)
-        similarity /= self.config.temperature
-
-        alpha_k = torch.softmax(similarity, dim=0)
-
-        return alpha_k
-
-
     def unroll(self):
         unroll_steps = 8
 
@@ -140,9 +124,6 @@ class XIRLTrainer:
         for _ in range(num_batches):
             self.optimizer.zero_grad()
 
-            index_preds = []
-            index_logits = []
-
             chosen_indices = torch.randint(
                 low=0, high=max_index, size=(self.config.batch_size,)
             )
@@ -152,35 +133,13 @@ class XIRLTrainer:
 
             embeddings = self.model.embed(frames)
 
-            # TODO: vectorize better
-            for i in range(self.config.batch_size):
-                self.ui = embeddings[i]
-
-                # calculate cycle MSE loss
-                alpha_k = self.soft_nearest_neighbor(
-                    self.ui, self.embedded_t1
-                )
-                v_squiggly = torch.sum(alpha_k.unsqueeze(-1) * self.embedded_t1, dim=0)
-
-                beta = self.soft_nearest_neighbor(
-                    v_squiggly, self.embedded_t0
-                )
-
-                frame_mult = torch.arange(
-                    start=1, end=len(beta) + 1, dtype=float, device=beta.device
-                ).float()# / len(beta)
-                mu = torch.matmul(frame_mult, beta) # / len(beta)
-
-                index_preds.append(mu)
-                index_logits.append(beta)
-
-            index_preds = torch.stack(index_preds)
+            index_preds, index_logits = cycle_back(
+                embeddings, self.embedded_t0, self.embedded_t1, temperature=self.config.temperature,
+            )
 
             unnormalized_mse = F.mse_loss(index_preds, target_indices)
             normalized_mse = F.mse_loss(index_preds / max_index, target_indices / max_index)
 
-            index_logits = torch.stack(index_logits)
-
             # cross_entropy_labels = F.one_hot(chosen_indices.to(self.device), num_classes=max_index, dtype=float)
             cross_entropy_labels = target_indices.long()
             ce_loss = F.cross_entropy(index_logits, cross_entropy_labels) / torch.log(torch.tensor(max_index))
@@ -23,8 +23,9 @@ class Tester:
     representation_function: XIRLModel
     dynamics_function: DynamicsFunction
 
-    def __init__(self, path_to_experiment: str, iteration: int=None, device=None):
+    def __init__(self, path_to_experiment: str, iteration: int=None, device=None, compile_search: bool=False):
         self.path_to_experiment = path_to_experiment
+        self.compile_search = compile_search
         
         checkpoint_dir = os.path.join(path_to_experiment, "checkpoints")
 
@@ -54,6 +55,8 @@ class Tester:
 
         self.new_video_paths = []
 
+        self.fmc = None
+
     def load_environment(self, env: gym.Env=None):
         if env is None:
             env = gym.make(self.minerl_env_id)
@@ -63,37 +66,59 @@ class Tester:
             raise ValueError(f"Cross-task testing is not recommended. The actual env ID loaded was {actual_env_id}, but we expected {self.minerl_env_id}.")
 
         self.env = env
+        self.fmc = None
+
+    def _get_fmc(self) -> DynamicsFMC:
+        # the search (and its buffers) is reused between calls.
+        if self.fmc is None:
+            self.fmc = DynamicsFMC(
+                self.dynamics_function, 
+                self.target_state, 
+                self.env.action_space,
+                num_walkers=512,
+                steps=128,
+                balance=3.0,
+                compile_step=self.compile_search,
+            )
+        return self.fmc
+
+    def get_actions(self, observations, force_no_escape: bool, warm_start_shift: int = None):
+        """Plan from a batch of observations at once (ie. many environments or candidate start frames), returns a list of
+        action sequences, 1 per observation.
+
+        `warm_start_shift` is the number of actions executed since the last call, when given the previous plan is
+        shifted forward and refined instead of replanning from scratch (see `DynamicsFMC.get_batched_actions`). Only the
+        refined actions of a warm started plan are returned.
+        """
 
-    def get_action(self, obs, force_no_escape: bool):
         self.representation_function.eval()
         self.dynamics_function.eval()
 
-        # x = torch.tensor(obs["pov"], device=self.device)
-        x = self.representation_function.prepare_observation(obs).to(self.device)
-        state = self.representation_function.embed(x).squeeze()
-
-        fmc = DynamicsFMC(
-            self.dynamics_function, 
-            self.target_state, 
-            self.env.action_space,
-            num_walkers=512,
-            steps=128,
-            balance=3.0,
-        )
+        x = torch.cat([self.representation_function.prepare_observation(obs) for obs in observations]).to(self.device)
+        states = self.representation_function.embed(x)
 
-        actions = fmc.get_actions(state)
+        batched_actions = self._get_fmc().get_batched_actions(states, warm_start_shift=warm_start_shift)
 
         action_percent = 0.5
-        max_action_index = max(1, int(np.ceil(len(actions) * action_percent)))
-        print("total actions", len(actions), "max", max_action_index)
+        max_action_index = max(1, int(np.ceil(batched_actions.shape[1] * action_percent)))
+        if warm_start_shift is not None:
+            max_action_index = min(max_action_index, self._get_fmc().refine_steps)
+        print("total actions", batched_actions.shape[1], "max", max_action_index)
+
+        action_sequences = []
+        for actions in batched_actions:
+            actions = actions[:max_action_index].tolist()
+
+            for action in actions:
+                if force_no_escape:
+                    action["ESC"] = 0
 
-        actions = actions[:max_action_index].flatten().tolist()
+            action_sequences.append(actions)
 
-        for action in actions:
-            if force_no_escape:
-                action["ESC"] = 0
+        return action_sequences
 
-        return actions
+    def get_action(self, obs, force_no_escape: bool, warm_start_shift: int = None):
+        return self.get_actions([obs], force_no_escape, warm_start_shift=warm_start_shift)[0]
 
     def play_episode(
         self, 
@@ -103,6 +128,7 @@ class Tester:
         smoke_test: bool = False, 
         use_tqdm: bool = True,
         save_video: bool = False,
+        warm_start: bool = False,
     ):
         if self.env is None:
             raise ValueError("load_environment must be called first.")
@@ -124,6 +150,7 @@ class Tester:
             self.new_video_paths.append(video_path)
 
         self.play_step = 0
+        num_executed = None
 
         def _after_step():
             if save_video:
@@ -141,7 +168,12 @@ class Tester:
 
         # for step in tqdm(range(max_steps), desc=f"Playing {self.minerl_env_id} Episode", disable=not use_tqdm):
         while True:
-            actions = self.get_action(obs, force_no_escape=self.play_step < min_steps)
+            actions = self.get_action(
+                obs, 
+                force_no_escape=self.play_step < min_steps, 
+                warm_start_shift=num_executed if warm_start else None,
+            )
+            num_executed = 0
 
             if smoke_test:
                 obs = np.random.uniform(size=(*AGENT_RESOLUTION, 3))
@@ -150,11 +182,13 @@ class Tester:
                 info = {}
 
                 _after_step()
+                num_executed = len(actions)
             else:
                 for action in actions:
                     obs, reward, done, info = self.env.step(action)
 
                     _after_step()
+                    num_executed += 1
 
                     if done:
                         break
@@ -177,7 +211,9 @@ if __name__ == "__main__":
     parser.add_argument("--smoke-test", action="store_true")
     parser.add_argument("--save-video", action="store_true")
     parser.add_argument("--render", action="store_true")
+    parser.add_argument("--warm-start", action="store_true", help="Refine the previous plan instead of replanning from scratch.")
     parser.add_argument("--force-cpu", action="store_true")
+    parser.add_argument("--compile-search", action="store_true", help="Compile the FMC search step (slow first plan).")
 
     args = dict(parser.parse_args().__dict__)
     
@@ -189,7 +225,12 @@ if __name__ == "__main__":
     if args.pop("force_cpu"):
         device = torch.device("cpu")
 
-    tester = Tester(experiment_dir, iteration=args.pop("iteration"), device=device)
+    tester = Tester(
+        experiment_dir, 
+        iteration=args.pop("iteration"), 
+        device=device, 
+        compile_search=args.pop("compile_search"),
+    )
 
     tester.load_environment()
     tester.play_episode(**args)
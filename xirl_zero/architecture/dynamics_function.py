@@ -1,48 +1,152 @@
 import minerl
 import gym
 
-from typing import Dict, List
+from typing import Dict, List, Mapping, Sequence, Union
 from vpt.agent import MineRLAgent
 
 from vpt.lib.actions import Buttons
+import numpy as np
 import torch
 import torch.nn.functional as F
 
+from fractal_zero.utils import gather_cloning_primitive
 from fractal_zero.vectorized_environment import VectorizedEnvironment
 
 
 num_actions = len(Buttons.ALL)
 
 
-def _vectorize_buttons(action: Dict):
-    a = torch.zeros(num_actions, dtype=float)
-    for i, button_str in enumerate(Buttons.ALL):
-        a[i] = torch.tensor(action[button_str], dtype=float)
-    a[a > 0] = torch.softmax(a[a > 0], dim=0)
-    return a
+def _softmax_pressed_buttons(buttons: torch.Tensor):
+    """Softmax over only the pressed (> 0) buttons of each row, unpressed buttons are left as is."""
+
+    pressed = buttons > 0
+    logits = buttons.masked_fill(~pressed, float("-inf"))
+    # rows without any pressed buttons are all -inf (nan after softmax), but those are never selected.
+    return torch.where(pressed, torch.softmax(logits, dim=-1), buttons)
+
+
+def _columnar_actions_to_arrays(actions: Mapping):
+    camera = actions["camera"]
+    buttons = [actions[button_str] for button_str in Buttons.ALL]
+
+    if isinstance(camera, torch.Tensor):
+        buttons = torch.stack([torch.as_tensor(b, device=camera.device) for b in buttons], dim=-1)
+        return buttons.float(), camera.float()
+
+    return np.stack([np.asarray(b) for b in buttons], axis=-1), np.asarray(camera)
+
+
+def vectorize_minerl_actions(actions: Union[Sequence[Dict], Mapping], camera_scale: float = 180, device=None):
+    """Vectorize a batch of MineRL actions into `(N, num_actions)` button and `(N, 2)` camera tensors.
+
+    `actions` can either be a list of MineRL action dicts, or a columnar batch (a single dict with 1 array/tensor
+    of N elements for each key). Columnar batches of tensors are vectorized without leaving their device.
+    """
+
+    if isinstance(actions, Mapping):
+        buttons, camera = _columnar_actions_to_arrays(actions)
+    else:
+        buttons = np.array([[action[button_str] for button_str in Buttons.ALL] for action in actions], dtype=np.float32)
+        camera = np.array([np.asarray(action["camera"]).reshape(2) for action in actions], dtype=np.float32)
+
+    if isinstance(buttons, np.ndarray):
+        # single host -> device copy.
+        packed = np.concatenate((buttons.reshape(-1, num_actions), camera.reshape(-1, 2)), axis=-1)
+        packed = torch.from_numpy(packed.astype(np.float32))
+        if device is not None:
+            packed = packed.to(device)
+        buttons, camera = packed[:, :num_actions], packed[:, num_actions:]
+    elif device is not None:
+        buttons, camera = buttons.to(device), camera.to(device)
+
+    return _softmax_pressed_buttons(buttons), camera / camera_scale
 
 
 def vectorize_minerl_action(action: Dict, camera_scale: float = 180):
     # group movement keys
-    button_vec = _vectorize_buttons(action)
-    camera_vec = torch.tensor(action["camera"], dtype=float) / camera_scale
-    return button_vec.float(), camera_vec.squeeze().float()
+    button_vecs, camera_vecs = vectorize_minerl_actions([action], camera_scale=camera_scale)
+    return button_vecs[0], camera_vecs[0]
+
+
+def vectorize_action_segments(segments: Sequence[Sequence[Dict]], camera_scale: float = 180, device=None):
+    """Vectorize variable length segments of actions into padded tensors. Returns buttons `(segments, max_len, num_actions)`,
+    camera `(segments, max_len, 2)` and a boolean mask `(segments, max_len)` that is true for real (non-padded) actions.
+    """
+
+    lengths = torch.tensor([len(segment) for segment in segments], dtype=torch.long)
+    num_segments = len(segments)
+    max_len = int(lengths.max()) if num_segments > 0 else 0
 
+    buttons = torch.zeros((num_segments, max_len, num_actions))
+    camera = torch.zeros((num_segments, max_len, 2))
+    mask = torch.zeros((num_segments, max_len), dtype=bool)
 
-def vectorize_minerl_actions(actions: List[Dict], camera_scale: float = 180, device=None):
-    button_vecs = []
-    camera_vecs = []
-    for action in actions:
-        bv, cv = vectorize_minerl_action(action, camera_scale=camera_scale)
-        button_vecs.append(bv)
-        camera_vecs.append(cv)
+    flat_actions = [action for segment in segments for action in segment]
+    if len(flat_actions) > 0:
+        button_vecs, camera_vecs = vectorize_minerl_actions(flat_actions, camera_scale=camera_scale)
 
-    button_vecs, camera_vecs = torch.stack(button_vecs), torch.stack(camera_vecs)
+        segment_indices = torch.repeat_interleave(torch.arange(num_segments), lengths)
+        step_indices = torch.cat([torch.arange(length) for length in lengths.tolist()])
+
+        buttons[segment_indices, step_indices] = button_vecs
+        camera[segment_indices, step_indices] = camera_vecs
+        mask[segment_indices, step_indices] = True
 
     if device is not None:
-        return button_vecs.to(device), camera_vecs.to(device)
+        return buttons.to(device), camera.to(device), mask.to(device)
+
+    return buttons, camera, mask
+
+
+class BatchedActionSampler:
+    """Samples actions for many walkers at once from a MineRL (gym) Dict action space as a columnar batch, which is a
+    dict with 1 tensor per key of the space. Discrete subspaces are sampled uniformly over their `n` values, and Box subspaces
+    uniformly between their bounds (the same marginals as `action_space.sample()`), directly on the given device.
+
+    Columnar batches can be passed directly to `vectorize_minerl_actions`, and rows can be decoded back into regular MineRL
+    action dicts with `decode`.
+    """
+
+    def __init__(self, action_space: gym.spaces.Dict):
+        self.discrete_sizes = {}
+        self.box_bounds = {}
+
+        for key, subspace in action_space.spaces.items():
+            if isinstance(subspace, gym.spaces.Discrete):
+                self.discrete_sizes[key] = int(subspace.n)
+            elif isinstance(subspace, gym.spaces.Box):
+                if not subspace.is_bounded():
+                    raise ValueError(f"Box subspace {key} must be bounded to be sampled uniformly.")
+                low = torch.tensor(subspace.low, dtype=torch.float32)
+                high = torch.tensor(subspace.high, dtype=torch.float32)
+                self.box_bounds[key] = (low, high)
+            else:
+                raise NotImplementedError(f"Sampling {type(subspace)} subspaces ({key}) is not supported.")
+
+    def sample(self, n: int, device=None) -> Dict[str, torch.Tensor]:
+        actions = {}
+
+        for key, size in self.discrete_sizes.items():
+            actions[key] = torch.randint(low=0, high=size, size=(n,), device=device)
+
+        for key, (low, high) in self.box_bounds.items():
+            low, high = low.to(device), high.to(device)
+            actions[key] = low + (high - low) * torch.rand((n, *low.shape), device=device)
+
+        return actions
+
+    @staticmethod
+    def decode(actions: Mapping, index: int) -> Dict:
+        """Convert a single row of a columnar batch into a MineRL action dict."""
 
-    return button_vecs, camera_vecs
+        action = {}
+        for key, values in actions.items():
+            value = values[index]
+            if value.dim() == 0:
+                action[key] = int(value.item())
+            else:
+                action[key] = value.detach().cpu().numpy()
+        return action
 
 
 class DynamicsFunction(torch.nn.Module):
@@ -161,19 +265,19 @@ class MineRLDynamicsEnvironment(VectorizedEnvironment):
         )
 
         # don't forward frozen states, frozen state's confusions are 0.
-        self.states[freeze_mask != 1] = new_states[freeze_mask != 1]
+        self.states = torch.where(freeze_mask.bool().unsqueeze(-1), self.states, new_states)
 
         # inverse l2 distance between the current states and the target states are the rewards
         rewards = -torch.norm(self.states[:] - self.target_state, dim=1)
 
         obs = self.states
-        dones = torch.zeros(self.n).bool()
+        dones = torch.zeros(self.n, device=self.states.device).bool()
         infos = [{} for _ in range(len(self.states))]
 
         return self.states, obs, rewards, dones, infos
 
     def clone(self, partners, clone_mask):
-        self.states[clone_mask] = self.states[partners[clone_mask]]
+        self.states = gather_cloning_primitive(self.states, partners, clone_mask)
 
     def batch_reset(self):
         # no need to be able to reset for our purposes.
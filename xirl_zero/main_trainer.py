@@ -9,7 +9,8 @@ import wandb
 
 import time
 
-from fgz.data_utils.contiguous_trajectory_loader import ContiguousTrajectoryLoader
+from fgz.data_utils.contiguous_trajectory_loader import ContiguousTrajectoryLoader, PrefetchingTrajectorySampler
+from fgz.data_utils.feature_cache import FeatureCache
 from xirl_zero.trainers.tcc_representation import TCCConfig, TCCRepresentationTrainer
 from xirl_zero.trainers.muzero_dynamics import MuZeroDynamicsConfig, MuZeroDynamicsTrainer
 
@@ -30,6 +31,20 @@ class Config:
 
     num_frame_samples: int = 128
 
+    # only decode the sampled frames from the videos (the actions in between come from the json files).
+    sparse_decoding: bool = True
+
+    # directory of compiled trajectories (see `fgz/data_utils/trajectory_cache.py`), uncached trajectories are decoded from the videos.
+    cache_dir: str = None
+
+    # directory of the representation model's frozen prefix features (see `fgz/data_utils/feature_cache.py`), so
+    # only the unfrozen layers run while training. features of uncompiled trajectories are computed every time.
+    feature_cache_dir: str = None
+
+    # trajectory pairs are decoded in background threads, set workers to 0 to load synchronously.
+    prefetch_workers: int = 2
+    prefetch_queue_size: int = 4
+
     verbose: bool = True
 
     use_wandb: bool = False
@@ -85,10 +100,18 @@ class Trainer:
 
         self.config = config
 
-        self.representation_trainer = TCCRepresentationTrainer(config.representation_config)
+        use_feature_cache = config.feature_cache_dir is not None
+        self.representation_trainer = TCCRepresentationTrainer(config.representation_config, from_features=use_feature_cache)
         self.dynamics_trainer = MuZeroDynamicsTrainer(config.dynamics_config)
 
-        self.train_loader, self.eval_loader = ContiguousTrajectoryLoader.get_train_and_eval_loaders(config.dataset_path, max_trajectories=self.config.max_trajectories)
+        self.train_loader, self.eval_loader = ContiguousTrajectoryLoader.get_train_and_eval_loaders(
+            config.dataset_path,
+            max_trajectories=self.config.max_trajectories,
+            sparse_decoding=self.config.sparse_decoding,
+            cache_dir=self.config.cache_dir,
+            feature_cache=FeatureCache(config.feature_cache_dir, self.representation_trainer.model) if use_feature_cache else None,
+        )
+        self._setup_prefetching()
 
         self.train_steps_taken = 0
 
@@ -102,16 +125,39 @@ class Trainer:
         else:
             self.run_name = now_filename()
 
-    def sample(self, from_train: bool):
-        # TODO: latency hide dataloading?
+    def _setup_prefetching(self):
+        self.train_prefetcher = None
+        self.eval_prefetcher = None
+
+        if self.config.prefetch_workers <= 0:
+            return
 
+        def _prefetcher(loader: ContiguousTrajectoryLoader):
+            return PrefetchingTrajectorySampler(
+                loader,
+                num_frame_samples=self.config.num_frame_samples,
+                max_frames=self.config.max_frames,
+                num_workers=self.config.prefetch_workers,
+                queue_size=self.config.prefetch_queue_size,
+            )
+
+        self.train_prefetcher = _prefetcher(self.train_loader)
+        self.eval_prefetcher = _prefetcher(self.eval_loader)
+
+    def sample(self, from_train: bool):
         loader = self.train_loader if from_train else self.eval_loader
+        prefetcher = self.train_prefetcher if from_train else self.eval_prefetcher
 
         start = time.time()
 
-        kwargs = {"num_frame_samples": self.config.num_frame_samples, "max_frames": self.config.max_frames}
-        t0, t0_actions = loader.sample(**kwargs)
-        t1, t1_actions = loader.sample(**kwargs)
+        if prefetcher is not None:
+            t0, t0_actions, t1, t1_actions = prefetcher.sample()
+            self.prefetch_stats = prefetcher.get_stats()
+        else:
+            kwargs = {"num_frame_samples": self.config.num_frame_samples, "max_frames": self.config.max_frames}
+            t0, t0_actions = loader.sample(**kwargs)
+            t1, t1_actions = loader.sample(**kwargs)
+            self.prefetch_stats = {}
 
         self.time_to_load_data = time.time() - start
 
@@ -127,6 +173,7 @@ class Trainer:
             "total_frames": len(t0) + len(t1),
             "total_actions": atotal,
             "load_seconds": self.time_to_load_data,
+            **self.prefetch_stats,
         }
 
     def train_step(self):
@@ -199,14 +246,20 @@ class Trainer:
         # these variables are not saveable, so remove them before saving, then restore.
         train_loader = self.train_loader
         eval_loader = self.eval_loader
+        train_prefetcher = self.train_prefetcher
+        eval_prefetcher = self.eval_prefetcher
         self.train_loader = None
         self.eval_loader = None
+        self.train_prefetcher = None
+        self.eval_prefetcher = None
 
         torch.save(self, path)
         print(f"Saved checkpoint to {path}")
 
         self.train_loader = train_loader
         self.eval_loader = eval_loader
+        self.train_prefetcher = train_prefetcher
+        self.eval_prefetcher = eval_prefetcher
 
         return path
 
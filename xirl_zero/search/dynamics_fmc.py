@@ -2,6 +2,8 @@
 
 
 
+import functools
+from typing import Dict
 import minerl
 import torch
 import torch.nn.functional as F
@@ -9,22 +11,95 @@ import gym
 
 import numpy as np
 
-from xirl_zero.architecture.dynamics_function import DynamicsFunction, vectorize_minerl_actions
+from xirl_zero.architecture.dynamics_function import BatchedActionSampler, DynamicsFunction, vectorize_minerl_actions
 
 
 
 def _relativize_vector(vector: torch.Tensor):
-    std = vector.std()
-    if std == 0:
-        return torch.ones(len(vector))
-    standard = (vector - vector.mean()) / std
-    standard[standard > 0] = torch.log(1 + standard[standard > 0]) + 1
-    standard[standard <= 0] = torch.exp(standard[standard <= 0])
-    return standard
+    """Relativize along the last dimension, so a (roots, walkers) batch is relativized independently per root."""
+
+    std = vector.std(dim=-1, keepdim=True)
+    # when all values are equal the standardized values are 0, which are all mapped to 1 below.
+    standard = (vector - vector.mean(dim=-1, keepdim=True)) / torch.where(std > 0, std, torch.ones_like(std))
+    return torch.where(standard > 0, torch.log(1 + standard) + 1, torch.exp(standard))
+
+
+def _clone_step(
+    states: torch.Tensor,
+    target_state: torch.Tensor,
+    partners: torch.Tensor,
+    clone_thresholds: torch.Tensor,
+    balance: float,
+):
+    """Score and clone (B, W, D) walker states. `partners` (B, W) and `clone_thresholds` (B, 1) are sampled by the
+    caller. Returns the cloned states, and for each walker the index of the walker it copied (itself if it didn't clone).
+    """
+
+    # scores are inverse l2 distance to the target state.
+    scores = -torch.linalg.vector_norm(states - target_state, dim=-1)
+
+    # partners are always chosen from the same root.
+    partner_states = torch.gather(states, 1, partners.unsqueeze(-1).expand(states.shape))
+    walker_distances = 1 - F.cosine_similarity(states, partner_states, dim=-1)
+
+    rel_scores = _relativize_vector(scores)
+    rel_distances = _relativize_vector(walker_distances)
+    virtual_rewards = rel_scores ** balance * rel_distances
+
+    # calculate the clone mask
+    vr = virtual_rewards
+    pair_vr = torch.gather(virtual_rewards, 1, partners)
+    value = (pair_vr - vr) / torch.where(vr > 0, vr, torch.full_like(vr, 1e-8))
+    clone_mask = value >= clone_thresholds
+
+    # execute cloning as a single gather (fixed shapes, no host sync).
+    walkers = torch.arange(partners.shape[1], device=partners.device).expand(partners.shape)
+    sources = torch.where(clone_mask, partners, walkers)
+    cloned_states = torch.gather(states, 1, sources.unsqueeze(-1).expand(states.shape))
+    return cloned_states, sources
+
+
+def _search_step(
+    dynamics_function: DynamicsFunction,
+    states: torch.Tensor,
+    target_state: torch.Tensor,
+    actions: Dict[str, torch.Tensor],
+    partners: torch.Tensor,
+    clone_thresholds: torch.Tensor,
+    balance: float,
+    clone_step=_clone_step,
+):
+    """A whole perturbate + clone step of `DynamicsFMC`. All randomness is sampled by the caller, so this is
+    deterministic and can be compiled.
+    """
+
+    button_vecs, camera_vecs = vectorize_minerl_actions(actions)
+
+    flat_states = states.flatten(0, 1)
+    new_states = dynamics_function.forward(flat_states, button_vecs, camera_vecs).view(states.shape)
+    return clone_step(new_states, target_state, partners, clone_thresholds, balance)
+
+
+def compile_search_step():
+    """Compile `_search_step`. Uses `torch.compile` when available (shapes are fixed for a given number of roots and
+    walkers, so dynamic shapes are disabled). Older versions of torch only get the scoring and cloning part scripted.
+    """
+
+    if hasattr(torch, "compile"):
+        return torch.compile(_search_step, dynamic=False)
+    return functools.partial(_search_step, clone_step=torch.jit.script(_clone_step))
 
 
 
 class DynamicsFMC:
+    """FMC search through the learned dynamics function. Searches from a batch of B root state embeddings at once,
+    with walker states of shape (B, num_walkers, D). Each root has its own independent swarm (cloning only happens
+    between walkers of the same root), but all swarms share the same batched dynamics forward pass.
+
+    Buffers are reused across calls as long as the number of roots and the device stay the same, so a single
+    instance should be kept around instead of being rebuilt for every search. Keeping it around also allows warm
+    starting (receding horizon planning), see `get_batched_actions`.
+    """
 
     def __init__(
         self, 
@@ -34,6 +109,9 @@ class DynamicsFMC:
         num_walkers: int=32,
         steps: int=128,
         balance: float=1.0,
+        compile_step: bool=False,
+        refine_steps: int=None,
+        warm_start_noise: float=0.25,
     ):
         self.dynamics_function = dynamics_function
         self.action_space = action_space
@@ -43,73 +121,189 @@ class DynamicsFMC:
         self.steps = steps
         self.balance = balance
 
+        # warm started searches only take `refine_steps` steps, where each walker follows it's previous plan but
+        # resamples each action with probability `warm_start_noise` (see `get_batched_actions`).
+        self.refine_steps = refine_steps if refine_steps else max(1, steps // 4)
+        self.warm_start_noise = warm_start_noise
+        if not 0 < self.refine_steps <= steps:
+            raise ValueError(f"refine_steps must be in (0, {steps}], got {self.refine_steps}.")
+
+        # the first search with a new number of roots will be slow when compiled.
+        self.compile_step = compile_step
+        self._search_step = compile_search_step() if compile_step else _search_step
+
         self.step = None
         self.device = None
+        self.num_roots = None
         self.states = None
 
-        self.action_history = np.empty(shape=(steps, num_walkers), dtype=object)
+        self.action_sampler = BatchedActionSampler(action_space)
+
+        # columnar action history, each key maps to a tensor of shape (steps, num_roots, num_walkers, ...).
+        self.action_history = None
+
+        # true when the action history holds a finished search that can be warm started from.
+        self.has_plan = False
+
+    def _allocate(self, num_roots: int, device):
+        if self.states is not None and self.num_roots == num_roots and self.device == device:
+            return
+
+        self.has_plan = False
+
+        self.num_roots = num_roots
+        self.device = device
+
+        state_embedding_size = self.dynamics_function.state_embedding_size
+        self.states = torch.zeros((num_roots, self.num_walkers, state_embedding_size), device=device)
+
+        # every step of the history is overwritten before it's used, so it doesn't need to be reset between calls.
+        sample = self.action_sampler.sample(num_roots * self.num_walkers, device=device)
+        self.action_history = {
+            key: torch.zeros(
+                (self.steps, num_roots, self.num_walkers, *values.shape[1:]), dtype=values.dtype, device=device
+            )
+            for key, values in sample.items()
+        }
 
     def sample_actions(self):
-        raw_actions = [self.action_space.sample() for _ in range(self.num_walkers)]
+        n = self.num_roots * self.num_walkers
+        actions = self.action_sampler.sample(n, device=self.device)
 
-        self.action_history[self.step, :] = raw_actions
+        for key, values in actions.items():
+            self.action_history[key][self.step] = values.view(self.num_roots, self.num_walkers, *values.shape[1:])
 
-        button_vecs, camera_vecs = vectorize_minerl_actions(raw_actions, device=self.device)
-        return button_vecs, camera_vecs
+        return actions
 
-    def get_actions(self, state_embedding: torch.Tensor):
-        assert state_embedding.shape == (self.dynamics_function.state_embedding_size,)
+    def follow_plan_actions(self):
+        """Each walker takes the next action of it's own plan (the action history), or a newly sampled action with
+        probability `warm_start_noise`.
+        """
 
-        self.device = state_embedding.device
-        self.states = torch.zeros(
-            (self.num_walkers, self.dynamics_function.state_embedding_size),
-            device=self.device,
-        )
+        n = self.num_roots * self.num_walkers
+        sampled = self.action_sampler.sample(n, device=self.device)
+        resample = torch.rand(n, device=self.device) < self.warm_start_noise
 
-        self._simulate()
+        actions = {}
+        for key, values in sampled.items():
+            planned = self.action_history[key][self.step].flatten(0, 1)
+            mask = resample.view(n, *([1] * (values.dim() - 1)))
+            actions[key] = torch.where(mask, values, planned)
+            self.action_history[key][self.step] = actions[key].view(self.num_roots, self.num_walkers, *values.shape[1:])
 
-        scores = self._get_scores()
-        best_walker = torch.argmax(scores)
-        actions = self.action_history[:, best_walker]
         return actions
 
-    def _perturbate(self):
-        button_vecs, camera_vecs = self.sample_actions()
-        new_states = self.dynamics_function.forward(self.states, button_vecs, camera_vecs)
-        self.states = new_states
+    def _get_target_state(self):
+        target_state = self.target_state.to(self.device)
 
-    def _get_scores(self):
-        return -torch.norm(self.states[:] - self.target_state, dim=1)
+        # a target can be given per root as (B, D).
+        if target_state.dim() == 2:
+            return target_state.unsqueeze(1)
+        return target_state
 
-    def _clone(self):
-        # scores are inverse l2 distance to the target state.
-        scores = self._get_scores()
+    def get_walker_actions(self, walker_indices: torch.Tensor):
+        """Decode the action history of 1 walker per root into a (num_roots, steps) array of MineRL action dicts."""
+
+        roots = torch.arange(self.num_roots, device=self.device)
+
+        # single device -> host copy per key.
+        walker_history = {
+            key: history[:, roots, walker_indices].transpose(0, 1).reshape(self.num_roots * self.steps, *history.shape[3:]).cpu()
+            for key, history in self.action_history.items()
+        }
+
+        actions = np.empty((self.num_roots, self.steps), dtype=object)
+        for root in range(self.num_roots):
+            for step in range(self.steps):
+                actions[root, step] = BatchedActionSampler.decode(walker_history, root * self.steps + step)
+        return actions
+
+    def _shift_action_history(self, shift: int):
+        for history in self.action_history.values():
+            history[:self.steps - shift] = history[shift:].clone()
+
+    def _resample_action_history(self, start: int):
+        for step in range(start, self.steps):
+            sampled = self.action_sampler.sample(self.num_roots * self.num_walkers, device=self.device)
+            for key, values in sampled.items():
+                self.action_history[key][step] = values.view(self.num_roots, self.num_walkers, *values.shape[1:])
 
-        partners = torch.randint(low=0, high=self.num_walkers, size=(self.num_walkers,), device=self.device)
-        walker_distances = 1 - F.cosine_similarity(self.states, self.states[partners], dim=-1)
+    def get_batched_actions(self, state_embeddings: torch.Tensor, warm_start_shift: int = None):
+        """Search from each of the (B, D) root state embeddings, returns a (B, steps) array of MineRL action dicts.
 
-        rel_scores = _relativize_vector(scores)
-        rel_distances = _relativize_vector(walker_distances)
-        virtual_rewards = rel_scores ** self.balance * rel_distances
+        When `warm_start_shift` is given (the number of actions executed since the last search), the previous
+        search's walker plans are reused instead of searching from scratch: they're shifted forward by that many steps
+        (the steps shifted in at the end are sampled), and only `refine_steps` search steps are taken from the new
+        roots, with each walker following it's own plan (see `follow_plan_actions`). A walker's plan is cloned along
+        with it's state.
 
-        # calculate the clone mask
-        vr = virtual_rewards
-        pair_vr = virtual_rewards[partners]
-        value = (pair_vr - vr) / torch.where(vr > 0, vr, 1e-8)
-        clone_mask = (value >= torch.rand(1)).bool()
+        So a warm started search only costs `refine_steps` dynamics forwards (instead of `steps`), but walkers are
+        scored after `refine_steps` steps instead of at the end of the horizon, and only the first `refine_steps`
+        actions of the plan were searched from the new roots. At most that many actions should be executed before
+        searching again. Falls back to a full search if there is no previous plan to warm start from.
+        """
+
+        assert (
+            state_embeddings.dim() == 2
+            and state_embeddings.shape[-1] == self.dynamics_function.state_embedding_size
+        ), str(state_embeddings.shape)
+
+        self._allocate(len(state_embeddings), state_embeddings.device)
+        self.states.copy_(state_embeddings.unsqueeze(1).expand_as(self.states))
+
+        warm_start = warm_start_shift is not None and self.has_plan
+        if warm_start:
+            if not 0 < warm_start_shift <= self.steps:
+                raise ValueError(f"warm_start_shift must be in (0, {self.steps}], got {warm_start_shift}.")
+
+            self._shift_action_history(warm_start_shift)
+            self._resample_action_history(self.steps - warm_start_shift)
+
+        self.has_plan = False
+        self._simulate(self.refine_steps if warm_start else self.steps, follow_plan=warm_start)
+        self.has_plan = True
+
+        scores = self._get_scores()
+        best_walkers = torch.argmax(scores, dim=-1)
+        return self.get_walker_actions(best_walkers)
+
+    def get_actions(self, state_embedding: torch.Tensor, warm_start_shift: int = None):
+        assert state_embedding.shape == (self.dynamics_function.state_embedding_size,)
+        return self.get_batched_actions(state_embedding.unsqueeze(0), warm_start_shift=warm_start_shift)[0]
+
+    def _get_scores(self):
+        return -torch.norm(self.states - self._get_target_state(), dim=-1)
 
-        np_clone_mask = clone_mask.cpu().numpy()
-        np_partners = partners.cpu().numpy()
+    def _sample_clone_inputs(self):
+        partners = torch.randint(low=0, high=self.num_walkers, size=(self.num_roots, self.num_walkers), device=self.device)
+        clone_thresholds = torch.rand((self.num_roots, 1), device=self.device)
+        return partners, clone_thresholds
 
-        # execute cloning
-        self.states[clone_mask] = self.states[partners[clone_mask]]
-        self.action_history[:, np_clone_mask] = self.action_history[:, np_partners[np_clone_mask]]
+    def _clone_action_history(self, sources: torch.Tensor, num_steps: int):
+        roots = torch.arange(self.num_roots, device=self.device).unsqueeze(-1)
+        for history in self.action_history.values():
+            history[:num_steps] = history[:num_steps, roots, sources]
 
     @torch.no_grad()
-    def _simulate(self):
-        for self.step in range(self.steps):
-            self._perturbate()
-            self._clone()
+    def _simulate(self, num_steps: int, follow_plan: bool = False):
+        target_state = self._get_target_state()
+
+        for self.step in range(num_steps):
+            actions = self.follow_plan_actions() if follow_plan else self.sample_actions()
+            partners, clone_thresholds = self._sample_clone_inputs()
+
+            self.states, sources = self._search_step(
+                self.dynamics_function, 
+                self.states, 
+                target_state, 
+                actions, 
+                partners, 
+                clone_thresholds, 
+                self.balance,
+            )
+            # when following plans, the rest of the plan goes with the walker. otherwise only the steps taken so far
+            # need to be cloned, the rest will be overwritten.
+            self._clone_action_history(sources, self.steps if follow_plan else self.step + 1)
 
 
 if __name__ == "__main__":
@@ -119,4 +313,4 @@ if __name__ == "__main__":
     space = gym.make("MineRLBasaltFindCave-v0").action_space
 
     fmc = DynamicsFMC(dynamics, target_state, action_space=space, num_walkers=4, steps=16)
-    fmc.get_actions(state)
\ No newline at end of file
+    fmc.get_actions(state)
@@ -0,0 +1,97 @@
+import functools
+
+import gym
+import numpy as np
+import pytest
+import torch
+from vpt.lib.actions import Buttons
+
+from xirl_zero.architecture.dynamics_function import DynamicsFunction
+from xirl_zero.search.dynamics_fmc import DynamicsFMC, _clone_step, _search_step, compile_search_step
+
+
+EMBEDDING_SIZE = 8
+
+
+def _get_action_space():
+    spaces = {button: gym.spaces.Discrete(2) for button in Buttons.ALL}
+    spaces["camera"] = gym.spaces.Box(-180.0, 180.0, (2,))
+    return gym.spaces.Dict(spaces)
+
+
+def _get_fmc(**kwargs):
+    torch.manual_seed(0)
+    dynamics_function = DynamicsFunction(state_embedding_size=EMBEDDING_SIZE, embedder_layers=1)
+    target_state = torch.randn(EMBEDDING_SIZE)
+    return DynamicsFMC(dynamics_function, target_state, _get_action_space(), **kwargs)
+
+
+def _count_forwards(fmc: DynamicsFMC):
+    calls = []
+    forward = fmc.dynamics_function.forward
+
+    def _forward(*args, **kwargs):
+        calls.append(1)
+        return forward(*args, **kwargs)
+
+    fmc.dynamics_function.forward = _forward
+    return calls
+
+
+def _assert_valid_plan(plan: np.ndarray, num_roots: int, steps: int, action_space: gym.spaces.Dict):
+    assert plan.shape == (num_roots, steps)
+
+    for action in plan.flatten():
+        assert set(action.keys()) == set(action_space.spaces.keys())
+        for key, space in action_space.spaces.items():
+            assert space.contains(np.asarray(action[key], dtype=space.dtype))
+
+
+def test_warm_start_refines():
+    steps = 16
+    fmc = _get_fmc(num_walkers=8, steps=steps, refine_steps=4)
+    calls = _count_forwards(fmc)
+
+    num_roots = 2
+    fmc.get_batched_actions(torch.randn(num_roots, EMBEDDING_SIZE))
+    cold_forwards = len(calls)
+
+    calls.clear()
+    plan = fmc.get_batched_actions(torch.randn(num_roots, EMBEDDING_SIZE), warm_start_shift=8)
+    warm_forwards = len(calls)
+
+    assert cold_forwards == steps
+    assert warm_forwards == fmc.refine_steps < cold_forwards
+    _assert_valid_plan(plan, num_roots, steps, fmc.action_space)
+
+    # without a previous plan (different number of roots), warm starting falls back to a full search.
+    calls.clear()
+    plan = fmc.get_batched_actions(torch.randn(3, EMBEDDING_SIZE), warm_start_shift=8)
+    assert len(calls) == steps
+    _assert_valid_plan(plan, 3, steps, fmc.action_space)
+
+
+def _get_scripted_search_step():
+    # the fallback used when `torch.compile` isn't available.
+    return functools.partial(_search_step, clone_step=torch.jit.script(_clone_step))
+
+
+@pytest.mark.parametrize("get_search_step", [compile_search_step, _get_scripted_search_step])
+def test_compiled_search_step(get_search_step):
+    fmc = _get_fmc(num_walkers=8, steps=4)
+    fmc.dynamics_function.eval()
+
+    num_roots = 2
+    fmc._allocate(num_roots, torch.device("cpu"))
+    fmc.states.copy_(torch.randn((num_roots, fmc.num_walkers, EMBEDDING_SIZE)))
+    fmc.step = 0
+
+    actions = fmc.sample_actions()
+    partners, clone_thresholds = fmc._sample_clone_inputs()
+    inputs = (fmc.dynamics_function, fmc.states, fmc._get_target_state(), actions, partners, clone_thresholds, fmc.balance)
+
+    eager_states, eager_sources = _search_step(*inputs)
+    compiled_states, compiled_sources = get_search_step()(*inputs)
+
+    assert torch.equal(eager_sources, compiled_sources)
+    assert torch.allclose(eager_states, compiled_states, atol=1e-4)
@@ -0,0 +1,78 @@
+import gym
+import pytest
+import torch
+from vpt.lib.actions import Buttons
+
+from xirl_zero.architecture.dynamics_function import DynamicsFunction
+from xirl_zero.trainers.muzero_dynamics import MuZeroDynamicsConfig, MuZeroDynamicsTrainer
+
+
+EMBEDDING_SIZE = 8
+
+
+def _get_action_space():
+    spaces = {button: gym.spaces.Discrete(2) for button in Buttons.ALL}
+    spaces["camera"] = gym.spaces.Box(-180.0, 180.0, (2,))
+    return gym.spaces.Dict(spaces)
+
+
+def _get_trainer(batched_loss: bool):
+    trainer = MuZeroDynamicsTrainer(MuZeroDynamicsConfig(batched_loss=batched_loss))
+
+    torch.manual_seed(0)
+    trainer.model = DynamicsFunction(state_embedding_size=EMBEDDING_SIZE, embedder_layers=1).to(trainer.config.device)
+    return trainer
+
+
+def _get_sub_trajectory(segment_lengths, action_space: gym.spaces.Dict):
+    embedded = torch.randn((len(segment_lengths) + 1, EMBEDDING_SIZE))
+    actions = [[action_space.sample() for _ in range(length)] for length in segment_lengths]
+    return embedded, actions
+
+
+def _get_pair():
+    torch.manual_seed(1)
+    action_space = _get_action_space()
+    action_space.seed(1)
+
+    # ragged segments, including an empty one (2 sampled frames without actions in between).
+    t0, a0 = _get_sub_trajectory([3, 1, 0, 5], action_space)
+    t1, a1 = _get_sub_trajectory([2, 4], action_space)
+    return t0, a0, t1, a1
+
+
+def test_batched_loss_matches_loop():
+    trainer = _get_trainer(batched_loss=True)
+    t0, a0, t1, a1 = _get_pair()
+
+    losses = trainer.calculate_batched_loss((t0, t1), (a0, a1))
+    expected_losses = torch.stack([trainer.calculate_loss(t0, a0), trainer.calculate_loss(t1, a1)])
+
+    assert losses.shape == (2,)
+    assert torch.allclose(losses, expected_losses, rtol=1e-5, atol=1e-7)
+
+
+@pytest.mark.parametrize("segment_lengths", [[0], [0, 0]])
+def test_batched_loss_empty_segments(segment_lengths):
+    trainer = _get_trainer(batched_loss=True)
+
+    torch.manual_seed(2)
+    t, a = _get_sub_trajectory(segment_lengths, _get_action_space())
+
+    losses = trainer.calculate_batched_loss((t,), (a,))
+    assert torch.equal(losses, torch.zeros(1))
+    assert trainer.calculate_loss(t, a) == 0
+
+
+def test_batched_loss_gradients_match_loop():
+    t0, a0, t1, a1 = _get_pair()
+
+    gradients = []
+    for batched_loss in (True, False):
+        trainer = _get_trainer(batched_loss)
+        trainer.model.zero_grad()
+        trainer._calculate_pair_loss(t0, a0, t1, a1).backward()
+        gradients.append([p.grad for p in trainer.model.parameters()])
+
+    for grad, expected_grad in zip(*gradients):
+        assert torch.allclose(grad, expected_grad, rtol=1e-4, atol=1e-6)
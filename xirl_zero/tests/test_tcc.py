@@ -0,0 +1,105 @@
+import pytest
+import torch
+import torch.nn.functional as F
+
+from fgz.architecture.tcc import cycle_back
+from xirl_zero.trainers.tcc_representation import TCCConfig, TCCRepresentationTrainer
+
+
+EMBEDDING_SIZE = 16
+
+
+def _looped_soft_nearest_neighbor(frame_embedding, other_embeddings, temperature: float):
+    expanded_frame_embedding = frame_embedding.expand(len(other_embeddings), -1)
+    similarity = -torch.norm(expanded_frame_embedding - other_embeddings, dim=1)
+    similarity /= temperature
+    return torch.softmax(similarity, dim=0)
+
+
+def _looped_cycle_back(embedded_chosen_frames, embedded_t0, embedded_t1, temperature: float):
+    """The original per-frame implementation (frame indices kept in the embedding dtype, so float64 stays float64)."""
+
+    index_preds = []
+    index_logits = []
+
+    for ui in embedded_chosen_frames:
+        alpha_k = _looped_soft_nearest_neighbor(ui, embedded_t1, temperature)
+        v_squiggly = torch.sum(alpha_k.unsqueeze(-1) * embedded_t1, dim=0)
+
+        beta = _looped_soft_nearest_neighbor(v_squiggly, embedded_t0, temperature)
+
+        frame_mult = torch.arange(start=1, end=len(beta) + 1, dtype=beta.dtype, device=beta.device)
+        mu = torch.matmul(frame_mult, beta)
+
+        index_preds.append(mu)
+        index_logits.append(beta)
+
+    return torch.stack(index_preds), torch.stack(index_logits)
+
+
+def _looped_stats(embedded_t0, embedded_t1, chosen_frame_indices, embedded_chosen_frames, temperature: float):
+    max_index = len(embedded_t0)
+
+    index_preds, index_logits = _looped_cycle_back(embedded_chosen_frames, embedded_t0, embedded_t1, temperature)
+    cross_entropy_labels = chosen_frame_indices.long()
+
+    correct = (index_logits.argmax(-1).long() == cross_entropy_labels).sum()
+
+    return {
+        "normalized_mse": F.mse_loss(index_preds / max_index, chosen_frame_indices / max_index),
+        "unnormalized_mse": F.mse_loss(index_preds, chosen_frame_indices),
+        "cross_entropy": F.cross_entropy(index_logits, cross_entropy_labels),
+        "index_accuracy": correct / len(chosen_frame_indices),
+    }
+
+
+def _get_trainer(batch_size: int, temperature: float):
+    # only the config is needed to calculate the loss, skip loading the VPT model.
+    trainer = TCCRepresentationTrainer.__new__(TCCRepresentationTrainer)
+    trainer.config = TCCConfig(batch_size=batch_size, temperature=temperature)
+    return trainer
+
+
+def _get_embeddings(len_t0: int, len_t1: int, batch_size: int):
+    torch.manual_seed(0)
+    embedded_t0 = torch.randn((len_t0, EMBEDDING_SIZE), dtype=torch.float64)
+    embedded_t1 = torch.randn((len_t1, EMBEDDING_SIZE), dtype=torch.float64)
+    chosen_frame_indices = torch.randint(low=0, high=len_t0, size=(batch_size,))
+    return embedded_t0, embedded_t1, chosen_frame_indices
+
+
+@pytest.mark.parametrize("temperature", [0.1, 1.0])
+def test_cycle_back_matches_loop(temperature: float):
+    embedded_t0, embedded_t1, chosen_frame_indices = _get_embeddings(24, 31, 8)
+    embedded_chosen_frames = embedded_t0[chosen_frame_indices]
+
+    mu, beta = cycle_back(embedded_chosen_frames, embedded_t0, embedded_t1, temperature)
+    expected_mu, expected_beta = _looped_cycle_back(embedded_chosen_frames, embedded_t0, embedded_t1, temperature)
+
+    assert mu.dtype == beta.dtype == torch.float64
+    assert torch.allclose(mu, expected_mu, rtol=0, atol=1e-12)
+    assert torch.allclose(beta, expected_beta, rtol=0, atol=1e-14)
+
+
+@pytest.mark.parametrize("temperature", [0.1, 1.0])
+def test_tcc_stats_match_loop(temperature: float):
+    batch_size = 8
+    trainer = _get_trainer(batch_size, temperature)
+    embedded_t0, embedded_t1, chosen_frame_indices = _get_embeddings(24, 31, batch_size)
+
+    chosen = embedded_t0[chosen_frame_indices].clone().requires_grad_()
+    stats = trainer._calculate_temporal_cycle_consistency(embedded_t0, embedded_t1, chosen_frame_indices, chosen)
+
+    expected_chosen = embedded_t0[chosen_frame_indices].clone().requires_grad_()
+    expected_stats = _looped_stats(embedded_t0, embedded_t1, chosen_frame_indices, expected_chosen, temperature)
+
+    assert stats.keys() == expected_stats.keys()
+    assert torch.equal(stats["index_accuracy"], expected_stats["index_accuracy"])
+    for key in ("normalized_mse", "unnormalized_mse", "cross_entropy"):
+        assert torch.allclose(stats[key], expected_stats[key], rtol=1e-12, atol=1e-14), key
+
+    # the gradients into the chosen frames (the only ones embedded with gradients) must match too.
+    for key in ("normalized_mse", "cross_entropy"):
+        grad, = torch.autograd.grad(stats[key], chosen, retain_graph=True)
+        expected_grad, = torch.autograd.grad(expected_stats[key], expected_chosen, retain_graph=True)
+        assert torch.allclose(grad, expected_grad, rtol=1e-10, atol=1e-12), key
@@ -4,12 +4,15 @@ from typing import Sequence
 import torch
 import torch.nn.functional as F
 
-from xirl_zero.architecture.dynamics_function import DynamicsFunction
+from xirl_zero.architecture.dynamics_function import DynamicsFunction, vectorize_action_segments
 
 
 @dataclass
 class MuZeroDynamicsConfig:
 
+    # unroll all segments of both trajectories in parallel (instead of 1 action at a time).
+    batched_loss: bool = True
+
     device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
 
 
@@ -48,11 +51,69 @@ class MuZeroDynamicsTrainer:
             for action in actions_between:
                 embedding = self.model.forward_action(embedding, action)
                 between_loss += F.mse_loss(embedding, target_embedding)
-            total_loss += between_loss / len(actions_between)
+            # empty segments (no actions between the frames) don't contribute.
+            total_loss += between_loss / max(len(actions_between), 1)
 
         loss = total_loss / num_sub_frames
         return loss
 
+    def calculate_batched_loss(
+        self,
+        embedded_sub_trajectories: Sequence[torch.Tensor],
+        actions_preceeding_each_timestep: Sequence[Sequence],
+    ):
+        """Same losses as `calculate_loss` (1 per trajectory), but the segments between every pair of sampled frames
+        from all trajectories are unrolled in parallel. The actions are vectorized once into padded tensors, and padded
+        steps leave the state untouched and are masked out of the loss.
+        """
+
+        device = self.config.device
+
+        start_embeddings = []
+        target_embeddings = []
+        segments = []
+        segment_owners = []
+        for i, (embedded_sub_trajectory, actions) in enumerate(zip(embedded_sub_trajectories, actions_preceeding_each_timestep)):
+            num_sub_frames = len(embedded_sub_trajectory)
+            assert num_sub_frames - 1 == len(actions), f"{embedded_sub_trajectory.shape} and {len(actions)}"
+
+            # TODO: there are many variations to how the target embedding can be determined.
+            start_embeddings.append(embedded_sub_trajectory[:-1])
+            target_embeddings.append(embedded_sub_trajectory[1:])
+            segments.extend(actions)
+            segment_owners.extend([i] * len(actions))
+
+        embedding = torch.cat(start_embeddings).to(device)
+        target_embedding = torch.cat(target_embeddings).to(device)
+        segment_owners = torch.tensor(segment_owners, device=device)
+
+        buttons, camera, mask = vectorize_action_segments(segments, device=device)
+
+        # teacher-forced unroll, 1 step at a time for all segments.
+        unrolled = []
+        for step in range(mask.shape[1]):
+            new_embedding = self.model.forward(embedding, buttons[:, step], camera[:, step])
+            embedding = torch.where(mask[:, step].unsqueeze(-1), new_embedding, embedding)
+            unrolled.append(embedding)
+        # when every segment is empty there's nothing to unroll, (segments, 0, embedding size).
+        unrolled = torch.stack(unrolled, dim=1) if unrolled else embedding.unsqueeze(1)[:, :0]
+
+        # masked mse, averaged over the actions in each segment.
+        step_losses = ((unrolled - target_embedding.unsqueeze(1)) ** 2).mean(dim=-1) * mask
+        segment_losses = step_losses.sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+
+        losses = torch.zeros(len(embedded_sub_trajectories), device=device).index_add(0, segment_owners, segment_losses)
+        num_sub_frames = torch.tensor([len(t) for t in embedded_sub_trajectories], device=device)
+        return losses / num_sub_frames
+
+    def _calculate_pair_loss(self, t0: torch.Tensor, a0: Sequence, t1: torch.Tensor, a1: Sequence):
+        if self.config.batched_loss:
+            loss0, loss1 = self.calculate_batched_loss((t0, t1), (a0, a1))
+        else:
+            loss0 = self.calculate_loss(t0, a0)
+            loss1 = self.calculate_loss(t1, a1)
+        return (loss0 + loss1) / 2
+
     def train_step(
         self, 
         t0: torch.Tensor, 
@@ -67,9 +128,7 @@ class MuZeroDynamicsTrainer:
         self.model.train()
         self.optimizer.zero_grad()
 
-        loss0 = self.calculate_loss(t0, a0)
-        loss1 = self.calculate_loss(t1, a1)
-        loss = (loss0 + loss1) / 2
+        loss = self._calculate_pair_loss(t0, a0, t1, a1)
         loss.backward()
 
         self.optimizer.step()
@@ -88,9 +147,7 @@ class MuZeroDynamicsTrainer:
 
         self.model.eval()
 
-        loss0 = self.calculate_loss(t0, a0)
-        loss1 = self.calculate_loss(t1, a1)
-        loss = (loss0 + loss1) / 2
+        loss = self._calculate_pair_loss(t0, a0, t1, a1)
 
         return {
             "loss": loss,
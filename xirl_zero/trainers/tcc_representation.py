@@ -6,6 +6,7 @@ import torch.nn.functional as F
 
 import os
 
+from fgz.architecture.tcc import cycle_back
 from fgz.architecture.xirl_model import XIRLModel
 from fgz.data_utils.data_handler import ContiguousTrajectoryDataLoader
 from fgz.data_utils.generate_xirl_targets import generate_target
@@ -51,28 +52,20 @@ class TCCConfig:
 
 class TCCRepresentationTrainer:
 
-    def __init__(self, config: TCCConfig):
+    def __init__(self, config: TCCConfig, from_features: bool = False):
         self.config = config
 
+        # when true, the inputs are the model's frozen prefix features (see `fgz/data_utils/feature_cache.py`).
+        self.from_features = from_features
+
         self.model = XIRLModel(self.config, config.device)
         self.optimizer = torch.optim.Adam(self.model.parameters(), lr=config.learning_rate, weight_decay=0, betas=(0.9, 0.999))
         # self.optimizer = torch.optim.Adam(self.model.parameters(), lr=config.learning_rate, weight_decay=1e-5, betas=(0.99, 0.999))
 
-    def soft_nearest_neighbor(
-        self, frame_embedding: torch.Tensor,
-        other_embeddings: List[torch.Tensor],
-    ):
-        expanded_frame_embedding = frame_embedding.expand(
-            len(other_embeddings), -1
-        )
-
-        # l2 similarity
-        similarity = -torch.norm(expanded_frame_embedding - other_embeddings, dim=1)
-        similarity /= self.config.temperature
-
-        alpha_k = torch.softmax(similarity, dim=0)
-
-        return alpha_k
+    def embed(self, x: torch.Tensor):
+        if self.from_features:
+            return self.model.embed_features(x)
+        return self.model.embed(x)
 
     def embed_trajectory(self, t: torch.Tensor):
         embedded = torch.zeros(size=(len(t), 2048), device=self.config.device, dtype=float)
@@ -83,7 +76,7 @@ class TCCRepresentationTrainer:
         while i < len(t):
             x = t[i:i+bs]
             batch = x.to(self.config.device)
-            embedded[i:i+bs] = self.model.embed(batch)
+            embedded[i:i+bs] = self.embed(batch)
 
             i += len(x)
 
@@ -97,39 +90,14 @@ class TCCRepresentationTrainer:
         embedded_chosen_frames: torch.Tensor,    
     ):
 
-        # TODO: vectorize better
-
         bs = self.config.batch_size
         assert len(chosen_frame_indices) == len(embedded_chosen_frames) == bs
 
         max_index = len(embedded_t0)
 
-        index_preds = []
-        index_logits = []
-
-        for i in range(bs):
-            ui = embedded_chosen_frames[i]
-
-            # calculate cycle MSE loss
-            alpha_k = self.soft_nearest_neighbor(
-                ui, embedded_t1
-            )
-            v_squiggly = torch.sum(alpha_k.unsqueeze(-1) * embedded_t1, dim=0)
-
-            beta = self.soft_nearest_neighbor(
-                v_squiggly, embedded_t0
-            )
-
-            frame_mult = torch.arange(
-                start=1, end=len(beta) + 1, dtype=float, device=beta.device
-            ).float()# / len(beta)
-            mu = torch.matmul(frame_mult, beta) # / len(beta)
-
-            index_preds.append(mu)
-            index_logits.append(beta)
-
-        index_preds = torch.stack(index_preds)
-        index_logits = torch.stack(index_logits)
+        index_preds, index_logits = cycle_back(
+            embedded_chosen_frames, embedded_t0, embedded_t1, temperature=self.config.temperature,
+        )
         cross_entropy_labels = chosen_frame_indices.long()
 
         correct = (index_logits.argmax(-1).long() == cross_entropy_labels).sum()
@@ -159,7 +127,7 @@ class TCCRepresentationTrainer:
 
         if with_gradient:
             # embed chosen frames again, but this time with gradients
-            embedded_chosen_frames = self.model.embed(t0[chosen_frame_indices].to(self.config.device))
+            embedded_chosen_frames = self.embed(t0[chosen_frame_indices].to(self.config.device))
         else:
             # don't embed again, no need to calculate gradients
             embedded_chosen_frames = embedded_t0[chosen_frame_indices]